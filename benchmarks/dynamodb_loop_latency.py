@@ -0,0 +1,102 @@
+"""
+Benchmark of the event-loop latency while registering servers in DynamoDB.
+
+Runs a batch of concurrent registrations, while a ticker measures how late
+the event loop wakes it up. This is done once with the database calls made
+directly on the event loop (as it used to be) and once via the thread pool.
+
+This needs a DynamoDB endpoint, for example a local DynamoDB or moto_server.
+
+Run with: python -m benchmarks.dynamodb_loop_latency [endpoint]
+"""
+
+import asyncio
+import ipaddress
+import os
+import sys
+import time
+import uuid
+
+from master_server.database.dynamodb import Database
+
+TICK = 0.01
+REGISTRATIONS = 200
+
+
+def build_info(name):
+    return {
+        "newgrfs": [{"grfid": i, "md5sum": "00" * 16} for i in range(5)],
+        "game_date": 10,
+        "start_date": 5,
+        "companies_max": 15,
+        "companies_on": 1,
+        "spectators_max": 10,
+        "name": name,
+        "openttd_version": "1.10.0",
+        "use_password": 0,
+        "clients_max": 25,
+        "clients_on": 1,
+        "spectators_on": 0,
+        "map_width": 256,
+        "map_height": 256,
+        "map_type": 1,
+        "is_dedicated": 1,
+    }
+
+
+async def ticker(lags, done):
+    loop = asyncio.get_running_loop()
+    while not done.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - start - TICK)
+
+
+async def register(db, index, blocking):
+    session_key = (index + 1) << 24
+    server_ip = ipaddress.IPv4Address(0xC0000200 + index)
+    info = build_info(f"server {index}")
+
+    if blocking:
+        db._store_session_key_token(session_key, 1)
+        db._server_online(session_key, server_ip, 3979, info)
+    else:
+        await db.store_session_key_token(session_key, 1)
+        await db.server_online(session_key, server_ip, 3979, info)
+
+
+async def run(db, blocking):
+    lags = []
+    done = asyncio.Event()
+    ticker_task = asyncio.ensure_future(ticker(lags, done))
+
+    start = time.monotonic()
+    await asyncio.gather(*[register(db, index, blocking) for index in range(REGISTRATIONS)])
+    duration = time.monotonic() - start
+
+    done.set()
+    await ticker_task
+
+    lags.sort()
+    return duration, lags[len(lags) // 2], lags[-1]
+
+
+async def main(endpoint):
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+
+    Database.host = endpoint
+    Database.region = "us-east-1"
+    Database.table_prefix = f"benchmark-{uuid.uuid4().hex[:8]}-"
+    db = Database()
+
+    for name, blocking in (("on event loop", True), ("thread pool", False)):
+        duration, median, worst = await run(db, blocking)
+        print(
+            f"{name:13s}: {REGISTRATIONS} registrations in {duration:6.2f}s, "
+            f"loop lag median {median * 1000:7.1f}ms, worst {worst * 1000:7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8000"))
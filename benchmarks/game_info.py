@@ -0,0 +1,159 @@
+"""
+Benchmark of the SERVER_RESPONSE (GameInfo) decoder.
+
+Compares the schema-driven decoder against the original hand-written chain
+of single-field reads, which is kept here as reference.
+
+Run with: python -m benchmarks.game_info
+"""
+
+import struct
+import timeit
+
+from master_server.openttd.protocol.enums import PacketUDPType
+from master_server.openttd.protocol.exceptions import PacketInvalidData
+from master_server.openttd.protocol.game_info import DAYS_TILL_ORIGINAL_BASE_YEAR
+from master_server.openttd.protocol.write import PacketWriter
+from master_server.openttd.receive import OpenTTDProtocolReceive
+
+
+def _read(data, fmt):
+    size = struct.calcsize(fmt)
+    if len(data) < size:
+        raise PacketInvalidData("packet too short")
+    return struct.unpack(fmt, data[0:size])[0], data[size:]
+
+
+def _read_string(data):
+    value = b""
+    while data[0:1] != b"\x00":
+        if len(data) < 1:
+            raise PacketInvalidData("packet too short")
+        value += data[0:1]
+        data = data[1:]
+    return value.decode(), data[1:]
+
+
+def legacy_receive_PACKET_UDP_SERVER_RESPONSE(data):
+    payload = {
+        name: None
+        for name in [
+            "gamescript_version",
+            "gamescript_name",
+            "newgrfs",
+            "game_date",
+            "start_date",
+            "companies_max",
+            "companies_on",
+            "spectators_max",
+            "name",
+            "openttd_version",
+            "use_password",
+            "clients_max",
+            "clients_on",
+            "spectators_on",
+            "map_width",
+            "map_height",
+            "map_type",
+            "is_dedicated",
+            "ticks_playing",
+        ]
+    }
+
+    game_info_version, data = _read(data, "<B")
+
+    if game_info_version >= 4:
+        newgrf_count, data = _read(data, "<B")
+        payload["newgrfs"] = []
+        for _ in range(newgrf_count):
+            grfid, data = _read(data, "<I")
+            md5sum, data = data[0:16], data[16:]
+            payload["newgrfs"].append({"grfid": grfid, "md5sum": md5sum.hex(), "name": None})
+
+    if game_info_version >= 3:
+        payload["game_date"], data = _read(data, "<I")
+        payload["start_date"], data = _read(data, "<I")
+
+    if game_info_version >= 2:
+        payload["companies_max"], data = _read(data, "<B")
+        payload["companies_on"], data = _read(data, "<B")
+        payload["spectators_max"], data = _read(data, "<B")
+
+    if game_info_version >= 1:
+        payload["name"], data = _read_string(data)
+        payload["openttd_version"], data = _read_string(data)
+        _, data = _read(data, "<B")
+        payload["use_password"], data = _read(data, "<B")
+        payload["clients_max"], data = _read(data, "<B")
+        payload["clients_on"], data = _read(data, "<B")
+        payload["spectators_on"], data = _read(data, "<B")
+        if game_info_version < 3:
+            payload["game_date"], data = _read(data, "<H")
+            payload["game_date"] += DAYS_TILL_ORIGINAL_BASE_YEAR
+            payload["start_date"], data = _read(data, "<H")
+            payload["start_date"] += DAYS_TILL_ORIGINAL_BASE_YEAR
+        _, data = _read_string(data)
+        payload["map_width"], data = _read(data, "<H")
+        payload["map_height"], data = _read(data, "<H")
+        payload["map_type"], data = _read(data, "<B")
+        payload["is_dedicated"], data = _read(data, "<B")
+
+    payload["ticks_playing"] = max(0, (payload["game_date"] - payload["start_date"]) * 74)
+
+    if len(data) != 0:
+        raise PacketInvalidData("more bytes than expected")
+
+    return payload
+
+
+def build_game_info(newgrf_count, name_length):
+    # The header is stripped; the decoders get the packet body.
+    packet = PacketWriter(PacketUDPType.PACKET_UDP_SERVER_RESPONSE)
+    packet.write_uint8(4)
+    packet.write_uint8(newgrf_count)
+    for i in range(newgrf_count):
+        packet.write_uint32(0x4D470000 + i)
+        packet.write_bytes(bytes(range(i, i + 16)))
+    packet.write_uint32(730000)
+    packet.write_uint32(720000)
+    packet.write_uint8(15)
+    packet.write_uint8(3)
+    packet.write_uint8(10)
+    packet.write_string("S" * name_length)
+    packet.write_string("14.1")
+    packet.write_uint8(0)
+    packet.write_uint8(0)
+    packet.write_uint8(25)
+    packet.write_uint8(4)
+    packet.write_uint8(0)
+    packet.write_string("")
+    packet.write_uint16(512)
+    packet.write_uint16(256)
+    packet.write_uint8(1)
+    packet.write_uint8(1)
+    return bytes(packet.finish()[3:])
+
+
+def main():
+    number = 20000
+
+    for newgrf_count, name_length in ((0, 20), (10, 40), (50, 80)):
+        data = build_game_info(newgrf_count, name_length)
+        assert OpenTTDProtocolReceive.receive_PACKET_UDP_SERVER_RESPONSE(
+            None, data
+        ) == legacy_receive_PACKET_UDP_SERVER_RESPONSE(data)
+
+        legacy = timeit.timeit(lambda: legacy_receive_PACKET_UDP_SERVER_RESPONSE(data), number=number)
+        current = timeit.timeit(
+            lambda: OpenTTDProtocolReceive.receive_PACKET_UDP_SERVER_RESPONSE(None, data), number=number
+        )
+
+        print(
+            f"{newgrf_count:3d} NewGRFs, name of {name_length:3d} chars ({len(data):4d} bytes): "
+            f"legacy {legacy / number * 1e6:7.2f}us, schema {current / number * 1e6:7.2f}us "
+            f"({legacy / current:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
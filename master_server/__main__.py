@@ -5,8 +5,15 @@ from openttd_helpers import click_helper
 from openttd_helpers.logging_helper import click_logging
 from openttd_helpers.sentry_helper import click_sentry
 
+from . import workers as workers_helper
+from .application.master_server_query import click_server_query
+from .application.session_key import click_session_key
+
 from .database.dynamodb import click_database_dynamodb
+from .database.memory import click_database_memory
 from .database.redis import click_database_redis
+from .database.sqlite import click_database_sqlite
+from .openttd.packet_queue import click_packet_queue
 from .openttd.udp import click_proxy_protocol
 
 log = logging.getLogger(__name__)
@@ -20,6 +27,14 @@ log = logging.getLogger(__name__)
 )
 @click.option("--msu-port", help="Port of the MSU server", default=3978, show_default=True, metavar="PORT")
 @click.option("--web-port", help="Port of the web server.", default=80, show_default=True, metavar="PORT")
+@click.option(
+    "--workers",
+    help="Amount of worker processes; they all listen on the same ports, and the kernel spreads the load.",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    metavar="COUNT",
+)
 @click.option(
     "--app",
     type=click.Choice(["master_server", "web_api"], case_sensitive=False),
@@ -28,14 +43,23 @@ log = logging.getLogger(__name__)
 )
 @click.option(
     "--db",
-    type=click.Choice(["dynamodb", "redis"], case_sensitive=False),
+    type=click.Choice(["dynamodb", "memory", "redis", "sqlite"], case_sensitive=False),
     required=True,
     callback=click_helper.import_module("master_server.database", "Database"),
 )
 @click_database_dynamodb
+@click_database_memory
 @click_database_redis
+@click_database_sqlite
 @click_proxy_protocol
-def main(bind, msu_port, web_port, app, db):
+@click_packet_queue
+@click_server_query
+@click_session_key
+def main(bind, msu_port, web_port, workers, app, db):
+    # Fork before anything creates connections, as those cannot be shared
+    # between processes.
+    workers_helper.fork_workers(workers)
+
     database = db()
     application = app(database)
     application.run(bind, msu_port, web_port)
@@ -1,14 +1,26 @@
 import asyncio
 import logging
+import os
 import random
+import socket
 import time
 
 from aiohttp import web
 from aiohttp.web_log import AccessLogger
 
 from .master_server_query import Common
+from .session_key import (
+    check_session_key,
+    is_session_key_expired,
+    is_signing_enabled,
+    sign_session_key,
+)
+from .. import workers
 from ..openttd import udp
+from ..openttd.packet_queue import PacketQueue
+from ..openttd.rate_limit import RateLimiter
 from ..openttd.protocol.enums import SLTType
+from ..openttd.send import OpenTTDProtocolSend
 from ..openttd.protocol.write import SAFE_MTU
 
 log = logging.getLogger(__name__)
@@ -37,6 +49,11 @@ async def healthz_handler(request):
     return web.HTTPOk()
 
 
+@routes.get("/metrics")
+async def metrics_handler(request):
+    return web.Response(text="".join(f"{line}\n" for line in request.app.application.get_metrics()))
+
+
 @routes.route("*", "/{tail:.*}")
 async def fallback(request):
     log.warning("Unexpected URL: %s", request.url)
@@ -53,14 +70,35 @@ class ErrorOnlyAccessLogger(AccessLogger):
 async def run_server(application, bind, port):
     loop = asyncio.get_event_loop()
 
+    # All sockets share the same queue, so the amount of packets processed
+    # concurrently is limited for the whole application.
+    application.packet_queue.start()
+
     transports = []
     for bind in bind:
-        transport, _ = await loop.create_datagram_endpoint(
-            lambda: udp.OpenTTDProtocolUDP(application), local_addr=(bind, port), reuse_port=True
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: udp.OpenTTDProtocolUDP(application, application.packet_queue, application.rate_limiter),
+            local_addr=(bind, port),
+            reuse_port=True,
         )
         transports.append(transport)
         log.info(f"Listening on {bind}:{port} ...")
 
+        if workers.worker_count > 1:
+            # With multiple workers, the kernel picks the worker based on the
+            # source of a packet. The answer to a query comes from another
+            # port than the registration did, so it would most likely end up
+            # at a worker not expecting it. Instead, every worker sends its
+            # queries from its own socket, where the answers will arrive too.
+            # These answers come directly from the server; never via a proxy.
+            query_transport, query_protocol = await loop.create_datagram_endpoint(
+                lambda: udp.OpenTTDProtocolUDP(application, application.packet_queue, application.rate_limiter),
+                local_addr=(bind, 0),
+            )
+            query_protocol.proxy_protocol = False
+            protocol.query_protocol = query_protocol
+            transports.append(query_transport)
+
     return transports
 
 
@@ -70,8 +108,11 @@ class Application(Common):
 
         self.database = database
         self.protocol = None
+        self.packet_queue = PacketQueue()
+        self.rate_limiter = RateLimiter()
 
         self._session_counter = random.randrange(0, 256 * 256)
+        self._lease_owner = f"{socket.gethostname()}:{os.getpid()}"
         self._servers_cache = {
             SLTType.SLT_IPv4: None,
             SLTType.SLT_IPv6: None,
@@ -84,13 +125,31 @@ class Application(Common):
         loop.run_until_complete(run_server(self, bind, msu_port))
 
         webapp = web.Application()
+        webapp.application = self
         webapp.add_routes(routes)
 
-        web.run_app(webapp, host=bind, port=web_port, access_log_class=ErrorOnlyAccessLogger, loop=loop)
+        web.run_app(
+            webapp,
+            host=bind,
+            port=web_port,
+            access_log_class=ErrorOnlyAccessLogger,
+            loop=loop,
+            reuse_port=workers.worker_count > 1,
+        )
 
         log.info("Shutting down master server ...")
 
+    def get_metrics(self):
+        yield from self.packet_queue.get_metrics()
+        yield from self.rate_limiter.get_metrics()
+        yield from self.get_query_metrics()
+
     async def check_stale_servers(self):
+        # The check is for the whole database, so with multiple workers only
+        # the first one has to do it.
+        if workers.worker_index != 0:
+            return
+
         # Randomly sleep a bit at startup. Multiple instances of this server
         # are most likely started are roughly the same time, causing stress
         # on the database server. By randomly sleeping for a bit there is
@@ -103,7 +162,10 @@ class Application(Common):
             # As we are in a task, we need to explicitly log the exception,
             # otherwise it won't show up in the logs in a sane matter.
             try:
-                self.database.check_stale_servers()
+                # Only one instance has to do the check. The lease outlives
+                # the interval, so whoever has the lease keeps it.
+                if await self.database.acquire_lease("stale-check", self._lease_owner, TIME_BETWEEN_STALE_CHECK * 2):
+                    await self.database.check_stale_servers()
             except Exception:
                 log.exception("Exception during check on stale servers")
                 return
@@ -113,12 +175,16 @@ class Application(Common):
         #           |--------|--------|--------|--------|--------|--------|--------|--------|
         # Version 1 |     unused      |      port       |                ip                 |
         # Version 2 | unused |               time                |     counter     | token  |
+        # (for signed session-keys, see session_key.py)
 
         # Add some random values to the counter, making it hard to guess the
         # next value. This avoids collisions if multiple servers register at
         # the same time.
+        # With multiple workers, each worker uses its own slice of the
+        # counter, so they never hand out the same session-key.
         self._session_counter += random.randrange(1, 16)
-        self._session_counter &= 0xFFFF
+        self._session_counter %= 0x10000 // workers.worker_count
+        counter = self._session_counter * workers.worker_count + workers.worker_index
 
         # The session key includes a token, to avoid people guessing the
         # session_key of others.
@@ -126,7 +192,12 @@ class Application(Common):
 
         # Session-key is the current server time combined with the counter
         # and token.
-        session_key = (int(time.time()) << 24) | (self._session_counter << 8)
+        session_key = (int(time.time()) << 24) | (counter << 8)
+
+        # Signed session-keys don't need to be stored; they can be
+        # validated without the database.
+        if is_signing_enabled():
+            return sign_session_key(session_key)
 
         await self.database.store_session_key_token(session_key, token)
         return session_key, token
@@ -158,11 +229,31 @@ class Application(Common):
             token = session_key & 0xFF
             session_key = (session_key >> 8) << 8
 
-            if not await self.database.check_session_key_token(session_key, token):
-                log.info("Invalid session-key token from %s:%d; transmitting new session-key", source.ip, source.port)
-
-                # TODO -- If an IP has this wrong for more than 3 times, it is
-                # time to put that IP on a ban-list for a bit of time.
+            # None means the session-key is unknown, or expired.
+            valid = check_session_key(session_key, token)
+            if valid is None:
+                valid = await self.database.check_session_key_token(session_key, token)
+            elif (
+                valid
+                and is_session_key_expired(session_key)
+                and not await self.database.check_session_key_in_use(session_key)
+            ):
+                valid = None
+
+            if not valid:
+                if valid is None:
+                    # The server has not been around for a while; this is
+                    # not something it did wrong, so no strike.
+                    log.info("Expired session-key from %s:%d; transmitting new session-key", source.ip, source.port)
+                else:
+                    log.info(
+                        "Invalid session-key token from %s:%d; transmitting new session-key", source.ip, source.port
+                    )
+
+                    # The token doesn't belong to this session-key, so it
+                    # was guessed. If an IP does this too often, it is put
+                    # on a ban-list for a bit of time.
+                    self.rate_limiter.strike(source.ip)
 
                 # Send the server a new session-key, as clearly he got a bit
                 # confused.
@@ -175,7 +266,9 @@ class Application(Common):
         #
         # Save the original addr for after we queried the server (user_data);
         # once we know the server is reachable, we will inform the server over
-        # this addr that it is registered.
+        # this addr that it is registered. This has to be sent via the socket
+        # the registration came in on (and not the one the query was sent
+        # from), as otherwise NATs can drop it, or it bypasses the proxy.
         # The flow is like this:
         # - random UDP port (source.addr) asks us to register a given server
         #   port.
@@ -185,13 +278,15 @@ class Application(Common):
         # ('random UDP port' in this context means one that is auto-assigned
         #  by the TCP/IP stack on the server side; it is not sent via the
         #  server UDP port).
-        self.query_server(source.ip, port, source.protocol, user_data=(session_key, source.addr))
+        self.query_server(
+            source.ip, port, source.protocol.query_protocol, user_data=(session_key, source.protocol, source.addr)
+        )
 
     async def receive_PACKET_UDP_SERVER_RESPONSE(self, source, **info):
         response = self.query_server_response(source.ip, source.port)
         if response is None:
             return
-        session_key, register_addr = response
+        session_key, register_protocol, register_addr = response
 
         # If the server-name is blacklisted, don't mark it as online but send
         # an ack to the server acting as if we did mark it online. This makes
@@ -208,7 +303,7 @@ class Application(Common):
                 return
 
         # Inform the server that he is now registered.
-        source.protocol.send_PACKET_UDP_MASTER_ACK_REGISTER(register_addr)
+        register_protocol.send_PACKET_UDP_MASTER_ACK_REGISTER(register_addr)
 
     async def receive_PACKET_UDP_SERVER_UNREGISTER(self, source, port):
         await self.database.server_offline(source.ip, port)
@@ -218,13 +313,18 @@ class Application(Common):
         if self._servers_cache[slt] is None or time.time() > self._servers_cache[slt]["expire"]:
             servers = await self.database.get_server_list_for_client(slt == SLTType.SLT_IPv6)
 
+            # Encode the packets once; every client asking for the list in
+            # the next SERVERS_CACHE_EXPIRE seconds gets the exact same bytes.
+            # Split the servers in packets that fit within the SAFE_MTU.
+            packets = []
+            for i in range(0, len(servers), MAX_COUNT[slt]):
+                server_slice = servers[i : i + MAX_COUNT[slt]]
+                packets.append(OpenTTDProtocolSend.encode_PACKET_UDP_MASTER_RESPONSE_LIST(slt, server_slice))
+
             self._servers_cache[slt] = {
-                "servers": servers,
+                "packets": packets,
                 "expire": time.time() + SERVERS_CACHE_EXPIRE,
             }
 
-        # Send the servers in packets that fit within the SAFE_MTU.
-        servers = self._servers_cache[slt]["servers"]
-        for i in range(0, len(servers), MAX_COUNT[slt]):
-            server_slice = servers[i : i + MAX_COUNT[slt]]
-            source.protocol.send_PACKET_UDP_MASTER_RESPONSE_LIST(source.addr, slt, server_slice)
+        for packet in self._servers_cache[slt]["packets"]:
+            source.protocol.send_packet(source.addr, packet)
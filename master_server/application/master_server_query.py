@@ -1,16 +1,109 @@
 import asyncio
+import click
+import heapq
 import ipaddress
+import itertools
 import logging
+import math
+
+from openttd_helpers import click_helper
 
 log = logging.getLogger(__name__)
 
+# Granularity (in seconds) of the query timers. All timers that expire
+# within the same tick are handled in a single batch.
+QUERY_TICK = 0.5
+
+
+class Query:
+    __slots__ = ("protocol", "server_addr", "user_data", "timeout", "retry_left")
+
+    def __init__(self, protocol, server_addr, user_data, timeout, retry_left):
+        self.protocol = protocol
+        self.server_addr = server_addr
+        self.user_data = user_data
+        self.timeout = timeout
+        self.retry_left = retry_left
+
 
 class Common:
+    max_queries = 10000
+
     def __init__(self, retry_reached_callback=None):
         self._ms_mapping = {}
         self._retry_reached_callback = retry_reached_callback
 
-    async def _query_server_task(self, protocol, ip, port, timeout, retry):
+        # All outstanding queries share a single timer. The heap contains
+        # (deadline, sequence, ms_key, query) tuples; answered queries are
+        # only removed from _ms_mapping, and are discarded from the heap once
+        # their deadline passes.
+        self._timers = []
+        self._timer_sequence = itertools.count()
+        self._timer_handle = None
+        self._timer_deadline = None
+
+        self.queries_dropped = 0
+
+    def _schedule_timer(self, ms_key, query, now):
+        heapq.heappush(self._timers, (now + query.timeout, next(self._timer_sequence), ms_key, query))
+
+    def _arm_timer(self):
+        # Round up to the next tick, so timers close to each other are
+        # handled in the same batch.
+        deadline = math.ceil(self._timers[0][0] / QUERY_TICK) * QUERY_TICK
+
+        if self._timer_handle is not None:
+            if self._timer_deadline <= deadline:
+                return
+            self._timer_handle.cancel()
+
+        self._timer_deadline = deadline
+        self._timer_handle = asyncio.get_event_loop().call_at(deadline, self._on_timer)
+
+    def _on_timer(self):
+        self._timer_handle = None
+        now = asyncio.get_event_loop().time()
+
+        while self._timers and self._timers[0][0] <= now:
+            _, _, ms_key, query = heapq.heappop(self._timers)
+
+            # Skip queries that were answered in the meantime.
+            if self._ms_mapping.get(ms_key) is not query:
+                continue
+
+            # As we are in a callback, we need to explicitly log the
+            # exception, otherwise it won't show up in the logs in a sane
+            # matter.
+            try:
+                if query.retry_left > 0:
+                    query.retry_left -= 1
+                    query.protocol.send_PACKET_UDP_CLIENT_FIND_SERVER(query.server_addr, new_connection=True)
+                    self._schedule_timer(ms_key, query, now)
+                    continue
+
+                # Forget about this query, as we consider it failed
+                del self._ms_mapping[ms_key]
+                query.protocol.close_connection(query.server_addr)
+
+                if self._retry_reached_callback:
+                    self._retry_reached_callback(*ms_key)
+            except Exception:
+                log.exception("Exception while processing timeout of query to %s:%d", *ms_key)
+
+        if self._timers:
+            self._arm_timer()
+
+    def query_server(self, ip, port, protocol, user_data=None, timeout=5, retry=3):
+        # Check if we are already querying this server.
+        # This can happen if we are flooded for example.
+        ms_key = (ip, port)
+        if ms_key in self._ms_mapping:
+            return
+
+        if len(self._ms_mapping) >= self.max_queries:
+            self.queries_dropped += 1
+            return
+
         # For an IPv4 socket, a tuple of two should be used. For IPv6 a tuple
         # of four. If an IPv4 address is sent over IPv6 socket, it should be
         # prefixed with "::ffff:".
@@ -22,69 +115,42 @@ class Common:
         else:
             server_addr = (str(ip), port)
 
-        # Retry as often as requested. If a response is received, our task is
-        # cancelled, so we don't have to worry about that.
-        retry_left = retry
-        while retry_left > 0:
-            request, response = protocol.send_PACKET_UDP_CLIENT_FIND_SERVER(server_addr, new_connection=True)
-
-            if request and response:
-
-                async def send_via_socks():
-                    transport, _ = await request
-                    try:
-                        data = await response
-                        protocol.datagram_received(data, server_addr, is_socks=True)
-                    finally:
-                        transport.close()
-
-                # The SOCKS connection times out after 30 seconds; we want it
-                # cancelled earlier, so we create a new task, and stop waiting
-                # for it after our own timeout.
-                task = asyncio.ensure_future(send_via_socks())
-                try:
-                    await asyncio.sleep(timeout)
-                finally:
-                    # Either we got cancelled or the timeout happened; either
-                    # way, close up the UDP socket.
-                    task.cancel()
-            else:
-                await asyncio.sleep(timeout)
-
-            retry_left -= 1
-
-        # Forget about this query, as we consider it failed
-        ms_key = (ip, port)
-        del self._ms_mapping[ms_key]
+        # Keep a mapping of all servers we are querying. This allows us to
+        # stop retransmitting if a response is received.
+        query = Query(protocol, server_addr, user_data, timeout, retry - 1)
+        self._ms_mapping[ms_key] = query
 
-        if self._retry_reached_callback:
-            self._retry_reached_callback(ip, port)
-
-    def query_server(self, ip, port, protocol, user_data=None, timeout=5, retry=3):
-        # Check if we are already querying this server.
-        # This can happen if we are flooded for example.
-        ms_key = (ip, port)
-        if ms_key in self._ms_mapping:
-            return
-
-        # Query the server in its own task.
-        task = asyncio.ensure_future(self._query_server_task(protocol, ip, port, timeout, retry))
-
-        # Keep a mapping of all servers we are querying, linking to their
-        # task. This allows us to cancel the task if a response is received.
-        self._ms_mapping[ms_key] = (task, user_data)
+        protocol.send_PACKET_UDP_CLIENT_FIND_SERVER(server_addr, new_connection=True)
+        self._schedule_timer(ms_key, query, asyncio.get_event_loop().time())
+        self._arm_timer()
 
     def query_server_response(self, ip, port):
         # Check if we expected a response from this server.
         ms_key = (ip, port)
-        task, user_data = self._ms_mapping.get(ms_key, (None, None))
-        if not task:
+        query = self._ms_mapping.pop(ms_key, None)
+        if query is None:
             log.info("Response from %s:%d, but we did not expect a response.", ip, port)
             return None
 
-        # Cancel the timeout timer, and make sure that any retransmit is
-        # not being processed anymore.
-        task.cancel()
-        del self._ms_mapping[ms_key]
-
-        return user_data
+        # This stops any retransmit; the timer itself is discarded once it
+        # expires.
+        query.protocol.close_connection(query.server_addr)
+        return query.user_data
+
+    def get_query_metrics(self):
+        yield "# TYPE master_server_queries_in_flight gauge"
+        yield f"master_server_queries_in_flight {len(self._ms_mapping)}"
+        yield "# TYPE master_server_queries_dropped_total counter"
+        yield f"master_server_queries_dropped_total {self.queries_dropped}"
+
+
+@click_helper.extend
+@click.option(
+    "--max-server-queries",
+    help="How many servers can be queried at the same time; registrations beyond this are ignored.",
+    default=10000,
+    show_default=True,
+    metavar="COUNT",
+)
+def click_server_query(max_server_queries):
+    Common.max_queries = max_server_queries
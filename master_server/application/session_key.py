@@ -0,0 +1,83 @@
+import click
+import hashlib
+import hmac
+import time
+
+from openttd_helpers import click_helper
+
+# Secrets to sign session-keys with; the first is used to sign new
+# session-keys, all of them are accepted. This allows rotating the secret:
+# add the new one at the end, then move it to the front, and finally,
+# once all servers are given a new session-key, remove the old one.
+_secrets = []
+
+# Signed session-keys have the highest bit set. The signature is stored in
+# the remaining unused bits of the top byte and in the token:
+#
+#   |63      56       48       40       32       24       16       8       0|
+#   |--------|--------|--------|--------|--------|--------|--------|--------|
+#   |1|  sig |               time                |     counter     |  sig   |
+SIGNED_FLAG = 1 << 63
+SIGNATURE_HIGH_MASK = 0x7F << 56
+
+# Unsigned session-keys expire from the database once they are no longer
+# used. Signed session-keys are not stored, so once they are this old, they
+# are only accepted if the database still knows the server; otherwise the
+# server gets a new one.
+SESSION_KEY_MAX_AGE = 60 * 60 * 24
+
+
+def _get_signature(secret, session_key):
+    message = (session_key & ~SIGNATURE_HIGH_MASK).to_bytes(8, "big")
+    digest = hmac.new(secret, message, hashlib.sha256).digest()
+    return int.from_bytes(digest[:2], "big") & 0x7FFF
+
+
+def is_signing_enabled():
+    return bool(_secrets)
+
+
+def sign_session_key(session_key):
+    """
+    Sign a (version 2) session-key, of which the token is not filled in yet.
+
+    Returns the session-key (without token) and the token.
+    """
+    session_key |= SIGNED_FLAG
+    signature = _get_signature(_secrets[0], session_key)
+    return session_key | ((signature >> 8) << 56), signature & 0xFF
+
+
+def check_session_key(session_key, token):
+    """
+    Validate the token of a session-key against its signature.
+
+    Returns None if the session-key is not signed; those can only be
+    validated by the database.
+    """
+    if not session_key & SIGNED_FLAG:
+        return None
+
+    signature = (((session_key & SIGNATURE_HIGH_MASK) >> 56) << 8) | token
+    return any(_get_signature(secret, session_key) == signature for secret in _secrets)
+
+
+def is_session_key_expired(session_key):
+    """Check if a signed session-key is old enough to need the database to stay valid."""
+    return time.time() - ((session_key >> 24) & 0xFFFFFFFF) > SESSION_KEY_MAX_AGE
+
+
+@click_helper.extend
+@click.option(
+    "--session-key-secret",
+    help="Secret to sign session-keys with, so they can be validated without database lookup. "
+    "Can be given multiple times to rotate secrets; the first is used to sign, all are accepted. "
+    "Signed session-keys older than a day are only accepted while their server is still known in the database. "
+    "Session-keys not signed are still validated via the database.",
+    multiple=True,
+    metavar="SECRET",
+)
+def click_session_key(session_key_secret):
+    global _secrets
+
+    _secrets = [secret.encode() for secret in session_key_secret]
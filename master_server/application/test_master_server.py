@@ -0,0 +1,93 @@
+import asyncio
+import ipaddress
+import time
+
+from . import session_key
+from .master_server import Application
+from .session_key import sign_session_key
+from ..database import memory
+
+
+class Protocol:
+    query_protocol = None
+
+    def __init__(self):
+        self.session_keys = []
+
+    def send_PACKET_UDP_MASTER_SESSION_KEY(self, addr, session_key):
+        self.session_keys.append(session_key)
+
+
+class Source:
+    def __init__(self):
+        self.ip = ipaddress.IPv4Address("192.0.2.1")
+        self.port = 40000
+        self.addr = ("192.0.2.1", 40000)
+        self.protocol = Protocol()
+
+
+def register(monkeypatch, session_key_and_token, setup=None):
+    source = Source()
+    strikes = []
+    queried = []
+
+    async def run():
+        db = memory.Database()
+        if setup is not None:
+            await setup(db)
+
+        application = Application(db)
+        monkeypatch.setattr(application.rate_limiter, "strike", strikes.append)
+        monkeypatch.setattr(application, "query_server", lambda *args, **kwargs: queried.append(kwargs["user_data"]))
+        await application.receive_PACKET_UDP_SERVER_REGISTER(source, 3979, session_key_and_token)
+
+    asyncio.run(run())
+    return source.protocol.session_keys, strikes, [user_data[0] for user_data in queried]
+
+
+def test_register_signed(monkeypatch):
+    monkeypatch.setattr(memory, "_snapshot", None)
+    monkeypatch.setattr(session_key, "_secrets", [b"secret"])
+    key, token = sign_session_key((int(time.time()) << 24) | (1234 << 8))
+
+    assert register(monkeypatch, key | token) == ([], [], [key])
+
+
+def test_register_signed_expired(monkeypatch):
+    monkeypatch.setattr(memory, "_snapshot", None)
+    monkeypatch.setattr(session_key, "_secrets", [b"secret"])
+    key, token = sign_session_key(((int(time.time()) - session_key.SESSION_KEY_MAX_AGE - 1) << 24) | (1234 << 8))
+
+    # A server that is still around keeps its session-key.
+    async def setup(db):
+        await db.store_session_key_token(key, 0)
+
+    assert register(monkeypatch, key | token, setup) == ([], [], [key])
+
+    # Otherwise it gets a new one; that is not its fault, so no strike.
+    session_keys, strikes, queried = register(monkeypatch, key | token)
+    assert len(session_keys) == 1
+    assert strikes == []
+    assert queried == []
+
+
+def test_register_strikes(monkeypatch):
+    monkeypatch.setattr(memory, "_snapshot", None)
+    monkeypatch.setattr(session_key, "_secrets", [b"secret"])
+    key, token = sign_session_key((int(time.time()) << 24) | (1234 << 8))
+    unsigned_key = 1 << 24
+
+    async def setup(db):
+        await db.store_session_key_token(unsigned_key, 5)
+
+    # Only a token that doesn't belong to the session-key is a strike.
+    session_keys, strikes, queried = register(monkeypatch, key | (token ^ 1))
+    assert (len(session_keys), strikes, queried) == (1, [ipaddress.IPv4Address("192.0.2.1")], [])
+    session_keys, strikes, queried = register(monkeypatch, unsigned_key | 6, setup)
+    assert (len(session_keys), strikes, queried) == (1, [ipaddress.IPv4Address("192.0.2.1")], [])
+
+    # A session-key that is not known (anymore) just gets a new one.
+    session_keys, strikes, queried = register(monkeypatch, unsigned_key | 5)
+    assert (len(session_keys), strikes, queried) == (1, [], [])
+
+    assert register(monkeypatch, unsigned_key | 5, setup) == ([], [], [unsigned_key])
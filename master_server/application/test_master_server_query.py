@@ -0,0 +1,78 @@
+import asyncio
+import ipaddress
+
+from . import master_server_query
+from .master_server_query import Common
+
+
+class Protocol:
+    is_ipv6 = False
+
+    def __init__(self):
+        self.sent = []
+        self.closed = []
+
+    def send_PACKET_UDP_CLIENT_FIND_SERVER(self, addr, new_connection=False):
+        self.sent.append(addr)
+
+    def close_connection(self, addr):
+        self.closed.append(addr)
+
+
+def test_query_server_retry(monkeypatch):
+    monkeypatch.setattr(master_server_query, "QUERY_TICK", 0.01)
+    failed = []
+    protocol = Protocol()
+    ip = ipaddress.IPv4Address("192.0.2.1")
+
+    async def run():
+        common = Common(retry_reached_callback=lambda ip, port: failed.append((ip, port)))
+        common.query_server(ip, 3979, protocol, timeout=0.02, retry=3)
+        # Querying a server that is already being queried is ignored.
+        common.query_server(ip, 3979, protocol, timeout=0.02, retry=3)
+
+        await asyncio.sleep(0.2)
+        return common
+
+    common = asyncio.run(run())
+
+    assert protocol.sent == [("192.0.2.1", 3979)] * 3
+    assert protocol.closed == [("192.0.2.1", 3979)]
+    assert failed == [(ip, 3979)]
+    assert common.query_server_response(ip, 3979) is None
+
+
+def test_query_server_response(monkeypatch):
+    monkeypatch.setattr(master_server_query, "QUERY_TICK", 0.01)
+    failed = []
+    protocol = Protocol()
+    ip = ipaddress.IPv4Address("192.0.2.1")
+
+    async def run():
+        common = Common(retry_reached_callback=lambda ip, port: failed.append((ip, port)))
+        common.query_server(ip, 3979, protocol, user_data="user-data", timeout=0.02, retry=3)
+        assert common.query_server_response(ip, 3979) == "user-data"
+
+        await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+
+    assert protocol.sent == [("192.0.2.1", 3979)]
+    assert protocol.closed == [("192.0.2.1", 3979)]
+    assert failed == []
+
+
+def test_query_server_max_queries():
+    protocol = Protocol()
+
+    async def run():
+        common = Common()
+        common.max_queries = 2
+        for i in range(3):
+            common.query_server(ipaddress.IPv4Address(f"192.0.2.{i}"), 3979, protocol)
+        return common
+
+    common = asyncio.run(run())
+
+    assert len(protocol.sent) == 2
+    assert common.queries_dropped == 1
@@ -0,0 +1,47 @@
+import time
+
+from . import session_key
+from .session_key import (
+    check_session_key,
+    is_session_key_expired,
+    sign_session_key,
+)
+
+
+def test_session_key_signed(monkeypatch):
+    monkeypatch.setattr(session_key, "_secrets", [b"new", b"old"])
+    now = int(time.time())
+    key, token = sign_session_key((now << 24) | (1234 << 8))
+
+    assert key & session_key.SIGNED_FLAG
+    assert (key >> 24) & 0xFFFFFFFF == now
+    assert check_session_key(key, token) is True
+    assert check_session_key(key, token ^ 1) is False
+    assert check_session_key(key ^ (1 << 8), token) is False
+
+    # Rotating the secret still accepts keys signed with the old one.
+    monkeypatch.setattr(session_key, "_secrets", [b"newer", b"new"])
+    assert check_session_key(key, token) is True
+
+    monkeypatch.setattr(session_key, "_secrets", [b"newer"])
+    assert check_session_key(key, token) is False
+
+
+def test_session_key_signed_expired(monkeypatch):
+    monkeypatch.setattr(session_key, "_secrets", [b"secret"])
+    key, token = sign_session_key(((int(time.time()) - session_key.SESSION_KEY_MAX_AGE - 1) << 24) | (1234 << 8))
+
+    # The signature of an old session-key stays valid; whether the server
+    # is still known is up to the database.
+    assert check_session_key(key, token) is True
+    assert is_session_key_expired(key)
+
+    key, token = sign_session_key((int(time.time()) << 24) | (1234 << 8))
+    assert not is_session_key_expired(key)
+
+
+def test_session_key_legacy(monkeypatch):
+    monkeypatch.setattr(session_key, "_secrets", [b"secret"])
+
+    # Session-keys from before signing are left to the database.
+    assert check_session_key((1600000000 << 24) | (1234 << 8), 12) is None
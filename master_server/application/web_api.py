@@ -6,6 +6,8 @@ from aiohttp import web
 from aiohttp.web_log import AccessLogger
 from collections import defaultdict
 
+from .. import workers
+
 log = logging.getLogger(__name__)
 routes = web.RouteTableDef()
 
@@ -47,13 +49,16 @@ async def healthz_handler(request):
 @routes.get("/server")
 async def server_list(request):
     if request.app.server_list_cache is None or time.time() > request.app.server_list_cache["expire"]:
+        expire = time.time() + TIME_SERVER_LIST_CACHE
+        servers = await request.app.database.get_server_list_for_web()
+
+        # Encode the response once, instead of for every request.
         request.app.server_list_cache = {
-            "servers": await request.app.database.get_server_list_for_web(),
-            "expire": time.time() + TIME_SERVER_LIST_CACHE,
+            "body": json.dumps({"servers": servers, "expire": expire}).encode(),
+            "expire": expire,
         }
 
-    server_list = request.app.server_list_cache
-    return web.json_response(server_list)
+    return web.Response(body=request.app.server_list_cache["body"], content_type="application/json")
 
 
 @routes.get("/server/{server_id}")
@@ -64,13 +69,15 @@ async def server_entry(request):
         request.app.server_entry_cache[server_id] is None
         or time.time() > request.app.server_entry_cache[server_id]["expire"]
     ):
+        expire = time.time() + TIME_SERVER_ENTRY_CACHE
+        server = await request.app.database.get_server_info_for_web(server_id)
+
         request.app.server_entry_cache[server_id] = {
-            "server": await request.app.database.get_server_info_for_web(server_id),
-            "expire": time.time() + TIME_SERVER_ENTRY_CACHE,
+            "body": json.dumps({"server": server, "expire": expire}).encode(),
+            "expire": expire,
         }
 
-    server_entry = request.app.server_entry_cache[server_id]
-    return web.json_response(server_entry)
+    return web.Response(body=request.app.server_entry_cache[server_id]["body"], content_type="application/json")
 
 
 @routes.route("*", "/{tail:.*}")
@@ -96,4 +103,10 @@ class Application:
         self._web.server_entry_cache = defaultdict(lambda: None)
 
     def run(self, bind, _, web_port):
-        web.run_app(self._web, host=bind, port=web_port, access_log_class=ErrorOnlyAccessLogger)
+        web.run_app(
+            self._web,
+            host=bind,
+            port=web_port,
+            access_log_class=ErrorOnlyAccessLogger,
+            reuse_port=workers.worker_count > 1,
+        )
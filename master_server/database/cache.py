@@ -0,0 +1,95 @@
+import asyncio
+import collections
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# How often the lifetime of the used entries is extended in the database.
+REFRESH_INTERVAL = 60
+
+# The token of a session-key never changes, so it can be remembered for a
+# while. The database keeps it for at least TTL_SERVER after it was last
+# used, so this has to be below that.
+TOKEN_CACHE_SIZE = 100000
+TOKEN_CACHE_TTL = 60 * 10
+# Unknown session-keys are remembered only briefly; those are rare, and
+# mostly servers that have been offline for a long time.
+TOKEN_CACHE_NEGATIVE_TTL = 30
+
+# Default for Cache.get() when None is a valid (cached) value.
+NOT_CACHED = object()
+
+
+class Cache:
+    """
+    In-process LRU cache, of which the entries expire after a while.
+
+    If "refresh" is given, every REFRESH_INTERVAL seconds it is called with
+    a list of (key, value) tuples of all entries used since the last call;
+    it can extend their lifetime in the database, and should call forget()
+    for those that no longer exist. An entry counts as used when get()
+    returns it, unless "touch" is False; then only touch() does that.
+    """
+
+    def __init__(self, size, refresh=None):
+        self._size = size
+        self._refresh = refresh
+        self._entries = collections.OrderedDict()
+        self._used = set()
+        self._task = None
+
+    def get(self, key, default=None, touch=True):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        value, expire = entry
+        if expire < time.monotonic():
+            del self._entries[key]
+            return default
+
+        self._entries.move_to_end(key)
+
+        if touch:
+            self.touch(key)
+        return value
+
+    def touch(self, key):
+        if self._refresh is None:
+            return
+
+        self._used.add(key)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._refresh_loop())
+
+    def put(self, key, value, ttl):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+
+    def forget(self, key):
+        self._entries.pop(key, None)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+
+            if not self._used:
+                continue
+
+            used, self._used = self._used, set()
+            entries = [(key, self._entries[key][0]) for key in used if key in self._entries]
+            if not entries:
+                continue
+
+            # As we are in a task, we need to explicitly log the exception,
+            # otherwise it won't show up in the logs in a sane matter.
+            try:
+                await self._refresh(entries)
+            except Exception:
+                log.exception("Exception while refreshing %d cache entries", len(entries))
+                # Look these up again next time, which also refreshes them.
+                for key, _ in entries:
+                    self._entries.pop(key, None)
@@ -0,0 +1,44 @@
+import moto
+import pytest
+
+from . import dynamodb
+
+
+@pytest.fixture
+def build_info():
+    """Build the server information as it comes out of an announcement."""
+
+    def build_info(name, grfids=(1,)):
+        return {
+            "newgrfs": [{"grfid": grfid, "md5sum": f"{grfid:02x}" * 16} for grfid in grfids],
+            "game_date": 10,
+            "start_date": 5,
+            "companies_max": 15,
+            "companies_on": 1,
+            "spectators_max": 10,
+            "name": name,
+            "openttd_version": "14.0",
+            "use_password": 0,
+            "clients_max": 25,
+            "clients_on": 1,
+            "spectators_on": 0,
+            "map_width": 256,
+            "map_height": 256,
+            "map_type": 1,
+            "is_dedicated": 1,
+            "ticks_playing": 100,
+        }
+
+    return build_info
+
+
+@pytest.fixture
+def mock_dynamodb(monkeypatch):
+    """Run the DynamoDB backend against moto."""
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setattr(dynamodb.Database, "region", "us-east-1")
+    monkeypatch.setattr(dynamodb.Database, "table_prefix", "")
+
+    with moto.mock_aws():
+        yield
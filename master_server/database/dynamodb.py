@@ -1,23 +1,55 @@
+import asyncio
+import botocore.exceptions
 import click
+import concurrent.futures
+import functools
 import hashlib
 import ipaddress
 import logging
+import time
 
 from datetime import (
     datetime,
     timedelta,
+    timezone,
 )
-from inspect import getmembers
 from openttd_helpers import click_helper
-from pynamodb.attributes import Attribute
-
+from pynamodb.connection import Connection
+from pynamodb.constants import ALL_OLD
+from pynamodb.exceptions import (
+    PutError,
+    TableError,
+    TransactWriteError,
+    UpdateError,
+)
+from pynamodb.transactions import TransactWrite
+
+from .cache import (
+    NOT_CACHED,
+    TOKEN_CACHE_NEGATIVE_TTL,
+    TOKEN_CACHE_SIZE,
+    TOKEN_CACHE_TTL,
+    Cache,
+)
 from .dynamodb_models import (
+    GrfMap,
     IpPort,
+    Lease,
     ServerIpMap,
     InfoMap,
     Server,
 )
+from .heartbeat import (
+    Heartbeats,
+    VOLATILE_FIELDS,
+    get_fingerprint,
+)
+from .info import (
+    INFO_FIELDS,
+    get_stored_info,
+)
 from .interface import DatabaseInterface
+from .. import workers
 
 log = logging.getLogger(__name__)
 
@@ -26,6 +58,11 @@ STALE_SERVER_TIMEOUT = 60 * 20
 # When database entries expire. A server after 20 minutes is marked offline;
 # so 60 minutes is a safe value.
 TTL = 60 * 60
+# How often a registration is retried when it races with another one for the
+# same IP:port.
+SERVER_ONLINE_ATTEMPTS = 3
+# How many stale entries are read (and then marked offline) at once.
+STALE_PAGE_SIZE = 100
 
 
 def md5sum(value):
@@ -39,38 +76,60 @@ def _get_server_id(server_ip, server_port):
         return md5sum(f"{server_ip}:{server_port}")
 
 
+def _convert_info_to_map(info):
+    fields = get_stored_info(info)
+    fields["newgrfs"] = [
+        GrfMap(grfid=newgrf["grfid"], md5sum=bytes.fromhex(newgrf["md5sum"])) for newgrf in fields["newgrfs"]
+    ]
+    return InfoMap(**fields)
+
+
 def _convert_server_to_dict(server):
+    # This is called for every online server, so the attribute values are
+    # read directly, instead of via the (rather slow) PynamoDB descriptors.
+    values = server.attribute_values
+    ipv4 = values.get("ipv4")
+    ipv6 = values.get("ipv6")
+
     entry = {
         "info": {},
     }
 
-    if server.ipv4:
+    if ipv4:
+        ipv4 = ipv4.attribute_values
         entry["ipv4"] = {
-            "ip": str(server.ipv4.ip),
-            "port": server.ipv4.port,
+            "ip": str(ipv4["ip"]),
+            "port": ipv4["port"],
         }
-        entry["server_id"] = _get_server_id(server.ipv4.ip, server.ipv4.port)
-
-    if server.ipv6:
+    if ipv6:
+        ipv6 = ipv6.attribute_values
         entry["ipv6"] = {
-            "ip": str(server.ipv6.ip),
-            "port": server.ipv6.port,
+            "ip": str(ipv6["ip"]),
+            "port": ipv6["port"],
         }
-        # Make sure the IPv4 variant always wins.
-        if "server_id" not in entry:
-            entry["server_id"] = _get_server_id(server.ipv6.ip, server.ipv6.port)
 
-    for name, _ in getmembers(InfoMap, lambda o: isinstance(o, Attribute)):
+    # Servers registered by an older version don't have their server_id
+    # stored yet. Make sure the IPv4 variant always wins.
+    if values.get("server_id"):
+        entry["server_id"] = values["server_id"]
+    elif ipv4:
+        entry["server_id"] = _get_server_id(ipv4["ip"], ipv4["port"])
+    elif ipv6:
+        entry["server_id"] = _get_server_id(ipv6["ip"], ipv6["port"])
+
+    info_values = values["info"].attribute_values
+    info = entry["info"]
+    for name in INFO_FIELDS:
         if name == "newgrfs":
-            entry["info"]["newgrfs"] = [
+            info["newgrfs"] = [
                 {
                     "grfid": newgrf["grfid"],
                     "md5sum": newgrf["md5sum"].hex(),
                 }
-                for newgrf in getattr(server.info, name)
+                for newgrf in (newgrf.attribute_values for newgrf in info_values.get("newgrfs") or [])
             ]
         else:
-            entry["info"][name] = getattr(server.info, name)
+            info[name] = info_values.get(name)
 
     return entry
 
@@ -79,92 +138,455 @@ class Database(DatabaseInterface):
     host = None
     region = None
     table_prefix = None
-
-    def _update_ip_port(self, server_id, session_key):
-        try:
-            ip_port = IpPort.get(server_id)
-            if ip_port.session_key == session_key:
-                return
-
-            # This IP:port is already known under another session-key.
-            # Most likely this means the server never unregistered itself
-            # (due to a server-crash for example). This means we can now
-            # consider the original server offline, and this new key will
-            # track the new server again.
-            Server(ip_port.session_key).update(
-                actions=[Server.online.set(False)],
-                condition=Server.session_key == ip_port.session_key,
-            )
-        except IpPort.DoesNotExist:
-            # New server, so nothing to update.
-            pass
+    threads = 16
+    online_shards = 0
+    migrate = False
 
     def __init__(self):
         # PynamoDB only allows to set these fields statically, while it is
         # much more likely you would like them dynamically. So .. we just
         # overwrite the fields. Sadly, this needs to be done per model, making
         # this a bit annoying to maintain.
-        for model in (Server, IpPort):
+        for model in (Server, IpPort, Lease):
             model.Meta.host = self.host
             model.Meta.region = self.region
             model.Meta.table_name = f"{self.table_prefix}{model.Meta.table_name}"
+            # Every thread can have a connection open.
+            model.Meta.max_pool_connections = self.threads
+
+        # Transactions are not bound to a single model, so they need their
+        # own connection.
+        self._connection = Connection(host=self.host, region=self.region, max_pool_connections=self.threads)
 
+        for model in (Server, IpPort, Lease):
             if not model.exists():
-                model.create_table(wait=True)
+                self._create_table(model)
+
+        # Creating indexes and migrating entries is only needed once after
+        # an upgrade (or after changing the amount of shards); and only a
+        # single process should do it.
+        if self.migrate and workers.worker_index == 0:
+            for model in (Server, IpPort, Lease):
+                self._create_missing_indexes(model)
+            self._migrate_online_entries()
+        else:
+            for model in (Server, IpPort, Lease):
+                for index_name in self._get_missing_indexes(model):
+                    log.error(
+                        "Index %s on %s is missing; start once with --dynamodb-migrate to create it",
+                        index_name,
+                        model.Meta.table_name,
+                    )
+
+        # With sharding, the online servers can only be listed via the shard
+        # index. Refuse to start without it, instead of failing every read.
+        if self.online_shards:
+            for model in (Server, IpPort):
+                index_name = model.online_shard_view.Meta.index_name
+                while (status := self._get_index_status(model).get(index_name)) != "ACTIVE":
+                    if status is None and not self.migrate:
+                        raise click.UsageError(
+                            f"--dynamodb-online-shards needs index {index_name} on {model.Meta.table_name}; "
+                            "start once with --dynamodb-migrate to create it"
+                        )
+                    # Another process is creating the index.
+                    time.sleep(5)
+
+        # Entries only get their client-list attribute from this version on,
+        # and older entries only once migrated. So until the index is there,
+        # read the client server-list from the online index instead.
+        self._use_client_list = (
+            self._get_index_status(IpPort).get(IpPort.client_list_view.Meta.index_name) == "ACTIVE"
+        )
+        if not self._use_client_list:
+            log.warning(
+                "Index client_list_view is not active; reading the client server-list from online_view until "
+                "restarted after --dynamodb-migrate"
+            )
+
+        # PynamoDB is blocking. To not stall the event loop on every
+        # round trip, all database calls are done from a pool of threads.
+        # This also bounds how many requests are in flight at the same time.
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="dynamodb")
+        self._heartbeats = Heartbeats(self._flush_heartbeats)
+        # The entry of a server is kept alive by server_online(), so there
+        # is no need to refresh tokens.
+        self._tokens = Cache(TOKEN_CACHE_SIZE)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args))
+
+    def _create_table(self, model):
+        try:
+            model.create_table(wait=True)
+        except TableError as e:
+            # Another process (or instance) is creating it at the same time.
+            if e.cause_response_code != "ResourceInUseException":
+                raise
+
+            while model.describe_table()["TableStatus"] != "ACTIVE":
+                time.sleep(5)
+
+    def _get_index_status(self, model):
+        description = model.describe_table()
+        return {index["IndexName"]: index["IndexStatus"] for index in description.get("GlobalSecondaryIndexes", [])}
+
+    def _get_indexes(self, model):
+        # The shard index is only used with sharding enabled.
+        return [
+            index
+            for index in model._get_schema()["global_secondary_indexes"]
+            if self.online_shards or index["index_name"] != "online_shard_view"
+        ]
+
+    def _get_missing_indexes(self, model):
+        existing = self._get_index_status(model)
+        return [index["index_name"] for index in self._get_indexes(model) if index["index_name"] not in existing]
+
+    def _create_missing_indexes(self, model):
+        # Tables created before an index was added to the model don't have
+        # that index yet. DynamoDB only allows to create a single index per
+        # call, and it takes a while before the index can be used.
+        for index in self._get_indexes(model):
+            if index["index_name"] in self._get_index_status(model):
+                continue
+
+            log.info("Creating index %s on %s; this can take a while ...", index["index_name"], model.Meta.table_name)
+            self._create_index(model, index)
+
+            while self._get_index_status(model)[index["index_name"]] != "ACTIVE":
+                time.sleep(5)
+
+    def _create_index(self, model, index):
+        while True:
+            try:
+                self._connection.client.update_table(
+                    TableName=model.Meta.table_name,
+                    AttributeDefinitions=index["attribute_definitions"],
+                    GlobalSecondaryIndexUpdates=[
+                        {
+                            "Create": {
+                                "IndexName": index["index_name"],
+                                "KeySchema": index["key_schema"],
+                                "Projection": index["projection"],
+                                "ProvisionedThroughput": index["provisioned_throughput"],
+                            },
+                        },
+                    ],
+                )
+                return
+            except botocore.exceptions.ClientError as e:
+                error = e.response["Error"]
+                # Another process is creating this (or another) index at the
+                # same time; in that case, wait for it.
+                if error["Code"] not in ("ResourceInUseException", "LimitExceededException") and not (
+                    error["Code"] == "ValidationException" and "already exists" in error.get("Message", "")
+                ):
+                    raise
+
+            if index["index_name"] in self._get_index_status(model):
+                return
+            time.sleep(5)
+
+    def _migrate_online_entries(self):
+        # Entries that went online before an index was added (or with
+        # another amount of shards) get their index attributes assigned. New
+        # entries are written with them directly. The old attributes are
+        # still written too, so instances running an older version keep
+        # working during a rollout.
+        for model, key in ((Server, "session_key"), (IpPort, "server_id")):
+            count = 0
+            for entry in model.scan(model.online == True):  # noqa: E712
+                actions = []
+
+                online_shard = self._get_online_shard(getattr(entry, key))
+                if entry.online_shard != online_shard and online_shard is not None:
+                    actions.append(model.online_shard.set(online_shard))
+                if model is IpPort:
+                    client_list = self._get_client_list(entry.server_id, entry.server_ip.ip)
+                    if entry.client_list != client_list:
+                        actions.append(IpPort.client_list.set(client_list))
+
+                if not actions:
+                    continue
+
+                try:
+                    entry.update(actions=actions, condition=model.online == True)  # noqa: E712
+                except UpdateError:
+                    # Went offline in the meantime.
+                    continue
+                count += 1
+
+            if count:
+                log.info("Migrated %d online entries of %s", count, model.Meta.table_name)
+
+    def _get_shard(self, key):
+        return int(md5sum(str(key)), 16) % max(1, self.online_shards)
+
+    def _get_online_shard(self, key):
+        if not self.online_shards:
+            return None
+        return f"online#{self._get_shard(key)}"
+
+    def _get_client_list(self, server_id, server_ip):
+        # Without sharding, every family still gets a single shard.
+        family = "ipv6" if isinstance(server_ip, ipaddress.IPv6Address) else "ipv4"
+        return f"{family}#{self._get_shard(server_id)}"
+
+    def _get_online_shards(self):
+        # Without sharding, all online entries are in a single partition of
+        # the (old) index.
+        if self.online_shards:
+            return [f"online#{shard}" for shard in range(self.online_shards)]
+        return [None]
+
+    def _query_online_shard(self, model, online_shard):
+        if online_shard is not None:
+            return list(model.online_shard_view.query(online_shard))
+        return list(model.online_view.query(True))
+
+    def _query_stale_page(self, model, online_shard, seen_before, last_evaluated_key):
+        if online_shard is not None:
+            result = model.online_shard_view.query(
+                online_shard,
+                model.time_last_seen < seen_before,
+                limit=STALE_PAGE_SIZE,
+                last_evaluated_key=last_evaluated_key,
+            )
+        else:
+            result = model.time_last_seen_view.query(
+                True,
+                model.time_last_seen < seen_before,
+                limit=STALE_PAGE_SIZE,
+                last_evaluated_key=last_evaluated_key,
+            )
+
+        entries = list(result)
+        return entries, result.last_evaluated_key
+
+    def _query_client_list(self, client_list):
+        return [ip_port.server_ip for ip_port in IpPort.client_list_view.query(client_list)]
+
+    async def _query_online(self, model):
+        # With sharding, every shard is queried in parallel.
+        results = await asyncio.gather(
+            *[self._run(self._query_online_shard, model, online_shard) for online_shard in self._get_online_shards()]
+        )
+        return [entry for result in results for entry in result]
 
     async def check_session_key_token(self, session_key, token):
+        stored_token = self._tokens.get(session_key, NOT_CACHED)
+        if stored_token is NOT_CACHED:
+            stored_token = await self._run(self._get_session_key_token, session_key)
+            ttl = TOKEN_CACHE_NEGATIVE_TTL if stored_token is None else TOKEN_CACHE_TTL
+            self._tokens.put(session_key, stored_token, ttl)
+
+        if stored_token is None:
+            return None
+        return stored_token == token
+
+    def _get_session_key_token(self, session_key):
         try:
-            server = Server.get(session_key)
+            server = Server.get(session_key, attributes_to_get=["token"])
         except Server.DoesNotExist:
-            return False
-        return server.token == token
+            return None
+        return server.token
 
     async def store_session_key_token(self, session_key, token):
-        server = Server(session_key, token=token, ttl=timedelta(seconds=TTL))
-        server.save()
+        await self._run(self._store_session_key_token, session_key, token)
+        self._tokens.put(session_key, token, TOKEN_CACHE_TTL)
 
-    async def server_online(self, session_key, server_ip, server_port, info):
-        server_id = _get_server_id(server_ip, server_port)
-        self._update_ip_port(server_id, session_key)
+    def _store_session_key_token(self, session_key, token):
+        # A server can re-register while it is online (version 1 servers do
+        # so on every announcement); keep what is known about it.
+        Server(session_key).update(actions=[Server.token.set(token), Server.ttl.set(timedelta(seconds=TTL))])
+
+    async def check_session_key_in_use(self, session_key):
+        return await self._run(self._check_session_key_in_use, session_key)
 
+    def _check_session_key_in_use(self, session_key):
         try:
-            server = Server.get(session_key)
+            server = Server.get(session_key, attributes_to_get=["ttl"])
         except Server.DoesNotExist:
             return False
+        # DynamoDB removes expired entries only once in a while.
+        return server.ttl is not None and server.ttl > datetime.now(timezone.utc)
 
-        # Don't accept servers with empty revision or name.
-        if info["openttd_version"] == "" or info["name"] == "":
+    async def server_online(self, session_key, server_ip, server_port, info):
+        # Most announcements are heartbeats of servers that didn't change;
+        # those only need to refresh when the server was last seen. If that
+        # fails (for example, because the server went offline in the
+        # meantime), it is written in full after all.
+        key = (server_ip, server_port)
+        fingerprint = get_fingerprint(session_key, info)
+        if self._heartbeats.get(key, fingerprint) is not None:
+            if await self._heartbeats.refresh(key, (session_key, info, datetime.utcnow().timestamp())):
+                return True
+
+        result = await self._run(self._server_online, session_key, server_ip, server_port, info)
+        if result:
+            self._heartbeats.remember(key, fingerprint, True)
+        else:
+            self._heartbeats.forget(key)
+        return result
+
+    async def _flush_heartbeats(self, heartbeats):
+        concurrency = asyncio.Semaphore(max(1, self.threads // 4))
+
+        async def run(func, *args):
+            async with concurrency:
+                return await self._run(func, *args)
+
+        # A server announces itself over IPv4 and IPv6 at the same time, and
+        # both refresh the same server entry; write that only once.
+        servers = {session_key: (info, now) for _, (session_key, info, now) in heartbeats}
+        results = await asyncio.gather(
+            *[run(self._refresh_server, session_key, info, now) for session_key, (info, now) in servers.items()]
+        )
+        refreshed = dict(zip(servers, results))
+
+        async def refresh_ip_port(key, session_key, now):
+            if not refreshed[session_key]:
+                return False
+            return await run(self._refresh_ip_port, session_key, *key, now)
+
+        return await asyncio.gather(
+            *[refresh_ip_port(key, session_key, now) for key, (session_key, _, now) in heartbeats]
+        )
+
+    def _refresh_server(self, session_key, info, now):
+        actions = [Server.time_last_seen.set(now), Server.ttl.set(timedelta(seconds=TTL))]
+        # These are not part of the fingerprint, so they have to be written
+        # with every refresh.
+        for name in VOLATILE_FIELDS:
+            if name in INFO_FIELDS:
+                actions.append(getattr(Server.info, name).set(info[name]))
+
+        # If the server went offline in the meantime (possibly via another
+        # instance), don't bring it back; the caller does a full write.
+        return self._refresh(Server(session_key), actions, Server.online == True)  # noqa: E712
+
+    def _refresh_ip_port(self, session_key, server_ip, server_port, now):
+        return self._refresh(
+            IpPort(_get_server_id(server_ip, server_port)),
+            [IpPort.time_last_seen.set(now), IpPort.ttl.set(timedelta(seconds=TTL))],
+            (IpPort.session_key == session_key) & (IpPort.online == True),  # noqa: E712
+        )
+
+    def _refresh(self, entry, actions, condition):
+        try:
+            entry.update(actions=actions, condition=condition)
+        except UpdateError as e:
+            if e.cause_response_code != "ConditionalCheckFailedException":
+                raise
             return False
 
-        # Update the server information.
-        actions = [
-            Server.info.set(InfoMap(**info)),
-            Server.online.set(True),
-            Server.time_last_seen.set(datetime.utcnow().timestamp()),
-            Server.ttl.set(timedelta(seconds=TTL)),
-        ]
+        return True
 
-        if server.time_first_seen is None:
-            actions.append(Server.time_first_seen.set(datetime.utcnow().timestamp()))
+    def _server_online(self, session_key, server_ip, server_port, info):
+        # Don't accept servers with empty revision or name.
+        if info["openttd_version"] == "" or info["name"] == "":
+            return False
 
+        server_id = _get_server_id(server_ip, server_port)
         server_ip_map = ServerIpMap(ip=server_ip, port=server_port)
         field = "ipv6" if isinstance(server_ip, ipaddress.IPv6Address) else "ipv4"
-        if getattr(server, field) != server_ip_map:
-            actions.append(getattr(Server, field).set(server_ip_map))
-
-        server.update(actions=actions, condition=Server.session_key == session_key)
-        IpPort(
-            server_id=server_id,
-            session_key=session_key,
-            online=True,
-            server_ip=server_ip_map,
-            time_last_seen=datetime.utcnow().timestamp(),
-            ttl=timedelta(seconds=TTL),
-        ).save()
+        now = datetime.utcnow().timestamp()
 
-        return True
+        server_actions = [
+            Server.info.set(_convert_info_to_map(info)),
+            Server.online.set(True),
+            Server.time_first_seen.set(Server.time_first_seen | now),
+            Server.time_last_seen.set(now),
+            Server.ttl.set(timedelta(seconds=TTL)),
+            getattr(Server, field).set(server_ip_map),
+            # Make sure the IPv4 variant always wins.
+            Server.server_id.set(server_id if field == "ipv4" else Server.server_id | server_id),
+        ]
+        if self.online_shards:
+            server_actions.append(Server.online_shard.set(self._get_online_shard(session_key)))
+
+        # In the common case the IP:port is either new or already ours, and
+        # everything is done in a single transaction. If it turns out the
+        # IP:port is known under another session-key, the transaction is
+        # retried, this time also marking that other server as offline.
+        previous_session_key = None
+        mark_previous_offline = False
+        for _ in range(SERVER_ONLINE_ATTEMPTS):
+            if previous_session_key is None:
+                ip_port_condition = IpPort.server_id.does_not_exist() | (IpPort.session_key == session_key)
+            else:
+                ip_port_condition = IpPort.session_key == previous_session_key
+
+            try:
+                with TransactWrite(connection=self._connection) as transaction:
+                    transaction.save(
+                        IpPort(
+                            server_id=server_id,
+                            session_key=session_key,
+                            online=True,
+                            server_ip=server_ip_map,
+                            time_last_seen=now,
+                            ttl=timedelta(seconds=TTL),
+                            online_shard=self._get_online_shard(server_id),
+                            client_list=self._get_client_list(server_id, server_ip),
+                        ),
+                        condition=ip_port_condition,
+                        return_values=ALL_OLD,
+                    )
+
+                    # The session-key was validated before, so this can
+                    # create the entry.
+                    transaction.update(Server(session_key), actions=server_actions)
+
+                    if mark_previous_offline:
+                        # This IP:port is already known under another
+                        # session-key. Most likely this means the server
+                        # never unregistered itself (due to a server-crash for
+                        # example). This means we can now consider the
+                        # original server offline, and this new key will
+                        # track the new server again.
+                        transaction.update(
+                            Server(previous_session_key),
+                            actions=[Server.online.set(False), Server.online_shard.remove()],
+                            condition=Server.session_key.exists(),
+                        )
+                return True
+            except TransactWriteError as e:
+                reasons = [reason.code if reason else None for reason in e.cancellation_reasons]
+                if not reasons:
+                    raise
+
+                if reasons[0] == "ConditionalCheckFailed":
+                    # The IP:port is known under another session-key (or
+                    # changed hands since we last looked); try again with its
+                    # current owner.
+                    raw_item = e.cancellation_reasons[0].raw_item
+                    if raw_item:
+                        previous_session_key = IpPort.from_raw_data(raw_item).session_key
+                    else:
+                        try:
+                            previous_session_key = IpPort.get(server_id, consistent_read=True).session_key
+                        except IpPort.DoesNotExist:
+                            previous_session_key = None
+                    if previous_session_key == session_key:
+                        previous_session_key = None
+                    mark_previous_offline = previous_session_key is not None
+                elif len(reasons) > 2 and reasons[2] == "ConditionalCheckFailed":
+                    # The previous server already expired, so there is
+                    # nothing to mark offline.
+                    mark_previous_offline = False
+                elif "TransactionConflict" not in reasons:
+                    raise
+
+        log.warning("Failed to register %s after %d attempts", server_id, SERVER_ONLINE_ATTEMPTS)
+        return False
 
     async def server_offline(self, server_ip, server_port):
+        self._heartbeats.forget((server_ip, server_port))
+        await self._run(self._server_offline, server_ip, server_port)
+
+    def _server_offline(self, server_ip, server_port):
         server_id = _get_server_id(server_ip, server_port)
 
         # Lookup the session-key based on the ip/port.
@@ -173,39 +595,69 @@ class Database(DatabaseInterface):
         except IpPort.DoesNotExist:
             return
 
-        Server(ip_port.session_key).update(
-            actions=[
-                Server.online.set(False),
-                Server.time_last_seen.set(datetime.utcnow().timestamp()),
-                Server.ttl.set(timedelta(seconds=TTL)),
-            ],
-            condition=Server.session_key == ip_port.session_key,
-        )
-        ip_port.update(
-            actions=[
-                IpPort.online.set(False),
-                IpPort.time_last_seen.set(datetime.utcnow().timestamp()),
-                IpPort.ttl.set(timedelta(seconds=TTL)),
-            ]
-        )
+        now = datetime.utcnow().timestamp()
+        try:
+            with TransactWrite(connection=self._connection) as transaction:
+                transaction.update(
+                    Server(ip_port.session_key),
+                    actions=[
+                        Server.online.set(False),
+                        Server.online_shard.remove(),
+                        Server.time_last_seen.set(now),
+                        Server.ttl.set(timedelta(seconds=TTL)),
+                    ],
+                    condition=Server.session_key.exists(),
+                )
+                transaction.update(
+                    ip_port,
+                    actions=[
+                        IpPort.online.set(False),
+                        IpPort.online_shard.remove(),
+                        IpPort.client_list.remove(),
+                        IpPort.time_last_seen.set(now),
+                        IpPort.ttl.set(timedelta(seconds=TTL)),
+                    ],
+                    # Another server could have taken over this IP:port.
+                    condition=IpPort.session_key == ip_port.session_key,
+                )
+        except TransactWriteError as e:
+            if not e.cancellation_reasons:
+                raise
+            # Either the server expired or the IP:port was taken over in
+            # the meantime; in both cases there is nothing to mark offline.
 
     async def get_server_list_for_client(self, ipv6_list):
-        server_list = []
-
-        for ip_port in IpPort.online_view.query(True):
-            if ipv6_list != isinstance(ip_port.server_ip.ip, ipaddress.IPv6Address):
-                continue
-
-            server_list.append(
+        if not self._use_client_list:
+            ip_ports = await self._run(self._query_online_shard, IpPort, None)
+            return [
                 {
                     "ip": ip_port.server_ip.ip,
                     "port": ip_port.server_ip.port,
                 }
-            )
+                for ip_port in ip_ports
+                if ipv6_list == isinstance(ip_port.server_ip.ip, ipaddress.IPv6Address)
+            ]
 
-        return server_list
+        # This index only contains online servers of a single family, and
+        # only their address, so we read nothing more than we return.
+        family = "ipv6" if ipv6_list else "ipv4"
+        results = await asyncio.gather(
+            *[self._run(self._query_client_list, f"{family}#{shard}") for shard in range(max(1, self.online_shards))]
+        )
+
+        return [
+            {
+                "ip": server_ip.ip,
+                "port": server_ip.port,
+            }
+            for result in results
+            for server_ip in result
+        ]
 
     async def get_server_info_for_web(self, server_id):
+        return await self._run(self._get_server_info_for_web, server_id)
+
+    def _get_server_info_for_web(self, server_id):
         try:
             ip_port = IpPort.get(server_id)
         except IpPort.DoesNotExist:
@@ -219,25 +671,93 @@ class Database(DatabaseInterface):
         return _convert_server_to_dict(server)
 
     async def get_server_list_for_web(self):
-        return [_convert_server_to_dict(server) for server in Server.online_view.query(True)]
+        return [_convert_server_to_dict(server) for server in await self._query_online(Server)]
+
+    async def acquire_lease(self, name, owner, duration):
+        return await self._run(self._acquire_lease, name, owner, duration)
+
+    def _acquire_lease(self, name, owner, duration):
+        now = time.time()
+
+        try:
+            Lease(name, owner=owner, expire=now + duration).save(
+                condition=Lease.name.does_not_exist() | (Lease.owner == owner) | (Lease.expire < now)
+            )
+        except PutError as e:
+            if e.cause_response_code == "ConditionalCheckFailedException":
+                return False
+            raise
 
-    def check_stale_servers(self):
-        for server in Server.time_last_seen_view.query(
-            True, Server.time_last_seen < datetime.utcnow().timestamp() - STALE_SERVER_TIMEOUT
-        ):
-            server.update(actions=[Server.online.set(False), Server.ttl.set(timedelta(seconds=TTL))])
+        return True
+
+    async def check_stale_servers(self):
+        seen_before = datetime.utcnow().timestamp() - STALE_SERVER_TIMEOUT
+
+        # Leave most of the threads free for handling packets.
+        concurrency = asyncio.Semaphore(max(1, self.threads // 4))
+
+        async def mark_stale(model, entry):
+            async with concurrency:
+                await self._run(self._mark_stale, model, entry, seen_before)
+
+        for model in (Server, IpPort):
+            for online_shard in self._get_online_shards():
+                last_evaluated_key = None
+
+                while True:
+                    entries, last_evaluated_key = await self._run(
+                        self._query_stale_page, model, online_shard, seen_before, last_evaluated_key
+                    )
+                    await asyncio.gather(*[mark_stale(model, entry) for entry in entries])
 
-        for ip_port in IpPort.time_last_seen_view.query(
-            True, Server.time_last_seen < datetime.utcnow().timestamp() - STALE_SERVER_TIMEOUT
-        ):
-            ip_port.update(actions=[IpPort.online.set(False), IpPort.ttl.set(timedelta(seconds=TTL))])
+                    if last_evaluated_key is None:
+                        break
+
+    def _mark_stale(self, model, entry, seen_before):
+        actions = [model.online.set(False), model.online_shard.remove(), model.ttl.set(timedelta(seconds=TTL))]
+        if model is IpPort:
+            actions.append(IpPort.client_list.remove())
+
+        try:
+            # The server could have announced itself since we looked.
+            entry.update(actions=actions, condition=model.time_last_seen < seen_before)
+        except UpdateError as e:
+            if e.cause_response_code != "ConditionalCheckFailedException":
+                raise
 
 
 @click_helper.extend
 @click.option("--dynamodb-host", help="Hostname to use for the DynamoDB connection", default=None)
 @click.option("--dynamodb-region", help="Region to use for the DynamoDB connection", default=None)
 @click.option("--dynamodb-prefix", help="Prefix for DynamoDB table names", default="")
-def click_database_dynamodb(dynamodb_host, dynamodb_region, dynamodb_prefix):
+@click.option(
+    "--dynamodb-threads",
+    help="How many DynamoDB requests can be in flight at the same time.",
+    default=16,
+    show_default=True,
+    metavar="COUNT",
+)
+@click.option(
+    "--dynamodb-online-shards",
+    help="Spread the online servers over this many partitions of the index (0 = single partition, as before). "
+    "After changing this, start once with --dynamodb-migrate.",
+    default=0,
+    show_default=True,
+    metavar="COUNT",
+)
+@click.option(
+    "--dynamodb-migrate",
+    help="Create missing indexes and move online servers to their shard on startup. "
+    "Only needed once after an upgrade (when all instances run the new version) or after changing "
+    "--dynamodb-online-shards.",
+    is_flag=True,
+)
+def click_database_dynamodb(
+    dynamodb_host, dynamodb_region, dynamodb_prefix, dynamodb_threads, dynamodb_online_shards, dynamodb_migrate
+):
     Database.host = dynamodb_host
     Database.region = dynamodb_region
     Database.table_prefix = dynamodb_prefix
+    Database.threads = dynamodb_threads
+    Database.online_shards = dynamodb_online_shards
+    Database.migrate = dynamodb_migrate
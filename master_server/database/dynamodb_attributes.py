@@ -1,9 +1,7 @@
 import ipaddress
 
-from base64 import b64decode
 from pynamodb.constants import (
     BINARY,
-    DEFAULT_ENCODING,
     NUMBER,
     STRING,
 )
@@ -25,12 +23,9 @@ class BinaryAttribute(Attribute):
 
     def deserialize(self, value):
         """
-        Returns a decoded string from base64
+        Returns the binary string (boto3 already did the base64 decoding)
         """
-        try:
-            return b64decode(value.decode(DEFAULT_ENCODING))
-        except AttributeError:
-            return b64decode(value)
+        return value
 
 
 class BooleanAsNumberAttribute(Attribute):
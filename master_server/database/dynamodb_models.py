@@ -6,7 +6,7 @@ from pynamodb.attributes import (
     TTLAttribute,
     UnicodeAttribute,
 )
-from pynamodb.indexes import GlobalSecondaryIndex, AllProjection
+from pynamodb.indexes import GlobalSecondaryIndex, AllProjection, IncludeProjection
 
 from .dynamodb_attributes import (
     BinaryAttribute,
@@ -74,6 +74,15 @@ class Server(Model):
         online = BooleanAsNumberAttribute(hash_key=True)
         time_last_seen = NumberAttribute(range_key=True)
 
+    class OnlineShardIndex(GlobalSecondaryIndex):
+        class Meta:
+            read_capacity_units = 3
+            write_capacity_units = 3
+            projection = AllProjection()
+
+        online_shard = UnicodeAttribute(hash_key=True)
+        time_last_seen = NumberAttribute(range_key=True)
+
     class Meta:
         table_name = "MSU-server"
         read_capacity_units = 3
@@ -88,11 +97,18 @@ class Server(Model):
     ipv4 = ServerIpMap(null=True)
     ipv6 = ServerIpMap(null=True)
     info = InfoMap(null=True)
+    # Derived from ipv4 (or ipv6 if there is no ipv4); stored so it doesn't
+    # have to be calculated on every read.
+    server_id = UnicodeAttribute(null=True)
 
     time_first_seen = NumberAttribute(null=True)
     time_last_seen = NumberAttribute(null=True)
     time_last_seen_view = TimeLastSeenIndex()
 
+    # Only set while online, as "online#<shard>".
+    online_shard = UnicodeAttribute(null=True)
+    online_shard_view = OnlineShardIndex()
+
     ttl = TTLAttribute()
 
     def __repr__(self):
@@ -117,6 +133,23 @@ class IpPort(Model):
         online = BooleanAsNumberAttribute(hash_key=True)
         time_last_seen = NumberAttribute(range_key=True)
 
+    class OnlineShardIndex(GlobalSecondaryIndex):
+        class Meta:
+            read_capacity_units = 3
+            write_capacity_units = 3
+            projection = AllProjection()
+
+        online_shard = UnicodeAttribute(hash_key=True)
+        time_last_seen = NumberAttribute(range_key=True)
+
+    class ClientListIndex(GlobalSecondaryIndex):
+        class Meta:
+            read_capacity_units = 3
+            write_capacity_units = 3
+            projection = IncludeProjection(["server_ip"])
+
+        client_list = UnicodeAttribute(hash_key=True)
+
     class Meta:
         table_name = "MSU-ip-port"
         read_capacity_units = 3
@@ -133,7 +166,29 @@ class IpPort(Model):
     time_last_seen = NumberAttribute(null=True)
     time_last_seen_view = TimeLastSeenIndex()
 
+    # Only set while online, as "online#<shard>".
+    online_shard = UnicodeAttribute(null=True)
+    online_shard_view = OnlineShardIndex()
+
+    # Only set while online, as "ipv4#<shard>" or "ipv6#<shard>".
+    client_list = UnicodeAttribute(null=True)
+    client_list_view = ClientListIndex()
+
     ttl = TTLAttribute()
 
     def __repr__(self):
         return str(vars(self))
+
+
+class Lease(Model):
+    class Meta:
+        table_name = "MSU-lease"
+        read_capacity_units = 1
+        write_capacity_units = 1
+
+    name = UnicodeAttribute(hash_key=True)
+    owner = UnicodeAttribute()
+    expire = NumberAttribute()
+
+    def __repr__(self):
+        return str(vars(self))
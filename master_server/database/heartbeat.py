@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Refreshes are collected for this long, and then written in a single batch.
+# The announcement is only acknowledged after its refresh is written, and
+# OpenTTD announces again if that takes more than 10 seconds, so this has to
+# stay well below that. It is long enough to catch both the IPv4 and IPv6
+# announcement of a server, which are sent at the same time.
+FLUSH_DELAY = 2
+# Even if nothing changed, do a full write once in a while. This makes sure
+# that whatever happened to the entry in the meantime (for example, another
+# instance writing it) is corrected.
+FULL_WRITE_INTERVAL = 60 * 60
+# Fields that change all the time while a game is running. They are not
+# part of the fingerprint, otherwise no running game would ever count as
+# unchanged; instead, they are written with every refresh.
+VOLATILE_FIELDS = ("game_date", "ticks_playing")
+
+
+def get_fingerprint(session_key, info):
+    info = {name: value for name, value in info.items() if name not in VOLATILE_FIELDS}
+    return hashlib.md5(json.dumps([session_key, info], sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Heartbeats:
+    """
+    Coalesce the writes of servers that announce themselves without any change.
+
+    Per server (ip/port), the fingerprint of the last fully written
+    information is remembered. As long as that does not change, only a
+    refresh of the entry is needed. These refreshes are collected, and
+    every FLUSH_DELAY seconds handed to "flush" in a single batch.
+
+    "flush" is called with a list of (key, data) tuples, and should return
+    for each of them whether it was refreshed. refresh() returns the same;
+    if it was not refreshed (for example, because the server went offline
+    in the meantime), the caller should do a full write instead.
+    """
+
+    def __init__(self, flush):
+        self._flush = flush
+        self._fingerprints = {}
+        self._pending = {}
+        self._task = None
+
+    def get(self, key, fingerprint):
+        """Get the data of the last full write, or None if a full write is needed."""
+        entry = self._fingerprints.get(key)
+        if entry is None or entry[0] != fingerprint or entry[1] < time.monotonic() - FULL_WRITE_INTERVAL:
+            return None
+        return entry[2]
+
+    def remember(self, key, fingerprint, data):
+        self._fingerprints[key] = (fingerprint, time.monotonic(), data)
+
+    def forget(self, key):
+        self._fingerprints.pop(key, None)
+
+    async def refresh(self, key, data):
+        # Multiple refreshes of the same server before a flush become one.
+        pending = self._pending.get(key)
+        future = asyncio.get_running_loop().create_future() if pending is None else pending[1]
+        self._pending[key] = (data, future)
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_later())
+
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(FLUSH_DELAY)
+
+        pending, self._pending = self._pending, {}
+        self._task = None
+
+        # Forget about servers that have not been fully written for a
+        # while, so this doesn't keep on growing.
+        too_old = time.monotonic() - FULL_WRITE_INTERVAL
+        for key in [key for key, entry in self._fingerprints.items() if entry[1] < too_old]:
+            del self._fingerprints[key]
+
+        # As we are in a task, we need to explicitly log the exception,
+        # otherwise it won't show up in the logs in a sane matter.
+        try:
+            results = await self._flush([(key, data) for key, (data, _) in pending.items()])
+        except Exception:
+            log.exception("Exception while refreshing %d servers", len(pending))
+            results = [False] * len(pending)
+
+        for (key, (_, future)), result in zip(pending.items(), results):
+            if not result:
+                self._fingerprints.pop(key, None)
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,27 @@
+# The fields of the server information that are stored, in the order they
+# are returned in.
+INFO_FIELDS = (
+    "clients_max",
+    "clients_on",
+    "companies_max",
+    "companies_on",
+    "game_date",
+    "is_dedicated",
+    "map_height",
+    "map_type",
+    "map_width",
+    "name",
+    "newgrfs",
+    "openttd_version",
+    "spectators_max",
+    "spectators_on",
+    "start_date",
+    "use_password",
+)
+
+
+def get_stored_info(info):
+    # The packet contains more fields than we store; only keep those we know.
+    stored = {name: info[name] for name in INFO_FIELDS if name != "newgrfs"}
+    stored["newgrfs"] = [{"grfid": newgrf["grfid"], "md5sum": newgrf["md5sum"]} for newgrf in info["newgrfs"] or []]
+    return stored
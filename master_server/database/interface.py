@@ -4,12 +4,25 @@ import abc
 class DatabaseInterface(abc.ABC):
     @abc.abstractmethod
     def check_session_key_token(self, session_key, token):
-        """Check if this session key token exists and is valid."""
+        """
+        Check if this session key token exists and is valid.
+
+        Returns None if the session key is not known (anymore).
+        """
 
     @abc.abstractmethod
     def store_session_key_token(self, session_key, token):
         """Store a new session key token."""
 
+    @abc.abstractmethod
+    def check_session_key_in_use(self, session_key):
+        """
+        Check if the server with this session key is still in use.
+
+        This is the case as long as its entry has not expired; every
+        announcement of the server extends it.
+        """
+
     @abc.abstractmethod
     def server_online(self, session_key, server_ip, server_port, info):
         """
@@ -19,7 +32,10 @@ class DatabaseInterface(abc.ABC):
         ip/port combinations to a single session_key. They are all the same
         server.
 
-        If the server is not known yet, create the server entry.
+        The session-key is validated before this is called, so if the server
+        is not known, the server entry is created. Signed session-keys are
+        never stored, and a stored one can expire between its validation and
+        this call.
         """
 
     @abc.abstractmethod
@@ -45,3 +61,17 @@ class DatabaseInterface(abc.ABC):
 
         This list contains all the detailed information for each server.
         """
+
+    @abc.abstractmethod
+    def check_stale_servers(self):
+        """Mark servers that have not been seen for a while as offline."""
+
+    @abc.abstractmethod
+    def acquire_lease(self, name, owner, duration):
+        """
+        Acquire (or renew) the lease with this name for "duration" seconds.
+
+        Leases are shared between all instances using the same database, and
+        can only be held by a single owner at the time. Returns whether the
+        owner holds the lease.
+        """
@@ -0,0 +1,463 @@
+import asyncio
+import click
+import hashlib
+import ipaddress
+import json
+import logging
+import os
+import time
+
+from openttd_helpers import click_helper
+
+from .info import get_stored_info
+from .interface import DatabaseInterface
+from .. import workers
+
+log = logging.getLogger(__name__)
+
+_snapshot = None
+_snapshot_interval = None
+
+# After 20 minutes with no advertisement, mark servers as stale.
+STALE_SERVER_TIMEOUT = 60 * 20
+# When entries are forgotten. A server after 20 minutes is marked offline;
+# so 60 minutes is a safe value.
+TTL = 60 * 60
+# Version of the snapshot format; snapshots of other versions are ignored.
+SNAPSHOT_VERSION = 1
+
+
+def md5sum(value):
+    return hashlib.md5(value.encode()).digest().hex()
+
+
+def _get_server_id(server_ip, server_port):
+    if isinstance(server_ip, ipaddress.IPv6Address):
+        return md5sum(f"[{server_ip}]:{server_port}")
+    else:
+        return md5sum(f"{server_ip}:{server_port}")
+
+
+def _get_family(server_ip):
+    return "ipv6" if isinstance(server_ip, ipaddress.IPv6Address) else "ipv4"
+
+
+class Server:
+    __slots__ = (
+        "session_key",
+        "token",
+        "server_id",
+        "info",
+        "ipv4",
+        "ipv6",
+        "online",
+        "time_first_seen",
+        "time_last_seen",
+        "expire",
+    )
+
+    def __init__(self, session_key, token):
+        self.session_key = session_key
+        self.token = token
+        self.server_id = None
+        self.info = None
+        self.ipv4 = None
+        self.ipv6 = None
+        self.online = False
+        self.time_first_seen = None
+        self.time_last_seen = None
+        self.expire = time.time() + TTL
+
+
+class IpPort:
+    __slots__ = ("server_id", "session_key", "server_ip", "server_port", "online", "time_last_seen")
+
+    def __init__(self, server_id, session_key, server_ip, server_port, time_last_seen):
+        self.server_id = server_id
+        self.session_key = session_key
+        self.server_ip = server_ip
+        self.server_port = server_port
+        self.online = True
+        self.time_last_seen = time_last_seen
+
+
+class Database(DatabaseInterface):
+    """
+    Keep all servers in the memory of this process.
+
+    Useful for local development, tests and benchmarks, as no other service
+    is needed. As the data is not shared between processes, this cannot be
+    combined with multiple workers. Optionally the data is written to a
+    snapshot every now and then; a process that doesn't change anything
+    itself (like the web_api) follows the snapshot instead.
+    """
+
+    def __init__(self):
+        if workers.worker_count > 1:
+            raise click.UsageError("--db memory cannot be used with multiple workers")
+
+        # Servers by session-key.
+        self._servers = {}
+        # IP:port combinations by server-id.
+        self._ip_ports = {}
+        # Server-ids of the online IP:port combinations, per family.
+        self._online = {"ipv4": set(), "ipv6": set()}
+        # Session-keys of the online servers.
+        self._online_servers = set()
+        self._leases = {}
+
+        self._snapshot_mtime = None
+        self._snapshot_task = None
+        self._snapshot_dirty = False
+        # There is no event loop yet, so the snapshot is loaded on first use.
+        self._snapshot_load = None
+
+    def _changed(self):
+        if _snapshot is None:
+            return
+
+        self._snapshot_dirty = True
+        if self._snapshot_task is not None:
+            return
+        self._snapshot_task = asyncio.ensure_future(self._snapshot_loop())
+
+    async def _snapshot_loop(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await asyncio.sleep(_snapshot_interval)
+
+            # Nothing changed since the last snapshot.
+            if not self._snapshot_dirty:
+                continue
+            self._snapshot_dirty = False
+
+            # As we are in a task, we need to explicitly log the exception,
+            # otherwise it won't show up in the logs in a sane matter.
+            try:
+                # Serialize in the event loop, so the snapshot is consistent;
+                # only the (slow) writing is done in a thread.
+                data = json.dumps(self._get_snapshot())
+                await loop.run_in_executor(None, self._write_snapshot, data)
+            except Exception:
+                log.exception("Exception while writing snapshot")
+                self._snapshot_dirty = True
+
+    def _write_snapshot(self, data):
+        # Write to a temporary file first, so the snapshot is replaced
+        # atomically, and never left half-written.
+        filename = f"{_snapshot}.tmp"
+        with open(filename, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(filename, _snapshot)
+
+    def _get_snapshot(self):
+        return {
+            "version": SNAPSHOT_VERSION,
+            "servers": [
+                [
+                    server.session_key,
+                    server.token,
+                    server.server_id,
+                    server.info,
+                    server.ipv4,
+                    server.ipv6,
+                    server.online,
+                    server.time_first_seen,
+                    server.time_last_seen,
+                    server.expire,
+                ]
+                for server in self._servers.values()
+            ],
+            "ip_ports": [
+                [
+                    ip_port.session_key,
+                    str(ip_port.server_ip),
+                    ip_port.server_port,
+                    ip_port.online,
+                    ip_port.time_last_seen,
+                ]
+                for ip_port in self._ip_ports.values()
+            ],
+        }
+
+    def _read_snapshot(self, known_mtime):
+        try:
+            mtime = os.stat(_snapshot).st_mtime
+        except FileNotFoundError:
+            return None
+        if mtime == known_mtime:
+            return None
+
+        with open(_snapshot) as f:
+            return mtime, json.load(f)
+
+    async def _load_snapshot(self):
+        # Reading and parsing the snapshot is slow, so it is done in a thread.
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, self._read_snapshot, self._snapshot_mtime)
+        except Exception:
+            log.exception("Exception while loading snapshot %s", _snapshot)
+            return
+        if result is None:
+            return
+
+        # Changed something in the meantime; keep those changes.
+        if self._snapshot_task is not None:
+            return
+
+        mtime, snapshot = result
+        self._snapshot_mtime = mtime
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            log.warning("Ignoring snapshot %s with unknown version %r", _snapshot, snapshot.get("version"))
+            return
+
+        self._servers = {}
+        self._online_servers = set()
+        for entry in snapshot["servers"]:
+            session_key, token, *values = entry
+            server = Server(session_key, token)
+            (
+                server.server_id,
+                server.info,
+                server.ipv4,
+                server.ipv6,
+                server.online,
+                server.time_first_seen,
+                server.time_last_seen,
+                server.expire,
+            ) = values
+            self._servers[session_key] = server
+            if server.online:
+                self._online_servers.add(session_key)
+
+        self._ip_ports = {}
+        self._online = {"ipv4": set(), "ipv6": set()}
+        for session_key, server_ip, server_port, online, time_last_seen in snapshot["ip_ports"]:
+            server_ip = ipaddress.ip_address(server_ip)
+            server_id = _get_server_id(server_ip, server_port)
+            ip_port = IpPort(server_id, session_key, server_ip, server_port, time_last_seen)
+            ip_port.online = online
+            self._ip_ports[server_id] = ip_port
+            if online:
+                self._online[_get_family(server_ip)].add(server_id)
+
+        log.info("Loaded %d servers from snapshot %s", len(self._servers), _snapshot)
+
+    async def _follow_snapshot(self):
+        # Only a process that never changed anything follows the snapshot;
+        # otherwise its own changes would be lost. Until then, every call
+        # does this first, so the snapshot is loaded before the first change.
+        if _snapshot is None or self._snapshot_task is not None:
+            return
+
+        # All callers share a single load.
+        if self._snapshot_load is None or self._snapshot_load.done():
+            self._snapshot_load = asyncio.ensure_future(self._load_snapshot())
+        await asyncio.shield(self._snapshot_load)
+
+    def _mark_ip_port_offline(self, ip_port):
+        ip_port.online = False
+        self._online[_get_family(ip_port.server_ip)].discard(ip_port.server_id)
+
+    def _mark_server_offline(self, server):
+        server.online = False
+        self._online_servers.discard(server.session_key)
+
+    async def check_session_key_token(self, session_key, token):
+        await self._follow_snapshot()
+
+        server = self._servers.get(session_key)
+        if server is None:
+            return None
+        return server.token == token
+
+    async def store_session_key_token(self, session_key, token):
+        await self._follow_snapshot()
+
+        # A server can re-register while it is online; keep what is known
+        # about it.
+        server = self._servers.get(session_key)
+        if server is None:
+            self._servers[session_key] = Server(session_key, token)
+        else:
+            server.token = token
+            server.expire = time.time() + TTL
+        self._changed()
+
+    async def check_session_key_in_use(self, session_key):
+        await self._follow_snapshot()
+
+        server = self._servers.get(session_key)
+        return server is not None and server.expire > time.time()
+
+    async def server_online(self, session_key, server_ip, server_port, info):
+        # Don't accept servers with empty revision or name.
+        if info["openttd_version"] == "" or info["name"] == "":
+            return False
+
+        await self._follow_snapshot()
+
+        server_id = _get_server_id(server_ip, server_port)
+        family = _get_family(server_ip)
+        now = time.time()
+
+        ip_port = self._ip_ports.get(server_id)
+        if ip_port is not None and ip_port.session_key != session_key:
+            # This IP:port is already known under another session-key. Most
+            # likely this means the server never unregistered itself (due
+            # to a server-crash for example). This means we can now consider
+            # the original server offline, and this new key will track the
+            # new server again.
+            previous_server = self._servers.get(ip_port.session_key)
+            if previous_server is not None:
+                self._mark_server_offline(previous_server)
+
+        self._ip_ports[server_id] = IpPort(server_id, session_key, server_ip, server_port, now)
+        self._online[family].add(server_id)
+
+        server = self._servers.get(session_key)
+        if server is None:
+            server = Server(session_key, None)
+            self._servers[session_key] = server
+
+        server.info = get_stored_info(info)
+        setattr(server, family, {"ip": str(server_ip), "port": server_port})
+        # Make sure the IPv4 variant always wins.
+        if family == "ipv4" or server.server_id is None:
+            server.server_id = server_id
+        if server.time_first_seen is None:
+            server.time_first_seen = now
+        server.online = True
+        server.time_last_seen = now
+        server.expire = now + TTL
+        self._online_servers.add(session_key)
+
+        self._changed()
+        return True
+
+    async def server_offline(self, server_ip, server_port):
+        await self._follow_snapshot()
+
+        ip_port = self._ip_ports.get(_get_server_id(server_ip, server_port))
+        if ip_port is None:
+            return
+
+        self._mark_ip_port_offline(ip_port)
+        server = self._servers.get(ip_port.session_key)
+        if server is not None:
+            self._mark_server_offline(server)
+            server.expire = time.time() + TTL
+
+        self._changed()
+
+    async def get_server_list_for_client(self, ipv6_list):
+        await self._follow_snapshot()
+
+        ip_ports = (self._ip_ports[server_id] for server_id in self._online["ipv6" if ipv6_list else "ipv4"])
+        return [{"ip": ip_port.server_ip, "port": ip_port.server_port} for ip_port in ip_ports]
+
+    def _convert_server_to_dict(self, server):
+        entry = {
+            "info": server.info,
+            "server_id": server.server_id,
+        }
+        if server.ipv4:
+            entry["ipv4"] = server.ipv4
+        if server.ipv6:
+            entry["ipv6"] = server.ipv6
+        return entry
+
+    async def get_server_info_for_web(self, server_id):
+        await self._follow_snapshot()
+
+        ip_port = self._ip_ports.get(server_id)
+        if ip_port is None:
+            return None
+
+        server = self._servers.get(ip_port.session_key)
+        if server is None or server.info is None:
+            return None
+
+        return self._convert_server_to_dict(server)
+
+    async def get_server_list_for_web(self):
+        await self._follow_snapshot()
+
+        return [
+            self._convert_server_to_dict(self._servers[session_key])
+            for session_key in self._online_servers
+            if self._servers[session_key].info is not None
+        ]
+
+    async def check_stale_servers(self):
+        await self._follow_snapshot()
+
+        now = time.time()
+        seen_before = now - STALE_SERVER_TIMEOUT
+        changed = False
+
+        for family in self._online.values():
+            for server_id in [
+                server_id for server_id in family if self._ip_ports[server_id].time_last_seen < seen_before
+            ]:
+                self._mark_ip_port_offline(self._ip_ports[server_id])
+                changed = True
+
+        for session_key in list(self._online_servers):
+            server = self._servers[session_key]
+            if server.time_last_seen < seen_before:
+                log.info("Marking server %s as stale", server.server_id)
+                self._mark_server_offline(server)
+                changed = True
+
+        # Forget about everything that has been offline for a while.
+        for session_key in [
+            session_key for session_key, server in self._servers.items() if not server.online and server.expire < now
+        ]:
+            del self._servers[session_key]
+            changed = True
+        expired_before = now - TTL
+        for server_id in [
+            server_id
+            for server_id, ip_port in self._ip_ports.items()
+            if not ip_port.online and ip_port.time_last_seen < expired_before
+        ]:
+            del self._ip_ports[server_id]
+            changed = True
+
+        if changed:
+            self._changed()
+
+    async def acquire_lease(self, name, owner, duration):
+        # Only a single process can use this database, but keep the
+        # semantics the same as for the other databases.
+        now = time.time()
+        lease = self._leases.get(name)
+        if lease is not None and lease[0] != owner and lease[1] > now:
+            return False
+
+        self._leases[name] = (owner, now + duration)
+        return True
+
+
+@click_helper.extend
+@click.option(
+    "--memory-snapshot",
+    help="File to periodically write a snapshot of the memory database to, and to load it from on startup.",
+    type=click.Path(dir_okay=False),
+)
+@click.option(
+    "--memory-snapshot-interval",
+    help="Seconds between two snapshots of the memory database.",
+    default=60,
+    show_default=True,
+    metavar="SECONDS",
+)
+def click_database_memory(memory_snapshot, memory_snapshot_interval):
+    global _snapshot, _snapshot_interval
+
+    _snapshot = memory_snapshot
+    _snapshot_interval = memory_snapshot_interval
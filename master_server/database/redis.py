@@ -3,15 +3,24 @@ import hashlib
 import ipaddress
 import json
 import logging
+import time
 
 from openttd_helpers import click_helper
 from redis import asyncio as aioredis
 
+from .cache import (
+    NOT_CACHED,
+    TOKEN_CACHE_NEGATIVE_TTL,
+    TOKEN_CACHE_SIZE,
+    TOKEN_CACHE_TTL,
+    Cache,
+)
 from .interface import DatabaseInterface
 
 log = logging.getLogger(__name__)
 
 _redis_url = None
+_redis_stream_format = 1
 
 # Servers should announce every 15 minutes, so if we haven't seen a server
 # after 20 minutes, we can assume it is no longer running.
@@ -19,6 +28,147 @@ TTL_SERVER = 60 * 20
 # Give a bit of grace period to forget about NewGRFs, so server restarts don't
 # bump the counter.
 TTL_NEWGRF = TTL_SERVER + 60
+# Most servers use the same NewGRFs, so their index is remembered locally.
+# As Redis keeps a NewGRF for at least TTL_NEWGRF after we last looked it
+# up, this has to be (well) below that.
+NEWGRF_CACHE_SIZE = 10000
+NEWGRF_CACHE_TTL = 60 * 10
+
+# Instead of scanning for keys on every read, every "gc-server:<server-id>"
+# and "gc-direct-<type>:<server-id>" key we write has its server-id in a
+# sorted set, scored by when the key expires. Keys written by others (like
+# the Game Coordinator) are found by a single SCAN, done by a reader at most
+# once every INDEX_SCAN_INTERVAL seconds (for all instances together). We
+# don't know when those keys expire, so they are scored +inf; readers skip
+# server-ids without a key, and the next SCAN removes them from the index.
+INDEXES = {
+    "ms-index:gc-server": "gc-server:",
+    "ms-index:gc-direct-ipv4": "gc-direct-ipv4:",
+    "ms-index:gc-direct-ipv6": "gc-direct-ipv6:",
+}
+INDEX_SCAN_PATTERN = "gc-*"
+INDEX_SCAN_INTERVAL = 30
+# How many keys to ask for per SCAN call, and to add to an index at once.
+INDEX_SCAN_COUNT = 1000
+
+# Format of the entries in "gc-stream":
+# 1: every event is its own entry, with "type" and "payload" (JSON).
+# 2: all events of a single registration are one entry, with "type" set to
+#    "batch", "version" to 2, and "payload" a JSON list of objects with
+#    "type" and "payload" (the latter being the payload itself, not a
+#    string with JSON in it).
+STREAM_FORMATS = (1, 2)
+
+# Registering a server, in a single round trip. Scripts run atomically, so
+# no other instance can create the same NewGRF between our GET and SET.
+# Key names depend on values only known inside the script (like the
+# server-id), so they are not passed via KEYS. This means Redis Cluster is not
+# supported; the key names are shared with the Game Coordinator, so they
+# can't be put in a single hash slot anyway.
+# The JSON values are built to be identical to what json.dumps() would make.
+#
+# ARGV: session-key, server-ip, server-port, server-id (if this is a new
+# server), type ("ipv4" / "ipv6"), info (JSON), TTL_SERVER, TTL_NEWGRF,
+# time the server expires (for the indexes), stream format, followed by "grfid-md5sum",
+# NewGRF (JSON) and its index (or "" if not known yet) for every NewGRF.
+# Returns the server-id, followed by the index of every NewGRF.
+REGISTER_SCRIPT = """
+local session_key = ARGV[1]
+local server_ip = ARGV[2]
+local server_port = ARGV[3]
+local type = ARGV[5]
+local info = ARGV[6]
+local ttl_server = ARGV[7]
+local ttl_newgrf = ARGV[8]
+local expire = ARGV[9]
+local stream_format = ARGV[10]
+
+local events = {}
+local function add_to_stream(entry_type, payload)
+    if stream_format == "1" then
+        redis.call(
+            "XADD", "gc-stream", "MAXLEN", "~", "1000", "*",
+            "gc-id", "-1", "type", entry_type, "payload", payload
+        )
+    else
+        events[#events + 1] = '{"type": "' .. entry_type .. '", "payload": ' .. payload .. "}"
+    end
+end
+
+-- server_offline() doesn't get the session_key, so we need a reverse lookup.
+redis.call("SET", "ms-session-id:" .. server_ip .. ":" .. server_port, session_key, "EX", ttl_server)
+
+-- Create a server-id based on the first ip/port we see of this server.
+-- This means the server-id remains mostly stable between restarts.
+local server_id = redis.call("GET", "ms-server-id:" .. session_key) or ARGV[4]
+redis.call("SET", "ms-server-id:" .. session_key, server_id, "EX", ttl_server)
+
+-- Convert the NewGRF list to an indexed list, as expected by the Game
+-- Coordinator.
+local indexes = {}
+for i = 11, #ARGV, 3 do
+    local key = "gc-newgrf:" .. ARGV[i]
+    local index = ARGV[i + 2]
+
+    -- If the index is already known, the caller takes care of refreshing it.
+    if index == "" then
+        local newgrf_lookup = redis.call("GET", key)
+
+        if newgrf_lookup then
+            index = string.format("%d", cjson.decode(newgrf_lookup)["index"])
+            -- Make sure the entry lives a bit longer.
+            redis.call("EXPIRE", key, ttl_newgrf)
+        else
+            index = string.format("%d", redis.call("INCR", "gc-newgrf-counter"))
+            redis.call("SET", key, '{"index": ' .. index .. ', "name": null}', "EX", ttl_newgrf)
+            add_to_stream("newgrf-added", '{"index": ' .. index .. ', "newgrf": ' .. ARGV[i + 1] .. "}")
+        end
+    end
+
+    indexes[#indexes + 1] = index
+end
+local newgrfs_indexed = "[" .. table.concat(indexes, ", ") .. "]"
+
+-- Update the information of this server.
+redis.call("SET", "gc-server-newgrf:" .. server_id, newgrfs_indexed, "EX", ttl_server)
+add_to_stream("update-newgrf", '{"server_id": "' .. server_id .. '", "newgrfs_indexed": ' .. newgrfs_indexed .. "}")
+redis.call("SET", "gc-server:" .. server_id, info, "EX", ttl_server)
+redis.call("ZADD", "ms-index:gc-server", expire, server_id)
+add_to_stream("update", '{"server_id": "' .. server_id .. '", "info": ' .. info .. "}")
+
+-- Track this IP based on the server_id.
+local direct_key = "gc-direct-" .. type .. ":" .. server_id
+redis.call("ZADD", "ms-index:gc-direct-" .. type, expire, server_id)
+if redis.call("EXPIRE", direct_key, ttl_server) == 0 then
+    redis.call("SET", direct_key, '{"ip": "' .. server_ip .. '", "port": ' .. server_port .. "}", "EX", ttl_server)
+    add_to_stream(
+        "new-direct-ip",
+        '{"server_id": "' .. server_id .. '", "type": "' .. type .. '", "ip": "' .. server_ip
+        .. '", "port": ' .. server_port .. "}"
+    )
+end
+
+if #events > 0 then
+    redis.call(
+        "XADD", "gc-stream", "MAXLEN", "~", "1000", "*",
+        "gc-id", "-1", "type", "batch", "version", "2", "payload", "[" .. table.concat(events, ", ") .. "]"
+    )
+end
+
+local result = {server_id}
+for _, index in ipairs(indexes) do
+    result[#result + 1] = index
+end
+return result
+"""
+
+# Renew the lease if we already hold it; otherwise only take it if nobody does.
+LEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return redis.call("SET", KEYS[1], ARGV[1], "NX", "PX", ARGV[2])
+"""
 
 
 def md5sum(value):
@@ -32,108 +182,147 @@ def _get_server_id(server_ip, server_port):
         return md5sum(f"{server_ip}:{server_port}")
 
 
+def _convert_server_to_entry(server_id, info_str, newgrfs_indexed_str, direct_ipv4_str, direct_ipv6_str):
+    if info_str is None or newgrfs_indexed_str is None:
+        return None
+
+    info = json.loads(info_str)
+    if info["game_type"] != 1:  # List only GameType.PUBLIC servers.
+        return None
+    if info["connection_type"] == 1:  # Do not list ConnectionType.ISOLATED servers.
+        return None
+
+    info["newgrfs"] = json.loads(newgrfs_indexed_str)
+
+    entry = {
+        "info": info,
+        "server_id": server_id,
+    }
+
+    if direct_ipv4_str:
+        direct_ipv4 = json.loads(direct_ipv4_str)
+        entry["ipv4"] = {
+            "ip": direct_ipv4["ip"],
+            "port": direct_ipv4["port"],
+        }
+
+    if direct_ipv6_str:
+        direct_ipv6 = json.loads(direct_ipv6_str)
+        entry["ipv6"] = {
+            "ip": direct_ipv6["ip"],
+            "port": direct_ipv6["port"],
+        }
+
+    return entry
+
+
 class Database(DatabaseInterface):
     def __init__(self):
         self._redis = aioredis.from_url(_redis_url, decode_responses=True)
+        self._newgrf_cache = Cache(NEWGRF_CACHE_SIZE, self._refresh_newgrfs)
+        self._tokens = Cache(TOKEN_CACHE_SIZE, self._refresh_tokens)
+        self._register_script = self._redis.register_script(REGISTER_SCRIPT)
 
     async def add_to_stream(self, entry_type, payload):
-        await self._redis.xadd(
-            "gc-stream", {"gc-id": -1, "type": entry_type, "payload": json.dumps(payload)}, maxlen=1000
-        )
+        if _redis_stream_format == 1:
+            entry = {"gc-id": -1, "type": entry_type, "payload": json.dumps(payload)}
+        else:
+            entry = {
+                "gc-id": -1,
+                "type": "batch",
+                "version": _redis_stream_format,
+                "payload": json.dumps([{"type": entry_type, "payload": payload}]),
+            }
+
+        await self._redis.xadd("gc-stream", entry, maxlen=1000)
 
     async def check_session_key_token(self, session_key, token):
-        ms_token = await self._redis.get(f"ms-session-key:{session_key}")
+        ms_token = self._tokens.get(session_key, NOT_CACHED, touch=False)
+        if ms_token is NOT_CACHED:
+            ms_token = await self._redis.get(f"ms-session-key:{session_key}")
+
+            ttl = TOKEN_CACHE_NEGATIVE_TTL if ms_token is None else TOKEN_CACHE_TTL
+            self._tokens.put(session_key, ms_token, ttl)
+
         if ms_token is None:
-            return False
+            return None
 
         if ms_token != str(token):
             return False
 
-        await self._redis.expire(f"ms-session-key:{session_key}", TTL_SERVER)
+        # The lifetime is extended with the next refresh of the cache.
+        self._tokens.touch(session_key)
         return True
 
     async def store_session_key_token(self, session_key, token):
         await self._redis.set(f"ms-session-key:{session_key}", token, ex=TTL_SERVER)
+        self._tokens.put(session_key, str(token), TOKEN_CACHE_TTL)
+
+    async def _refresh_tokens(self, tokens):
+        # Only session-keys with a matching token are touched.
+        session_keys = [session_key for session_key, _ in tokens]
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for session_key in session_keys:
+                pipe.expire(f"ms-session-key:{session_key}", TTL_SERVER)
+            results = await pipe.execute()
+
+        # Expired after all; look it up again next time.
+        for session_key, result in zip(session_keys, results):
+            if not result:
+                self._tokens.forget(session_key)
+
+    async def check_session_key_in_use(self, session_key):
+        return bool(await self._redis.exists(f"ms-server-id:{session_key}"))
 
     async def server_online(self, session_key, server_ip, server_port, info):
         # Don't accept servers with empty revision or name.
         if info["openttd_version"] == "" or info["name"] == "":
             return False
 
-        # server_offline() doesn't get the session_key, so we need a reverse lookup.
-        await self._redis.set(f"ms-session-id:{server_ip}:{server_port}", session_key, ex=TTL_SERVER)
-
-        # Create a server-id based on the first ip/port we see of this server.
-        # This means the server-id remains mostly stable between restarts.
-        server_id = await self._redis.get(f"ms-server-id:{session_key}")
-        if server_id is None:
-            server_id = _get_server_id(server_ip, server_port)
-        await self._redis.set(f"ms-server-id:{session_key}", server_id, ex=TTL_SERVER)
-
         info["game_type"] = 1  # Public
         info["connection_type"] = 2  # Direct-IP
 
         newgrfs = info["newgrfs"]
         del info["newgrfs"]
 
-        # Convert the NewGRF list to an indexed list, as expected by the
-        # Game Coordinator.
-        newgrfs_indexed = []
-        for newgrf in newgrfs:
-            newgrf_lookup_str = await self._redis.get(f"gc-newgrf:{newgrf['grfid']}-{newgrf['md5sum']}")
-            if newgrf_lookup_str is not None:
-                newgrf_lookup = json.loads(newgrf_lookup_str)
-
-                # Make sure the entry lives a bit longer.
-                await self._redis.expire(f"gc-newgrf:{newgrf['grfid']}-{newgrf['md5sum']}", TTL_NEWGRF)
-                newgrfs_indexed.append(newgrf_lookup["index"])
-                continue
-
-            newgrf_lookup = {
-                "index": await self._redis.incr("gc-newgrf-counter"),
-                "name": None,
-            }
-            res = await self._redis.set(
-                f"gc-newgrf:{newgrf['grfid']}-{newgrf['md5sum']}", json.dumps(newgrf_lookup), nx=True, ex=TTL_NEWGRF
-            )
-            if res is not None:
-                await self.add_to_stream("newgrf-added", {"index": newgrf_lookup["index"], "newgrf": newgrf})
-                newgrfs_indexed.append(newgrf_lookup["index"])
-                continue
-
-            # Another instance sneaked in between our get and set, so fetch
-            # the key again. This time it is guaranteed to exist.
-            newgrf_lookup_str = await self._redis.get(f"gc-newgrf:{newgrf['grfid']}-{newgrf['md5sum']}")
-            newgrf_lookup = json.loads(newgrf_lookup_str)
-
-            await self._redis.expire(f"gc-newgrf:{newgrf['grfid']}-{newgrf['md5sum']}", TTL_NEWGRF)
-            newgrfs_indexed.append(newgrf_lookup["index"])
-
-        # Update the information of this server.
-        await self._redis.set(f"gc-server-newgrf:{server_id}", json.dumps(newgrfs_indexed), ex=TTL_SERVER)
-        await self.add_to_stream("update-newgrf", {"server_id": server_id, "newgrfs_indexed": newgrfs_indexed})
-        await self._redis.set(f"gc-server:{server_id}", json.dumps(info), ex=TTL_SERVER)
-        await self.add_to_stream("update", {"server_id": server_id, "info": info})
-
-        # Track this IP based on the server_id.
+        # The whole registration is done in a single script; see REGISTER_SCRIPT.
         type = "ipv6" if isinstance(server_ip, ipaddress.IPv6Address) else "ipv4"
-        res = await self._redis.expire(f"gc-direct-{type}:{server_id}", TTL_SERVER)
-        if res == 0:
-            await self._redis.set(
-                f"gc-direct-{type}:{server_id}", json.dumps({"ip": str(server_ip), "port": server_port}), ex=TTL_SERVER
-            )
-            await self.add_to_stream(
-                "new-direct-ip",
-                {
-                    "server_id": server_id,
-                    "type": type,
-                    "ip": str(server_ip),
-                    "port": server_port,
-                },
-            )
+        args = [
+            session_key,
+            str(server_ip),
+            server_port,
+            _get_server_id(server_ip, server_port),
+            type,
+            json.dumps(info),
+            TTL_SERVER,
+            TTL_NEWGRF,
+            time.time() + TTL_SERVER,
+            _redis_stream_format,
+        ]
+        newgrf_keys = [f"{newgrf['grfid']}-{newgrf['md5sum']}" for newgrf in newgrfs]
+        cached_indexes = [self._newgrf_cache.get(newgrf_key) for newgrf_key in newgrf_keys]
+        for newgrf_key, newgrf, index in zip(newgrf_keys, newgrfs, cached_indexes):
+            args.extend([newgrf_key, json.dumps(newgrf), "" if index is None else index])
+        server_id, *indexes = await self._register_script(args=args)
+
+        # Remember the NewGRFs that were looked up (or created) by the script.
+        for newgrf_key, cached_index, index in zip(newgrf_keys, cached_indexes, indexes):
+            if cached_index is None:
+                self._newgrf_cache.put(newgrf_key, index, NEWGRF_CACHE_TTL)
 
         return True
 
+    async def _refresh_newgrfs(self, newgrfs):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for newgrf_key, _ in newgrfs:
+                pipe.expire(f"gc-newgrf:{newgrf_key}", TTL_NEWGRF)
+            results = await pipe.execute()
+
+        # Removed by someone else; look it up again next time.
+        for (newgrf_key, _), result in zip(newgrfs, results):
+            if not result:
+                self._newgrf_cache.forget(newgrf_key)
+
     async def server_offline(self, server_ip, server_port):
         # Find the session-key of this ip:port combination.
         session_key = await self._redis.get(f"ms-session-id:{server_ip}:{server_port}")
@@ -148,11 +337,54 @@ class Database(DatabaseInterface):
 
         await self._redis.delete(f"gc-direct-ipv4:{server_id}")
         await self._redis.delete(f"gc-direct-ipv6:{server_id}")
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for index in INDEXES:
+                pipe.zrem(index, server_id)
+            await pipe.execute()
 
         # Delete this server.
         if await self._redis.delete(f"gc-server:{server_id}") > 0:
             await self.add_to_stream("delete", {"server_id": server_id})
 
+    async def _get_indexed(self, index):
+        await self._scan_indexes()
+
+        # Expired members are only pruned once in a while; skip them. Keys
+        # can also be removed by others without updating the index; the
+        # callers skip server-ids without a key.
+        return await self._redis.zrangebyscore(index, time.time(), "+inf")
+
+    async def _scan_indexes(self):
+        # Only a single reader scans per interval.
+        if not await self._redis.set("ms-index-scan", 1, nx=True, px=INDEX_SCAN_INTERVAL * 1000):
+            return
+
+        # SCAN, unlike KEYS, doesn't block Redis while going over all keys.
+        found = {index: set() for index in INDEXES}
+        async for key in self._redis.scan_iter(match=INDEX_SCAN_PATTERN, count=INDEX_SCAN_COUNT):
+            for index, prefix in INDEXES.items():
+                if key.startswith(prefix):
+                    found[index].add(key[len(prefix) :])
+
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for index in INDEXES:
+                pipe.zrangebyscore(index, "+inf", "+inf")
+            scanned_before = await pipe.execute()
+
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for (index, server_ids), previous in zip(found.items(), scanned_before):
+                # Their key is gone. A key created during the scan can be
+                # missed too; the next scan adds it again.
+                gone = set(previous) - server_ids
+                if gone:
+                    pipe.zrem(index, *gone)
+
+                server_ids = list(server_ids)
+                for start in range(0, len(server_ids), INDEX_SCAN_COUNT):
+                    batch = server_ids[start : start + INDEX_SCAN_COUNT]
+                    pipe.zadd(index, {server_id: "+inf" for server_id in batch}, gt=True)
+            await pipe.execute()
+
     async def get_server_list_for_client(self, ipv6_list):
         if ipv6_list:
             type = "ipv6"
@@ -161,79 +393,69 @@ class Database(DatabaseInterface):
             type = "ipv4"
             ipcls = ipaddress.IPv4Address
 
+        server_ids = await self._get_indexed(f"ms-index:gc-direct-{type}")
+        if not server_ids:
+            return []
+
         server_list = []
-        direct_ips = await self._redis.keys(f"gc-direct-{type}:*")
-        for direct_ip_key in direct_ips:
-            direct_ip_str = await self._redis.get(direct_ip_key)
+        for direct_ip_str in await self._redis.mget([f"gc-direct-{type}:{server_id}" for server_id in server_ids]):
+            # Removed since the index was updated.
+            if direct_ip_str is None:
+                continue
+
             direct_ip = json.loads(direct_ip_str)
             direct_ip["ip"] = ipcls(direct_ip["ip"])
             server_list.append(direct_ip)
 
         return server_list
 
-    async def get_server_info_for_web(self, server_id):
-        info_str = await self._redis.get(f"gc-server:{server_id}")
-        if info_str is None:
-            return None
+    async def _get_server_entries_for_web(self, server_ids):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for prefix in ("gc-server", "gc-server-newgrf", "gc-direct-ipv4", "gc-direct-ipv6"):
+                pipe.mget([f"{prefix}:{server_id}" for server_id in server_ids])
+            results = await pipe.execute()
 
-        info = json.loads(info_str)
-        if info["game_type"] != 1:  # List only GameType.PUBLIC servers.
-            return None
-        if info["connection_type"] == 1:  # Do not list ConnectionType.ISOLATED servers.
-            return None
-
-        newgrfs_indexed_str = await self._redis.get(f"gc-server-newgrf:{server_id}")
-        newgrfs_indexed = json.loads(newgrfs_indexed_str)
-
-        info["newgrfs"] = newgrfs_indexed
-
-        entry = {
-            "info": info,
-            "server_id": server_id,
-        }
-
-        direct_ipv4_str = await self._redis.get(f"gc-direct-ipv4:{server_id}")
-        if direct_ipv4_str:
-            direct_ipv4 = json.loads(direct_ipv4_str)
-            entry["ipv4"] = {
-                "ip": direct_ipv4["ip"],
-                "port": direct_ipv4["port"],
-            }
+        return [_convert_server_to_entry(server_id, *values) for server_id, *values in zip(server_ids, *results)]
 
-        direct_ipv6_str = await self._redis.get(f"gc-direct-ipv6:{server_id}")
-        if direct_ipv6_str:
-            direct_ipv6 = json.loads(direct_ipv6_str)
-            entry["ipv6"] = {
-                "ip": direct_ipv6["ip"],
-                "port": direct_ipv6["port"],
-            }
-
-        return entry
+    async def get_server_info_for_web(self, server_id):
+        entries = await self._get_server_entries_for_web([server_id])
+        return entries[0]
 
     async def get_server_list_for_web(self):
-        server_list = []
+        server_ids = await self._get_indexed("ms-index:gc-server")
+        if not server_ids:
+            return []
 
-        servers = await self._redis.keys("gc-server:*")
-        for server_key in servers:
-            _, _, server_id = server_key.partition(":")
-            entry = await self.get_server_info_for_web(server_id)
-            if entry is not None:
-                server_list.append(entry)
+        return [entry for entry in await self._get_server_entries_for_web(server_ids) if entry is not None]
 
-        return server_list
+    async def acquire_lease(self, name, owner, duration):
+        return bool(await self._redis.eval(LEASE_SCRIPT, 1, f"ms-lease:{name}", owner, int(duration * 1000)))
 
-    def check_stale_servers(self):
-        # Redis takes care of this for us.
-        pass
+    async def check_stale_servers(self):
+        # Redis expires the keys for us; only the indexes need pruning.
+        now = time.time()
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for index in INDEXES:
+                pipe.zremrangebyscore(index, "-inf", now)
+            await pipe.execute()
 
 
 @click_helper.extend
 @click.option(
     "--redis-url",
-    help="URL of the redis server.",
+    help="URL of the redis server. This has to be a standalone server (or primary); Redis Cluster is not supported.",
     default="redis://localhost",
 )
-def click_database_redis(redis_url):
-    global _redis_url
+@click.option(
+    "--redis-stream-format",
+    help="Format of the entries written to gc-stream. 1 writes an entry per event (understood by every consumer), "
+    "2 writes a single entry with all events of a registration.",
+    type=click.Choice([str(format) for format in STREAM_FORMATS]),
+    default="1",
+    show_default=True,
+)
+def click_database_redis(redis_url, redis_stream_format):
+    global _redis_url, _redis_stream_format
 
     _redis_url = redis_url
+    _redis_stream_format = int(redis_stream_format)
@@ -0,0 +1,419 @@
+import asyncio
+import click
+import concurrent.futures
+import hashlib
+import ipaddress
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from openttd_helpers import click_helper
+
+from .info import (
+    INFO_FIELDS,
+    get_stored_info,
+)
+from .interface import DatabaseInterface
+
+log = logging.getLogger(__name__)
+
+_sqlite_path = None
+
+# After 20 minutes with no advertisement, mark servers as stale.
+STALE_SERVER_TIMEOUT = 60 * 20
+# When entries are forgotten. A server after 20 minutes is marked offline;
+# so 60 minutes is a safe value.
+TTL = 60 * 60
+# How many writes are committed at once (at most).
+WRITE_BATCH_SIZE = 100
+# How long to wait for a lock held by another process, in milliseconds.
+BUSY_TIMEOUT = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS server (
+    session_key INTEGER PRIMARY KEY,
+    token INTEGER,
+    server_id TEXT,
+    info TEXT,
+    ipv4_ip TEXT,
+    ipv4_port INTEGER,
+    ipv6_ip TEXT,
+    ipv6_port INTEGER,
+    online INTEGER NOT NULL DEFAULT 0,
+    time_first_seen REAL,
+    time_last_seen REAL,
+    expire REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS server_online ON server (online);
+CREATE INDEX IF NOT EXISTS server_time_last_seen ON server (time_last_seen);
+
+CREATE TABLE IF NOT EXISTS ip_port (
+    server_id TEXT PRIMARY KEY,
+    session_key INTEGER NOT NULL,
+    family INTEGER NOT NULL,
+    ip TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    online INTEGER NOT NULL,
+    time_last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ip_port_online ON ip_port (online, family);
+CREATE INDEX IF NOT EXISTS ip_port_time_last_seen ON ip_port (time_last_seen);
+
+CREATE TABLE IF NOT EXISTS newgrf (
+    newgrf_id INTEGER PRIMARY KEY,
+    grfid INTEGER NOT NULL,
+    md5sum TEXT NOT NULL,
+    UNIQUE (grfid, md5sum)
+);
+
+CREATE TABLE IF NOT EXISTS server_newgrf (
+    session_key INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    newgrf_id INTEGER NOT NULL,
+    PRIMARY KEY (session_key, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS server_newgrf_newgrf_id ON server_newgrf (newgrf_id);
+
+CREATE TABLE IF NOT EXISTS lease (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expire REAL NOT NULL
+);
+"""
+
+
+def md5sum(value):
+    return hashlib.md5(value.encode()).digest().hex()
+
+
+def _get_server_id(server_ip, server_port):
+    if isinstance(server_ip, ipaddress.IPv6Address):
+        return md5sum(f"[{server_ip}]:{server_port}")
+    else:
+        return md5sum(f"{server_ip}:{server_port}")
+
+
+def _get_key(session_key):
+    # Version 1 session-keys of IPv6 servers contain the whole IP, so they
+    # don't fit in a SQLite integer; those are hashed down to 64 bits.
+    if session_key >= 1 << 64:
+        return int.from_bytes(hashlib.md5(str(session_key).encode()).digest()[:8], "big", signed=True)
+    # SQLite integers are signed; signed session-keys use the highest bit.
+    return session_key - (1 << 64) if session_key >= 1 << 63 else session_key
+
+
+def _connect():
+    connection = sqlite3.connect(_sqlite_path, isolation_level=None)
+    connection.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT}")
+    # With WAL, commits are only synced on checkpoints; a crash can lose the
+    # last few writes, but never corrupts the database.
+    connection.execute("PRAGMA synchronous = NORMAL")
+    return connection
+
+
+class Database(DatabaseInterface):
+    """
+    Keep the servers in a SQLite database.
+
+    All writes go via a single thread, which commits them in batches; reads
+    are done by a pool of threads. This way the event loop never blocks on
+    the database. As the database is in WAL mode, readers don't block the
+    writer, and multiple processes (workers, web_api) can share the file.
+    """
+
+    threads = 4
+
+    def __init__(self):
+        connection = _connect()
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.executescript(SCHEMA)
+        connection.close()
+
+        self._local = threading.local()
+        self._readers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.threads, thread_name_prefix="sqlite-reader"
+        )
+
+        self._writes = queue.SimpleQueue()
+        threading.Thread(target=self._writer, name="sqlite-writer", daemon=True).start()
+
+    async def _read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._readers, self._run_read, func, args)
+
+    def _run_read(self, func, args):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = _connect()
+            self._local.connection = connection
+
+        # Read everything from a single snapshot of the database.
+        connection.execute("BEGIN")
+        try:
+            return func(connection, *args)
+        finally:
+            connection.execute("COMMIT")
+
+    async def _write(self, func, *args):
+        future = concurrent.futures.Future()
+        self._writes.put((func, args, future))
+        return await asyncio.wrap_future(future)
+
+    def _writer(self):
+        connection = _connect()
+
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Every write gets its own savepoint, so a failing write doesn't
+            # take the others in the batch down with it.
+            results = []
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                for func, args, future in batch:
+                    connection.execute("SAVEPOINT write")
+                    try:
+                        result = func(connection, *args)
+                    except Exception as e:
+                        connection.execute("ROLLBACK TO write")
+                        results.append((future, None, e))
+                    else:
+                        results.append((future, result, None))
+                    connection.execute("RELEASE write")
+                connection.execute("COMMIT")
+            except Exception as e:
+                log.exception("Exception while committing %d writes", len(batch))
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                results = [(future, None, e) for _, _, future in batch]
+
+            # Only after the commit the writes are visible for others.
+            for future, result, exception in results:
+                if exception is not None:
+                    future.set_exception(exception)
+                else:
+                    future.set_result(result)
+
+    async def check_session_key_token(self, session_key, token):
+        return await self._read(self._check_session_key_token, _get_key(session_key), token)
+
+    def _check_session_key_token(self, connection, session_key, token):
+        row = connection.execute("SELECT token FROM server WHERE session_key = ?", (session_key,)).fetchone()
+        if row is None:
+            return None
+        return row[0] == token
+
+    async def store_session_key_token(self, session_key, token):
+        await self._write(self._store_session_key_token, _get_key(session_key), token)
+
+    def _store_session_key_token(self, connection, session_key, token):
+        connection.execute(
+            "INSERT INTO server (session_key, token, expire) VALUES (?, ?, ?) "
+            "ON CONFLICT (session_key) DO UPDATE SET token = excluded.token, expire = excluded.expire",
+            (session_key, token, time.time() + TTL),
+        )
+
+    async def check_session_key_in_use(self, session_key):
+        return await self._read(self._check_session_key_in_use, _get_key(session_key))
+
+    def _check_session_key_in_use(self, connection, session_key):
+        row = connection.execute(
+            "SELECT 1 FROM server WHERE session_key = ? AND expire > ?", (session_key, time.time())
+        ).fetchone()
+        return row is not None
+
+    async def server_online(self, session_key, server_ip, server_port, info):
+        # Don't accept servers with empty revision or name.
+        if info["openttd_version"] == "" or info["name"] == "":
+            return False
+
+        fields = get_stored_info(info)
+        newgrfs = [(newgrf["grfid"], newgrf["md5sum"]) for newgrf in fields.pop("newgrfs")]
+
+        await self._write(
+            self._server_online, _get_key(session_key), server_ip, server_port, json.dumps(fields), newgrfs
+        )
+        return True
+
+    def _server_online(self, connection, session_key, server_ip, server_port, info, newgrfs):
+        server_id = _get_server_id(server_ip, server_port)
+        family = 6 if isinstance(server_ip, ipaddress.IPv6Address) else 4
+        now = time.time()
+
+        row = connection.execute("SELECT session_key FROM ip_port WHERE server_id = ?", (server_id,)).fetchone()
+        if row is not None and row[0] != session_key:
+            # This IP:port is already known under another session-key. Most
+            # likely this means the server never unregistered itself (due
+            # to a server-crash for example). This means we can now consider
+            # the original server offline, and this new key will track the
+            # new server again.
+            connection.execute("UPDATE server SET online = 0 WHERE session_key = ?", (row[0],))
+
+        connection.execute(
+            "INSERT OR REPLACE INTO ip_port (server_id, session_key, family, ip, port, online, time_last_seen) "
+            "VALUES (?, ?, ?, ?, ?, 1, ?)",
+            (server_id, session_key, family, str(server_ip), server_port, now),
+        )
+
+        connection.execute(
+            "INSERT INTO server (session_key, expire) VALUES (?, ?) ON CONFLICT (session_key) DO NOTHING",
+            (session_key, now),
+        )
+        # Make sure the IPv4 variant of the server-id always wins.
+        connection.execute(
+            f"UPDATE server SET info = ?, online = 1, ipv{family}_ip = ?, ipv{family}_port = ?, "
+            "time_first_seen = COALESCE(time_first_seen, ?), time_last_seen = ?, expire = ?, "
+            "server_id = CASE WHEN ? = 4 OR server_id IS NULL THEN ? ELSE server_id END "
+            "WHERE session_key = ?",
+            (info, str(server_ip), server_port, now, now, now + TTL, family, server_id, session_key),
+        )
+
+        connection.executemany("INSERT OR IGNORE INTO newgrf (grfid, md5sum) VALUES (?, ?)", newgrfs)
+        connection.execute("DELETE FROM server_newgrf WHERE session_key = ?", (session_key,))
+        connection.executemany(
+            "INSERT INTO server_newgrf (session_key, position, newgrf_id) "
+            "SELECT ?, ?, newgrf_id FROM newgrf WHERE grfid = ? AND md5sum = ?",
+            [(session_key, position, grfid, md5sum) for position, (grfid, md5sum) in enumerate(newgrfs)],
+        )
+
+    async def server_offline(self, server_ip, server_port):
+        await self._write(self._server_offline, _get_server_id(server_ip, server_port))
+
+    def _server_offline(self, connection, server_id):
+        row = connection.execute("SELECT session_key FROM ip_port WHERE server_id = ?", (server_id,)).fetchone()
+        if row is None:
+            return
+
+        now = time.time()
+        connection.execute(
+            "UPDATE server SET online = 0, time_last_seen = ?, expire = ? WHERE session_key = ?",
+            (now, now + TTL, row[0]),
+        )
+        connection.execute(
+            "UPDATE ip_port SET online = 0, time_last_seen = ? WHERE server_id = ?",
+            (now, server_id),
+        )
+
+    async def get_server_list_for_client(self, ipv6_list):
+        return await self._read(self._get_server_list_for_client, ipv6_list)
+
+    def _get_server_list_for_client(self, connection, ipv6_list):
+        rows = connection.execute(
+            "SELECT ip, port FROM ip_port WHERE online = 1 AND family = ?", (6 if ipv6_list else 4,)
+        )
+        return [{"ip": ipaddress.ip_address(ip), "port": port} for ip, port in rows]
+
+    def _get_servers(self, connection, where, params):
+        servers = connection.execute(
+            "SELECT session_key, server_id, info, ipv4_ip, ipv4_port, ipv6_ip, ipv6_port FROM server "
+            f"WHERE info IS NOT NULL AND {where}",
+            params,
+        ).fetchall()
+        if not servers:
+            return []
+
+        newgrfs = {}
+        for session_key, grfid, md5sum in connection.execute(
+            "SELECT server_newgrf.session_key, grfid, md5sum FROM server_newgrf "
+            "JOIN newgrf USING (newgrf_id) "
+            f"WHERE server_newgrf.session_key IN (SELECT session_key FROM server WHERE info IS NOT NULL AND {where}) "
+            "ORDER BY server_newgrf.session_key, position",
+            params,
+        ):
+            newgrfs.setdefault(session_key, []).append({"grfid": grfid, "md5sum": md5sum})
+
+        entries = []
+        for session_key, server_id, info_str, ipv4_ip, ipv4_port, ipv6_ip, ipv6_port in servers:
+            fields = json.loads(info_str)
+            fields["newgrfs"] = newgrfs.get(session_key, [])
+
+            entry = {
+                "info": {name: fields.get(name) for name in INFO_FIELDS},
+                "server_id": server_id,
+            }
+            if ipv4_ip is not None:
+                entry["ipv4"] = {"ip": ipv4_ip, "port": ipv4_port}
+            if ipv6_ip is not None:
+                entry["ipv6"] = {"ip": ipv6_ip, "port": ipv6_port}
+            entries.append(entry)
+
+        return entries
+
+    async def get_server_info_for_web(self, server_id):
+        return await self._read(self._get_server_info_for_web, server_id)
+
+    def _get_server_info_for_web(self, connection, server_id):
+        entries = self._get_servers(
+            connection, "session_key = (SELECT session_key FROM ip_port WHERE server_id = ?)", (server_id,)
+        )
+        return entries[0] if entries else None
+
+    async def get_server_list_for_web(self):
+        return await self._read(self._get_servers, "online = 1", ())
+
+    async def check_stale_servers(self):
+        await self._write(self._check_stale_servers)
+
+    def _check_stale_servers(self, connection):
+        now = time.time()
+        seen_before = now - STALE_SERVER_TIMEOUT
+
+        cursor = connection.execute(
+            "UPDATE server SET online = 0 WHERE online = 1 AND time_last_seen < ?",
+            (seen_before,),
+        )
+        if cursor.rowcount:
+            log.info("Marked %d servers as stale", cursor.rowcount)
+        connection.execute(
+            "UPDATE ip_port SET online = 0 WHERE online = 1 AND time_last_seen < ?",
+            (seen_before,),
+        )
+
+        # Forget about everything that has been offline for a while.
+        connection.execute("DELETE FROM server WHERE online = 0 AND expire < ?", (now,))
+        connection.execute("DELETE FROM ip_port WHERE online = 0 AND time_last_seen < ?", (now - TTL,))
+        connection.execute("DELETE FROM server_newgrf WHERE session_key NOT IN (SELECT session_key FROM server)")
+        connection.execute("DELETE FROM newgrf WHERE newgrf_id NOT IN (SELECT newgrf_id FROM server_newgrf)")
+
+    async def acquire_lease(self, name, owner, duration):
+        return await self._write(self._acquire_lease, name, owner, duration)
+
+    def _acquire_lease(self, connection, name, owner, duration):
+        now = time.time()
+        # Only take over the lease if it is ours already, or has expired.
+        cursor = connection.execute(
+            "INSERT INTO lease (name, owner, expire) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expire = excluded.expire "
+            "WHERE lease.owner = excluded.owner OR lease.expire < ?",
+            (name, owner, now + duration, now),
+        )
+        return cursor.rowcount > 0
+
+
+@click_helper.extend
+@click.option(
+    "--sqlite-path",
+    help="Path of the SQLite database file.",
+    default="master-server.sqlite",
+    show_default=True,
+    type=click.Path(dir_okay=False),
+)
+@click.option(
+    "--sqlite-threads",
+    help="Amount of threads reading from the SQLite database.",
+    default=4,
+    show_default=True,
+    metavar="COUNT",
+)
+def click_database_sqlite(sqlite_path, sqlite_threads):
+    global _sqlite_path
+
+    _sqlite_path = sqlite_path
+    Database.threads = sqlite_threads
@@ -0,0 +1,94 @@
+import asyncio
+import ipaddress
+
+import pytest
+
+from . import (
+    dynamodb,
+    memory,
+    sqlite,
+)
+
+
+@pytest.fixture
+def backend(request, monkeypatch, tmp_path):
+    monkeypatch.setattr(memory, "_snapshot", None)
+    monkeypatch.setattr(sqlite, "_sqlite_path", str(tmp_path / "master-server.sqlite"))
+
+    if request.param is dynamodb:
+        request.getfixturevalue("mock_dynamodb")
+    return request.param
+
+
+@pytest.mark.parametrize("backend", [memory, sqlite, dynamodb], indirect=True)
+def test_backend(backend, build_info, monkeypatch):
+    ipv4 = ipaddress.IPv4Address("192.0.2.1")
+    ipv6 = ipaddress.IPv6Address("2001:db8::1")
+    signed_key = (1 << 63) | (2 << 24)
+
+    async def run():
+        db = backend.Database()
+
+        await db.store_session_key_token(1 << 24, 5)
+        assert await db.check_session_key_token(1 << 24, 5)
+        assert await db.check_session_key_token(1 << 24, 6) is False
+        assert await db.check_session_key_token(2 << 24, 5) is None
+
+        assert not await db.server_online(1 << 24, ipv4, 3979, build_info(""))
+        results = await asyncio.gather(
+            db.server_online(1 << 24, ipv4, 3979, build_info("server", [3, 1, 2])),
+            db.server_online(1 << 24, ipv6, 3979, build_info("server", [3, 1, 2])),
+        )
+        assert results == [True, True]
+        assert await db.get_server_list_for_client(False) == [{"ip": ipv4, "port": 3979}]
+        assert await db.get_server_list_for_client(True) == [{"ip": ipv6, "port": 3979}]
+
+        servers = await db.get_server_list_for_web()
+        assert len(servers) == 1
+        assert servers[0]["ipv4"] == {"ip": "192.0.2.1", "port": 3979}
+        assert servers[0]["ipv6"] == {"ip": "2001:db8::1", "port": 3979}
+        assert [newgrf["grfid"] for newgrf in servers[0]["info"]["newgrfs"]] == [3, 1, 2]
+        assert servers[0]["info"]["newgrfs"][0]["md5sum"] == "03" * 16
+        assert "ticks_playing" not in servers[0]["info"]
+        assert await db.get_server_info_for_web(servers[0]["server_id"]) == servers[0]
+        assert await db.get_server_info_for_web("unknown") is None
+
+        # Re-registering an online server (v1 always uses token 0) keeps it online.
+        await db.store_session_key_token(1 << 24, 0)
+        await db.check_stale_servers()
+        assert [server["info"]["name"] for server in await db.get_server_list_for_web()] == ["server"]
+
+        # Version 1 session-keys of IPv6 servers contain the whole IP.
+        v1_ipv6_key = int(ipv6) | (3980 << 32)
+        await db.store_session_key_token(v1_ipv6_key, 0)
+        assert await db.check_session_key_token(v1_ipv6_key, 0)
+        assert await db.server_online(v1_ipv6_key, ipv6, 3980, build_info("v1"))
+        assert {server["port"] for server in await db.get_server_list_for_client(True)} == {3979, 3980}
+        assert sorted(server["info"]["name"] for server in await db.get_server_list_for_web()) == ["server", "v1"]
+        await db.server_offline(ipv6, 3980)
+
+        # Another server taking over the IP:port marks the first offline.
+        # Signed session-keys are never stored, so this creates the server.
+        assert not await db.check_session_key_in_use(signed_key)
+        assert await db.server_online(signed_key, ipv4, 3979, build_info("other"))
+        assert await db.check_session_key_in_use(signed_key)
+        assert [server["info"]["name"] for server in await db.get_server_list_for_web()] == ["other"]
+
+        await db.server_offline(ipv4, 3979)
+        assert await db.get_server_list_for_client(False) == []
+        assert await db.get_server_list_for_web() == []
+
+        assert await db.server_online(signed_key, ipv4, 3979, build_info("other"))
+        monkeypatch.setattr(backend, "STALE_SERVER_TIMEOUT", -1)
+        await db.check_stale_servers()
+        assert await db.get_server_list_for_client(True) == []
+        assert await db.get_server_list_for_web() == []
+
+        assert await db.acquire_lease("stale-check", "a", 60)
+        assert not await db.acquire_lease("stale-check", "b", 60)
+        assert await db.acquire_lease("stale-check", "a", 60)
+        # Once expired, someone else can take over.
+        assert await db.acquire_lease("stale-check", "a", -1)
+        assert await db.acquire_lease("stale-check", "b", 60)
+
+    asyncio.run(run())
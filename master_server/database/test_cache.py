@@ -0,0 +1,69 @@
+import asyncio
+
+from . import cache as cache_module
+from .cache import Cache
+
+
+def test_cache(monkeypatch):
+    monkeypatch.setattr(cache_module, "REFRESH_INTERVAL", 0)
+    refreshed = []
+
+    async def refresh(entries):
+        refreshed.extend(sorted(entries))
+        # The first entry was removed in the meantime.
+        cache.forget(entries[0][0])
+
+    async def run():
+        assert cache.get("a") is None
+        cache.put("a", "1", 60)
+        cache.put("b", "2", 60)
+        assert cache.get("a") == "1"
+        assert cache.get("a") == "1"
+
+        # "b" is the least recently used, so it makes place for "c".
+        cache.put("c", "3", 60)
+        assert cache.get("b") is None
+
+        while not refreshed:
+            await asyncio.sleep(0)
+
+    cache = Cache(2, refresh)
+    asyncio.run(run())
+
+    assert refreshed == [("a", "1")]
+    assert cache.get("a") is None
+    assert cache.get("c") == "3"
+
+
+def test_cache_expire():
+    cache = Cache(10)
+    cache.put("a", None, 60)
+    cache.put("b", "2", -1)
+
+    missing = object()
+    assert cache.get("a", missing) is None
+    assert cache.get("b", missing) is missing
+
+
+def test_cache_touch(monkeypatch):
+    monkeypatch.setattr(cache_module, "REFRESH_INTERVAL", 0)
+    refreshed = []
+
+    async def refresh(entries):
+        refreshed.extend(sorted(entries))
+
+    async def run():
+        cache.put("a", "1", 60)
+        cache.put("b", "2", 60)
+        # Only entries that are touched are refreshed.
+        assert cache.get("a", touch=False) == "1"
+        assert cache.get("b", touch=False) == "2"
+        cache.touch("b")
+
+        while not refreshed:
+            await asyncio.sleep(0)
+
+    cache = Cache(2, refresh)
+    asyncio.run(run())
+
+    assert refreshed == [("b", "2")]
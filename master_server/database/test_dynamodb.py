@@ -0,0 +1,145 @@
+import asyncio
+import click
+import functools
+import ipaddress
+import threading
+import time
+
+import pytest
+
+from . import (
+    dynamodb,
+    heartbeat,
+)
+from .dynamodb import Database
+
+
+def test_dynamodb_client_list_fallback(build_info, mock_dynamodb):
+    ipv4 = ipaddress.IPv4Address("192.0.2.1")
+    ipv6 = ipaddress.IPv6Address("2001:db8::1")
+
+    # Tables from before the client-list index was added don't have it.
+    db = Database()
+    db._connection.client.update_table(
+        TableName="MSU-ip-port", GlobalSecondaryIndexUpdates=[{"Delete": {"IndexName": "client_list_view"}}]
+    )
+
+    async def run():
+        db = Database()
+        assert not db._use_client_list
+
+        await db.store_session_key_token(1 << 24, 5)
+        assert await db.server_online(1 << 24, ipv4, 3979, build_info("server"))
+        assert await db.server_online(1 << 24, ipv6, 3979, build_info("server"))
+        assert await db.get_server_list_for_client(False) == [{"ip": ipv4, "port": 3979}]
+        assert await db.get_server_list_for_client(True) == [{"ip": ipv6, "port": 3979}]
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("online_shards", [0, 2])
+def test_dynamodb_check_stale_servers(build_info, mock_dynamodb, monkeypatch, online_shards):
+    monkeypatch.setattr(dynamodb, "STALE_PAGE_SIZE", 2)
+    monkeypatch.setattr(Database, "threads", 8)
+    monkeypatch.setattr(Database, "online_shards", online_shards)
+    monkeypatch.setattr(Database, "migrate", True)
+
+    db = Database()
+
+    # Track how many entries are marked stale at the same time.
+    lock = threading.Lock()
+    active = []
+    max_active = []
+    mark_stale = db._mark_stale
+
+    def tracked_mark_stale(*args):
+        with lock:
+            active.append(None)
+            max_active.append(len(active))
+        time.sleep(0.01)
+        mark_stale(*args)
+        with lock:
+            active.pop()
+
+    monkeypatch.setattr(db, "_mark_stale", tracked_mark_stale)
+
+    async def run():
+        for i in range(1, 8):
+            session_key = i << 24
+            await db.store_session_key_token(session_key, 5)
+            assert await db.server_online(session_key, ipaddress.IPv4Address(f"192.0.2.{i}"), 3979, build_info("s"))
+        assert len(await db.get_server_list_for_web()) == 7
+
+        # Nothing is stale yet.
+        await db.check_stale_servers()
+        assert not max_active
+        assert len(await db.get_server_list_for_web()) == 7
+
+        # Every page of every shard is visited, but only threads // 4
+        # entries are updated at the same time.
+        monkeypatch.setattr(dynamodb, "STALE_SERVER_TIMEOUT", -1)
+        await db.check_stale_servers()
+        assert len(max_active) == 7 * 2
+        assert max(max_active) == 2
+        assert await db.get_server_list_for_web() == []
+        assert await db.get_server_list_for_client(False) == []
+
+    asyncio.run(run())
+
+
+def test_dynamodb_online_shards_without_index(mock_dynamodb, monkeypatch):
+    # Tables from before sharding was added don't have the shard index.
+    db = Database()
+    for table_name in ("MSU-server", "MSU-ip-port"):
+        db._connection.client.update_table(
+            TableName=table_name, GlobalSecondaryIndexUpdates=[{"Delete": {"IndexName": "online_shard_view"}}]
+        )
+
+    # Sharding needs an index that is only created by --dynamodb-migrate.
+    monkeypatch.setattr(Database, "online_shards", 2)
+    with pytest.raises(click.UsageError):
+        Database()
+
+    monkeypatch.setattr(Database, "migrate", True)
+    Database()
+
+    monkeypatch.setattr(Database, "migrate", False)
+    Database()
+
+
+def test_dynamodb_heartbeats_coalesce(build_info, mock_dynamodb, monkeypatch):
+    monkeypatch.setattr(heartbeat, "FLUSH_DELAY", 0)
+    ipv4 = ipaddress.IPv4Address("192.0.2.1")
+    ipv6 = ipaddress.IPv6Address("2001:db8::1")
+
+    db = Database()
+
+    async def run():
+        await db.store_session_key_token(1 << 24, 5)
+        assert await db.server_online(1 << 24, ipv4, 3979, build_info("server"))
+        assert await db.server_online(1 << 24, ipv6, 3979, build_info("server"))
+
+        # Count the writes from here on.
+        writes = []
+        for model in (dynamodb.Server, dynamodb.IpPort):
+            monkeypatch.setattr(model, "update", functools.partialmethod(count_write, model.update, writes))
+
+        # The IPv4 and IPv6 announcement (and a retry of one of them) only
+        # write the server entry once.
+        info = build_info("server")
+        info["game_date"] = 20
+        results = await asyncio.gather(
+            db.server_online(1 << 24, ipv4, 3979, info),
+            db.server_online(1 << 24, ipv6, 3979, info),
+            db.server_online(1 << 24, ipv4, 3979, info),
+        )
+        assert results == [True, True, True]
+        assert sorted(writes) == ["IpPort", "IpPort", "Server"]
+
+        assert [server["info"]["game_date"] for server in await db.get_server_list_for_web()] == [20]
+
+    def count_write(self, update, writes, **kwargs):
+        writes.append(type(self).__name__)
+        return update(self, **kwargs)
+
+    asyncio.run(run())
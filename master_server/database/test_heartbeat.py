@@ -0,0 +1,37 @@
+import asyncio
+
+from . import heartbeat
+from .heartbeat import (
+    Heartbeats,
+    get_fingerprint,
+)
+
+
+def test_heartbeats_coalesce(monkeypatch):
+    monkeypatch.setattr(heartbeat, "FLUSH_DELAY", 0)
+    flushed = []
+
+    async def flush(entries):
+        flushed.extend(entries)
+        # The first server could not be refreshed.
+        return [False] + [True] * (len(entries) - 1)
+
+    async def run():
+        fingerprint = get_fingerprint(1, {"name": "server", "game_date": 1})
+        assert fingerprint == get_fingerprint(1, {"name": "server", "game_date": 2})
+        assert fingerprint != get_fingerprint(2, {"name": "server", "game_date": 1})
+
+        assert heartbeats.get("a", fingerprint) is None
+        heartbeats.remember("a", fingerprint, "data-a")
+        heartbeats.remember("b", fingerprint, "data-b")
+        assert heartbeats.get("a", fingerprint) == "data-a"
+        assert heartbeats.get("a", get_fingerprint(1, {"name": "other"})) is None
+
+        return await asyncio.gather(heartbeats.refresh("a", 1), heartbeats.refresh("a", 2), heartbeats.refresh("b", 3))
+
+    heartbeats = Heartbeats(flush)
+    assert asyncio.run(run()) == [False, False, True]
+
+    assert flushed == [("a", 2), ("b", 3)]
+    assert heartbeats.get("a", get_fingerprint(1, {"name": "server"})) is None
+    assert heartbeats.get("b", get_fingerprint(1, {"name": "server"})) == "data-b"
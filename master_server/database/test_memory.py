@@ -0,0 +1,80 @@
+import asyncio
+import ipaddress
+import threading
+
+from . import memory
+from .memory import Database
+
+
+def test_memory_snapshot(build_info, monkeypatch, tmp_path):
+    monkeypatch.setattr(memory, "_snapshot", str(tmp_path / "snapshot.json"))
+    monkeypatch.setattr(memory, "_snapshot_interval", 0)
+    ipv4 = ipaddress.IPv4Address("192.0.2.1")
+
+    async def run():
+        db = Database()
+        await db.store_session_key_token(1 << 24, 5)
+        assert await db.server_online(1 << 24, ipv4, 3979, build_info("server"))
+
+        # Wait for the snapshot, and load it in a new instance.
+        while not (tmp_path / "snapshot.json").exists():
+            await asyncio.sleep(0.01)
+        loaded = Database()
+        assert await loaded.get_server_list_for_web() == await db.get_server_list_for_web()
+        assert await loaded.get_server_list_for_client(False) == [{"ip": ipv4, "port": 3979}]
+        assert await loaded.check_session_key_token(1 << 24, 5)
+
+    asyncio.run(run())
+
+
+def test_memory_snapshot_unchanged(monkeypatch, tmp_path):
+    monkeypatch.setattr(memory, "_snapshot", str(tmp_path / "snapshot.json"))
+    monkeypatch.setattr(memory, "_snapshot_interval", 0)
+    writes = []
+    monkeypatch.setattr(Database, "_write_snapshot", lambda self, data: writes.append(data))
+
+    async def run():
+        db = Database()
+        await db.store_session_key_token(1 << 24, 5)
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+        assert len(writes) == 1
+
+        await db.check_stale_servers()
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+        assert len(writes) == 1
+
+    asyncio.run(run())
+
+
+def test_memory_snapshot_follow(build_info, monkeypatch, tmp_path):
+    monkeypatch.setattr(memory, "_snapshot", str(tmp_path / "snapshot.json"))
+    monkeypatch.setattr(memory, "_snapshot_interval", 0)
+    ipv4 = ipaddress.IPv4Address("192.0.2.1")
+
+    threads = set()
+    read_snapshot = Database._read_snapshot
+
+    def record_thread(self, known_mtime):
+        threads.add(threading.current_thread())
+        return read_snapshot(self, known_mtime)
+
+    monkeypatch.setattr(Database, "_read_snapshot", record_thread)
+
+    async def run():
+        db = Database()
+        follower = Database()
+        await db.store_session_key_token(1 << 24, 5)
+        assert await db.server_online(1 << 24, ipv4, 3979, build_info("server"))
+
+        # The follower picks up every new snapshot.
+        for name in ("server", "renamed"):
+            assert await db.server_online(1 << 24, ipv4, 3979, build_info(name))
+            while [server["info"]["name"] for server in await follower.get_server_list_for_web()] != [name]:
+                await asyncio.sleep(0.01)
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+    # The snapshot is never read on the event loop.
+    assert threads and threading.main_thread() not in threads
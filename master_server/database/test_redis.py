@@ -0,0 +1,151 @@
+import asyncio
+import fakeredis
+import ipaddress
+import json
+import pytest
+
+from . import (
+    cache as cache_module,
+    redis,
+)
+from .redis import (
+    Database,
+    _get_server_id,
+)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        redis.aioredis, "from_url", lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs)
+    )
+
+
+def expected_events(server_id, info, newgrfs_indexed, new=True):
+    events = []
+    if new:
+        for index, newgrf in zip(newgrfs_indexed, info["newgrfs"]):
+            events.append(("newgrf-added", {"index": index, "newgrf": newgrf}))
+
+    info = {name: value for name, value in info.items() if name != "newgrfs"}
+    info["game_type"] = 1
+    info["connection_type"] = 2
+
+    events.append(("update-newgrf", {"server_id": server_id, "newgrfs_indexed": newgrfs_indexed}))
+    events.append(("update", {"server_id": server_id, "info": info}))
+    if new:
+        events.append(("new-direct-ip", {"server_id": server_id, "type": "ipv4", "ip": "192.0.2.1", "port": 3979}))
+    return events
+
+
+@pytest.mark.parametrize("stream_format", [1, 2])
+def test_redis_server_online(stream_format, build_info, fake_redis, monkeypatch):
+    monkeypatch.setattr(redis, "_redis_stream_format", stream_format)
+    ipv4 = ipaddress.IPv4Address("192.0.2.1")
+    server_id = _get_server_id(ipv4, 3979)
+
+    async def run():
+        db = Database()
+
+        # The second time, the NewGRFs and the direct-IP are known already.
+        events = []
+        for new in (True, False):
+            info = build_info("server", [1, 2])
+            events.append(expected_events(server_id, info, [1, 2], new=new))
+            assert await db.server_online(1 << 24, ipv4, 3979, info)
+
+        # The script builds its JSON by hand; it has to be identical to
+        # what json.dumps() makes.
+        info = build_info("server", [1, 2])
+        del info["newgrfs"]
+        info["game_type"] = 1
+        info["connection_type"] = 2
+        assert await db._redis.get(f"gc-server:{server_id}") == json.dumps(info)
+        assert await db._redis.get(f"gc-server-newgrf:{server_id}") == json.dumps([1, 2])
+        assert await db._redis.get(f"gc-direct-ipv4:{server_id}") == json.dumps({"ip": "192.0.2.1", "port": 3979})
+        assert await db._redis.get(f"gc-newgrf:1-{'01' * 16}") == json.dumps({"index": 1, "name": None})
+        assert await db._redis.get("ms-session-id:192.0.2.1:3979") == str(1 << 24)
+        assert await db._redis.get(f"ms-server-id:{1 << 24}") == server_id
+        assert await db.check_session_key_in_use(1 << 24)
+        assert not await db.check_session_key_in_use(2 << 24)
+
+        entries = [fields for _, fields in await db._redis.xrange("gc-stream")]
+        if stream_format == 1:
+            assert entries == [
+                {"gc-id": "-1", "type": entry_type, "payload": json.dumps(payload)}
+                for registration in events
+                for entry_type, payload in registration
+            ]
+        else:
+            assert entries == [
+                {
+                    "gc-id": "-1",
+                    "type": "batch",
+                    "version": "2",
+                    "payload": json.dumps(
+                        [{"type": entry_type, "payload": payload} for entry_type, payload in registration]
+                    ),
+                }
+                for registration in events
+            ]
+
+        assert await db.get_server_list_for_client(False) == [{"ip": ipv4, "port": 3979}]
+        assert [server["server_id"] for server in await db.get_server_list_for_web()] == [server_id]
+
+    asyncio.run(run())
+
+
+def test_redis_session_key_token(fake_redis, monkeypatch):
+    monkeypatch.setattr(cache_module, "REFRESH_INTERVAL", 0)
+
+    async def run():
+        db = Database()
+        await db._redis.set(f"ms-session-key:{1 << 24}", 5, ex=10)
+
+        # A wrong token doesn't keep the session-key alive.
+        assert await db.check_session_key_token(1 << 24, 6) is False
+        assert await db.check_session_key_token(2 << 24, 5) is None
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert await db._redis.ttl(f"ms-session-key:{1 << 24}") <= 10
+
+        assert await db.check_session_key_token(1 << 24, 5)
+        while await db._redis.ttl(f"ms-session-key:{1 << 24}") <= 10:
+            await asyncio.sleep(0)
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_redis_index_scanned(fake_redis):
+    info = {"game_type": 1, "connection_type": 3, "name": "other"}
+
+    async def run():
+        db = Database()
+
+        # Written by the Game Coordinator, so not in the index; readers find
+        # it without waiting for the stale-server check.
+        await db._redis.set("gc-server:other", json.dumps(info), ex=60)
+        await db._redis.set("gc-server-newgrf:other", "[]", ex=60)
+        await db._redis.set("gc-direct-ipv6:other", json.dumps({"ip": "2001:db8::1", "port": 3979}))
+        assert [server["server_id"] for server in await db.get_server_list_for_web()] == ["other"]
+        assert await db.get_server_list_for_client(True) == [{"ip": ipaddress.IPv6Address("2001:db8::1"), "port": 3979}]
+        assert await db.get_server_list_for_client(False) == []
+
+        # Whoever writes it decides how long the key lives, so it is
+        # listed for as long as the key exists.
+        assert await db._redis.zscore("ms-index:gc-server", "other") == float("inf")
+        await db.check_stale_servers()
+        assert await db._redis.zscore("ms-index:gc-server", "other") == float("inf")
+
+        # Only one scan per interval.
+        await db._redis.set("gc-server:later", json.dumps(info), ex=60)
+        await db._redis.set("gc-server-newgrf:later", "[]", ex=60)
+        await db._redis.delete("gc-server:other")
+        assert await db.get_server_list_for_web() == []
+
+        await db._redis.delete("ms-index-scan")
+        assert [server["server_id"] for server in await db.get_server_list_for_web()] == ["later"]
+        assert await db._redis.zscore("ms-index:gc-server", "other") is None
+
+    asyncio.run(run())
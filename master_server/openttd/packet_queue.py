@@ -0,0 +1,96 @@
+import asyncio
+import click
+import collections
+import logging
+
+from openttd_helpers import click_helper
+
+from .protocol.enums import PacketUDPType
+
+log = logging.getLogger(__name__)
+
+# Workers always pick the packet with the highest priority (lowest value)
+# first, so under load the queues of the lower priorities fill up and their
+# packets are dropped first. Unregistering and completing a registration
+# keep the server-list correct; a new registration only starts a query, and
+# a client not getting the server-list simply asks again.
+# Every packet type the master server accepts needs an entry here.
+PACKET_PRIORITY = {
+    PacketUDPType.PACKET_UDP_SERVER_UNREGISTER: 0,
+    PacketUDPType.PACKET_UDP_SERVER_RESPONSE: 0,
+    PacketUDPType.PACKET_UDP_SERVER_REGISTER: 1,
+    PacketUDPType.PACKET_UDP_CLIENT_GET_LIST: 2,
+}
+
+
+class PacketQueue:
+    workers = 64
+    size = 1024
+
+    def __init__(self):
+        # One queue per packet type, ordered on priority.
+        self._queues = {type: collections.deque() for type in sorted(PACKET_PRIORITY, key=PACKET_PRIORITY.get)}
+        self._pending = asyncio.Semaphore(0)
+        self._tasks = []
+
+        self.dropped = collections.Counter()
+
+    def start(self):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.ensure_future(self._worker()))
+
+    def put(self, type, handler, source, kwargs):
+        """Queue a packet for processing; returns False if the packet was dropped instead."""
+        queue = self._queues[type]
+        if len(queue) >= self.size:
+            self.dropped[type] += 1
+            return False
+
+        queue.append((handler, source, kwargs))
+        self._pending.release()
+        return True
+
+    async def _worker(self):
+        while True:
+            await self._pending.acquire()
+
+            for queue in self._queues.values():
+                if queue:
+                    break
+            handler, source, kwargs = queue.popleft()
+
+            # As we are in a task, we need to explicitly log the exception,
+            # otherwise it won't show up in the logs in a sane matter.
+            try:
+                await handler(source, **kwargs)
+            except Exception:
+                log.exception("Error while processing packet")
+
+    def get_metrics(self):
+        yield "# TYPE master_server_packets_queued gauge"
+        for type, queue in self._queues.items():
+            yield f'master_server_packets_queued{{type="{type.name}"}} {len(queue)}'
+
+        yield "# TYPE master_server_packets_dropped_total counter"
+        for type in self._queues:
+            yield f'master_server_packets_dropped_total{{type="{type.name}"}} {self.dropped[type]}'
+
+
+@click_helper.extend
+@click.option(
+    "--packet-workers",
+    help="How many packets are processed concurrently.",
+    default=64,
+    show_default=True,
+    metavar="COUNT",
+)
+@click.option(
+    "--packet-queue-size",
+    help="How many packets of a single type can wait to be processed; when full, new packets of that type are dropped.",
+    default=1024,
+    show_default=True,
+    metavar="COUNT",
+)
+def click_packet_queue(packet_workers, packet_queue_size):
+    PacketQueue.workers = packet_workers
+    PacketQueue.size = packet_queue_size
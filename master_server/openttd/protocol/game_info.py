@@ -0,0 +1,187 @@
+import struct
+
+from .exceptions import PacketInvalidData
+
+# The minimum starting year on the original TTD.
+ORIGINAL_BASE_YEAR = 1920
+# In GameInfo version 3 the date was changed to be counted from the year zero.
+# This offset is added to version 2 and 1 to have the date the same for all
+# versions. It is the amount of days from year 0 to 1920.
+DAYS_TILL_ORIGINAL_BASE_YEAR = (
+    365 * ORIGINAL_BASE_YEAR + ORIGINAL_BASE_YEAR // 4 - ORIGINAL_BASE_YEAR // 100 + ORIGINAL_BASE_YEAR // 400
+)
+
+# Field types. Fixed-size fields use their struct format character; the
+# others are decoded with a dedicated step.
+UINT8 = "B"
+UINT16 = "H"
+UINT32 = "I"
+STRING = "string"
+NEWGRFS = "newgrfs"
+
+# Fixed-size fields that are no longer used are skipped with pad bytes.
+_PADDING = {
+    UINT8: "x",
+    UINT16: "2x",
+    UINT32: "4x",
+}
+
+NEWGRF = struct.Struct("<I16s")
+
+# All keys of a decoded GameInfo, in the order they are returned.
+PAYLOAD_FIELDS = (
+    "gamescript_version",
+    "gamescript_name",
+    "newgrfs",
+    "game_date",
+    "start_date",
+    "companies_max",
+    "companies_on",
+    "spectators_max",
+    "name",
+    "openttd_version",
+    "use_password",
+    "clients_max",
+    "clients_on",
+    "spectators_on",
+    "map_width",
+    "map_height",
+    "map_type",
+    "is_dedicated",
+    "ticks_playing",
+)
+
+
+def _base_fields(dates):
+    return [
+        ("name", STRING),
+        ("openttd_version", STRING),
+        (None, UINT8),  # Unused, used to be server-lang
+        ("use_password", UINT8),
+        ("clients_max", UINT8),
+        ("clients_on", UINT8),
+        ("spectators_on", UINT8),
+        *dates,
+        (None, STRING),  # Unused, used to be map-name
+        ("map_width", UINT16),
+        ("map_height", UINT16),
+        ("map_type", UINT8),
+        ("is_dedicated", UINT8),
+    ]
+
+
+_COMPANIES_FIELDS = [
+    ("companies_max", UINT8),
+    ("companies_on", UINT8),
+    ("spectators_max", UINT8),
+]
+
+# The layout of every GameInfo version we understand, as (name, type) pairs
+# in the order they appear in the packet. Fields named None are read but
+# discarded. Dates before version 3 are counted from ORIGINAL_BASE_YEAR, and
+# have date_offset added to them.
+GAME_INFO_VERSIONS = {
+    1: {
+        "fields": _base_fields([("game_date", UINT16), ("start_date", UINT16)]),
+        "date_offset": DAYS_TILL_ORIGINAL_BASE_YEAR,
+    },
+    2: {
+        "fields": _COMPANIES_FIELDS + _base_fields([("game_date", UINT16), ("start_date", UINT16)]),
+        "date_offset": DAYS_TILL_ORIGINAL_BASE_YEAR,
+    },
+    3: {
+        "fields": [("game_date", UINT32), ("start_date", UINT32)] + _COMPANIES_FIELDS + _base_fields([]),
+        "date_offset": 0,
+    },
+    4: {
+        "fields": [("newgrfs", NEWGRFS), ("game_date", UINT32), ("start_date", UINT32)]
+        + _COMPANIES_FIELDS
+        + _base_fields([]),
+        "date_offset": 0,
+    },
+}
+
+
+def _decode_struct(fmt, names):
+    def decode(reader, payload):
+        payload.update(zip(names, reader.read_struct(fmt)))
+
+    return decode
+
+
+def _decode_string(name):
+    if name is None:
+
+        def decode(reader, payload):
+            reader.read_string()
+
+    else:
+
+        def decode(reader, payload):
+            payload[name] = reader.read_string()
+
+    return decode
+
+
+def _decode_newgrfs(name):
+    def decode(reader, payload):
+        count = reader.read_uint8()
+        payload[name] = [
+            {"grfid": grfid, "md5sum": md5sum.hex(), "name": None}
+            for grfid, md5sum in reader.read_struct_array(NEWGRF, count)
+        ]
+
+    return decode
+
+
+def _compile(fields):
+    """Compile a list of fields into decode steps, merging runs of fixed-size fields into a single struct."""
+    steps = []
+    fmt = ""
+    names = []
+
+    def flush():
+        if fmt:
+            steps.append(_decode_struct(struct.Struct("<" + fmt), tuple(names)))
+
+    for name, type in fields:
+        if type == STRING or type == NEWGRFS:
+            flush()
+            fmt = ""
+            names = []
+            steps.append(_decode_string(name) if type == STRING else _decode_newgrfs(name))
+        elif name is None:
+            fmt += _PADDING[type]
+        else:
+            fmt += type
+            names.append(name)
+    flush()
+
+    return tuple(steps)
+
+
+class GameInfoDecoder:
+    def __init__(self, versions=GAME_INFO_VERSIONS):
+        self._template = dict.fromkeys(PAYLOAD_FIELDS)
+        self._versions = {
+            version: (_compile(layout["fields"]), layout["date_offset"]) for version, layout in versions.items()
+        }
+
+    def decode(self, reader):
+        game_info_version = reader.read_uint8()
+
+        layout = self._versions.get(game_info_version)
+        if layout is None:
+            raise PacketInvalidData("unsupported game info version", game_info_version)
+        steps, date_offset = layout
+
+        payload = self._template.copy()
+        for step in steps:
+            step(reader, payload)
+
+        if date_offset:
+            payload["game_date"] += date_offset
+            payload["start_date"] += date_offset
+
+        payload["ticks_playing"] = max(0, (payload["game_date"] - payload["start_date"]) * 74)
+        return payload
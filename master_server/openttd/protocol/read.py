@@ -2,45 +2,68 @@ import struct
 
 from .exceptions import PacketInvalidData
 
+UINT8 = struct.Struct("<B")
+UINT16 = struct.Struct("<H")
+UINT32 = struct.Struct("<I")
+UINT64 = struct.Struct("<Q")
 
-def validate_length(data, length):
-    if len(data) < length:
-        raise PacketInvalidData("packet too short")
 
+class PacketReader:
+    """
+    Cursor over a received packet.
 
-def read_uint8(data):
-    validate_length(data, 1)
-    value = struct.unpack("<B", data[0:1])
-    return value[0], data[1:]
+    Fields are unpacked directly from the underlying buffer, so reading a
+    field never copies the remainder of the packet.
+    """
 
+    __slots__ = ("_data", "_view", "_pos")
 
-def read_uint16(data):
-    validate_length(data, 2)
-    value = struct.unpack("<H", data[0:2])
-    return value[0], data[2:]
+    def __init__(self, data, offset=0):
+        self._data = data
+        self._view = memoryview(data)
+        self._pos = offset
 
+    @property
+    def pos(self):
+        return self._pos
 
-def read_uint32(data):
-    validate_length(data, 4)
-    value = struct.unpack("<I", data[0:4])
-    return value[0], data[4:]
+    def remaining(self):
+        return len(self._data) - self._pos
 
+    def _advance(self, length):
+        pos = self._pos
+        if len(self._data) - pos < length:
+            raise PacketInvalidData("packet too short")
+        self._pos = pos + length
+        return pos
 
-def read_uint64(data):
-    validate_length(data, 8)
-    value = struct.unpack("<Q", data[0:8])
-    return value[0], data[8:]
+    def read_struct(self, fmt):
+        return fmt.unpack_from(self._data, self._advance(fmt.size))
 
+    def read_struct_array(self, fmt, count):
+        pos = self._advance(fmt.size * count)
+        return fmt.iter_unpack(self._view[pos : self._pos])
 
-def read_bytes(data, count):
-    validate_length(data, count)
-    return data[0:count], data[count:]
+    def read_uint8(self):
+        return UINT8.unpack_from(self._data, self._advance(1))[0]
 
+    def read_uint16(self):
+        return UINT16.unpack_from(self._data, self._advance(2))[0]
 
-def read_string(data):
-    value = b""
-    while data[0:1] != b"\x00":
-        validate_length(data, 1)
-        value += data[0:1]
-        data = data[1:]
-    return value.decode(), data[1:]
+    def read_uint32(self):
+        return UINT32.unpack_from(self._data, self._advance(4))[0]
+
+    def read_uint64(self):
+        return UINT64.unpack_from(self._data, self._advance(8))[0]
+
+    def read_bytes(self, count):
+        pos = self._advance(count)
+        return self._view[pos : pos + count]
+
+    def read_string(self):
+        pos = self._pos
+        end = self._data.find(b"\x00", pos)
+        if end == -1:
+            raise PacketInvalidData("packet too short")
+        self._pos = end + 1
+        return str(self._view[pos:end], "utf-8")
@@ -0,0 +1,39 @@
+import pytest
+
+from .exceptions import PacketInvalidData
+from .read import PacketReader
+
+
+def test_read_fields():
+    reader = PacketReader(b"\x01\x02\x01\x04\x03\x02\x01\x08\x07\x06\x05\x04\x03\x02\x01name\x00\xaa\xbb", 0)
+
+    assert reader.read_uint8() == 0x01
+    assert reader.read_uint16() == 0x0102
+    assert reader.read_uint32() == 0x01020304
+    assert reader.read_uint64() == 0x0102030405060708
+    assert reader.read_string() == "name"
+    assert reader.read_bytes(2) == b"\xaa\xbb"
+    assert reader.remaining() == 0
+
+
+def test_read_offset():
+    reader = PacketReader(b"\xff\xff\x01", 2)
+
+    assert reader.read_uint8() == 0x01
+    assert reader.remaining() == 0
+
+
+@pytest.mark.parametrize(
+    "data, method, args",
+    [
+        (b"", "read_uint8", ()),
+        (b"\x01", "read_uint16", ()),
+        (b"\x01\x02\x03", "read_uint32", ()),
+        (b"\x01\x02\x03\x04\x05\x06\x07", "read_uint64", ()),
+        (b"\x01", "read_bytes", (2,)),
+        (b"name", "read_string", ()),
+    ],
+)
+def test_read_too_short(data, method, args):
+    with pytest.raises(PacketInvalidData):
+        getattr(PacketReader(data), method)(*args)
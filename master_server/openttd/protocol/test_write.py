@@ -0,0 +1,30 @@
+import pytest
+
+from .exceptions import PacketTooBig
+from .write import (
+    PacketWriter,
+    SAFE_MTU,
+)
+
+
+def test_write_fields():
+    packet = PacketWriter(0x07)
+    packet.write_uint8(0x01)
+    packet.write_uint16(0x0102)
+    packet.write_uint32(0x01020304)
+    packet.write_uint64(0x0102030405060708)
+    packet.write_string("name")
+    packet.write_bytes(b"\xaa\xbb")
+
+    assert packet.finish() == (
+        b"\x19\x00\x07\x01\x02\x01\x04\x03\x02\x01\x08\x07\x06\x05\x04\x03\x02\x01name\x00\xaa\xbb"
+    )
+
+
+def test_write_safe_mtu():
+    packet = PacketWriter(0x07)
+    packet.write_bytes(b"\x00" * (SAFE_MTU - 3))
+    assert len(packet.finish()) == SAFE_MTU
+
+    with pytest.raises(PacketTooBig):
+        packet.write_uint8(0x00)
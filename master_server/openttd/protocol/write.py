@@ -9,32 +9,56 @@ from .exceptions import PacketTooBig
 # master-server successfully.
 SAFE_MTU = 1360
 
+UINT8 = struct.Struct("<B")
+UINT16 = struct.Struct("<H")
+UINT32 = struct.Struct("<I")
+UINT64 = struct.Struct("<Q")
 
-def write_init(type):
-    return b"\x00\x00" + struct.pack("<B", type)
 
+class PacketWriter:
+    """
+    Builder for a single packet.
 
-def write_uint8(data, value):
-    return data + struct.pack("<B", value)
+    Fields are packed into a buffer of SAFE_MTU bytes that is allocated
+    once; the packet size is patched into the header when the packet is
+    finished.
+    """
 
+    __slots__ = ("_buffer", "_pos")
 
-def write_uint16(data, value):
-    return data + struct.pack("<H", value)
+    def __init__(self, type):
+        self._buffer = bytearray(SAFE_MTU)
+        self._pos = 3
+        UINT8.pack_into(self._buffer, 2, type)
 
+    def _advance(self, length):
+        pos = self._pos
+        if pos + length > SAFE_MTU:
+            raise PacketTooBig(pos + length)
+        self._pos = pos + length
+        return pos
 
-def write_uint32(data, value):
-    return data + struct.pack("<I", value)
+    def write_uint8(self, value):
+        UINT8.pack_into(self._buffer, self._advance(1), value)
 
+    def write_uint16(self, value):
+        UINT16.pack_into(self._buffer, self._advance(2), value)
 
-def write_uint64(data, value):
-    return data + struct.pack("<Q", value)
+    def write_uint32(self, value):
+        UINT32.pack_into(self._buffer, self._advance(4), value)
 
+    def write_uint64(self, value):
+        UINT64.pack_into(self._buffer, self._advance(8), value)
 
-def write_string(data, value):
-    return data + value.encode() + b"\x00"
+    def write_bytes(self, value):
+        pos = self._advance(len(value))
+        self._buffer[pos : self._pos] = value
 
+    def write_string(self, value):
+        self.write_bytes(value.encode())
+        self.write_uint8(0)
 
-def write_presend(data):
-    if len(data) > SAFE_MTU:
-        raise PacketTooBig(len(data))
-    return struct.pack("<H", len(data)) + data[2:]
+    def finish(self):
+        """Patch in the packet size, and return the packet ready to be sent."""
+        UINT16.pack_into(self._buffer, 0, self._pos)
+        return memoryview(self._buffer)[: self._pos]
@@ -0,0 +1,120 @@
+import collections
+import ipaddress
+import logging
+import time
+
+from .protocol.enums import PacketUDPType
+
+log = logging.getLogger(__name__)
+
+# Per packet type the (tokens per second, burst) of the token-bucket. A
+# single IP can host many servers, and many clients can be behind a single
+# IP, so these are rather generous. Packet types not listed are not limited;
+# for example, a SERVER_RESPONSE is only processed if we asked for it.
+RATE_LIMITS = {
+    PacketUDPType.PACKET_UDP_SERVER_REGISTER: (2, 50),
+    PacketUDPType.PACKET_UDP_SERVER_UNREGISTER: (2, 50),
+    PacketUDPType.PACKET_UDP_CLIENT_GET_LIST: (5, 50),
+}
+# If an IP has a wrong session-key token more than this amount of times
+# within STRIKE_WINDOW seconds, it is banned for BAN_DURATION seconds.
+BAN_STRIKES = 3
+STRIKE_WINDOW = 60 * 10
+BAN_DURATION = 60 * 10
+# Maximum amount of entries to track. When full, the least recently seen
+# entry is forgotten. This keeps memory bounded when someone floods us with
+# spoofed source addresses; forgetting an entry only means it starts over
+# with a full bucket.
+MAX_ENTRIES = 100000
+
+
+def _get_key(ip):
+    # A single host is often given a whole /64 for IPv6, so limit on that.
+    # IPv6 keys are offset to never collide with IPv4 keys.
+    if isinstance(ip, ipaddress.IPv6Address):
+        return (1 << 64) | (int(ip) >> 64)
+    return int(ip)
+
+
+def _insert(entries, key, value):
+    entries[key] = value
+    if len(entries) > MAX_ENTRIES:
+        entries.popitem(last=False)
+
+
+class RateLimiter:
+    def __init__(self):
+        self._buckets = collections.OrderedDict()
+        self._strikes = collections.OrderedDict()
+        self._bans = collections.OrderedDict()
+
+        self.limited = collections.Counter()
+        self.banned = 0
+
+    def is_banned(self, ip):
+        key = _get_key(ip)
+
+        expire = self._bans.get(key)
+        if expire is None:
+            return False
+
+        if expire < time.monotonic():
+            del self._bans[key]
+            return False
+
+        self.banned += 1
+        return True
+
+    def allow(self, type, ip):
+        """Take a token from the bucket of this IP for this packet type; returns False if the bucket is empty."""
+        limit = RATE_LIMITS.get(type)
+        if limit is None:
+            return True
+        rate, burst = limit
+
+        key = (_get_key(ip), type)
+        now = time.monotonic()
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [burst, now]
+            _insert(self._buckets, key, bucket)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] < 1:
+            self.limited[type] += 1
+            return False
+
+        bucket[0] -= 1
+        return True
+
+    def strike(self, ip):
+        """Register misbehaviour of this IP; after too many strikes the IP is banned."""
+        key = _get_key(ip)
+        now = time.monotonic()
+
+        strikes = self._strikes.get(key)
+        if strikes is None or now - strikes[1] > STRIKE_WINDOW:
+            strikes = [0, now]
+            _insert(self._strikes, key, strikes)
+        strikes[0] += 1
+
+        if strikes[0] > BAN_STRIKES:
+            log.info("Banning %s for %d seconds after %d strikes", ip, BAN_DURATION, strikes[0])
+
+            del self._strikes[key]
+            _insert(self._bans, key, now + BAN_DURATION)
+
+    def get_metrics(self):
+        yield "# TYPE master_server_packets_rate_limited_total counter"
+        for type in RATE_LIMITS:
+            yield f'master_server_packets_rate_limited_total{{type="{type.name}"}} {self.limited[type]}'
+
+        yield "# TYPE master_server_packets_banned_total counter"
+        yield f"master_server_packets_banned_total {self.banned}"
+
+        yield "# TYPE master_server_bans gauge"
+        yield f"master_server_bans {len(self._bans)}"
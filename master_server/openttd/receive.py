@@ -9,59 +9,66 @@ from .protocol.exceptions import (
     PacketInvalidSize,
     PacketInvalidType,
 )
-from .protocol.read import (
-    read_bytes,
-    read_string,
-    read_uint8,
-    read_uint16,
-    read_uint32,
-    read_uint64,
-)
+from .protocol.game_info import GameInfoDecoder
+from .protocol.read import PacketReader
 
 NETWORK_MASTER_SERVER_WELCOME_MESSAGE = "OpenTTDRegister"
 
-# The minimum starting year on the original TTD.
-ORIGINAL_BASE_YEAR = 1920
-# In GameInfo version 3 the date was changed to be counted from the year zero.
-# This offset is added to version 2 and 1 to have the date the same for all
-# versions. It is the amount of days from year 0 to 1920.
-DAYS_TILL_ORIGINAL_BASE_YEAR = (
-    365 * ORIGINAL_BASE_YEAR + ORIGINAL_BASE_YEAR // 4 - ORIGINAL_BASE_YEAR // 100 + ORIGINAL_BASE_YEAR // 400
-)
+GAME_INFO_DECODER = GameInfoDecoder()
 
 
 class OpenTTDProtocolReceive:
+    def __init__(self):
+        super().__init__()
+
+        # Resolve once how every packet type is handled, so dispatching a
+        # packet is a single index in this table. Packet types we do not
+        # accept have no entry.
+        self._dispatch = [None] * 256
+        for type in PacketUDPType:
+            decoder = getattr(self, f"receive_{type.name}", None)
+            if decoder is None:
+                continue
+
+            handler = self.get_packet_handler(type)
+            if handler is None:
+                continue
+
+            self._dispatch[type] = (decoder, handler)
+
+    def get_packet_handler(self, type):
+        """Get what receive_packet() returns as handler for this packet type; None if the type is not accepted."""
+        return type
+
     def receive_packet(self, source, data):
-        # Check length of packet
-        length, data = read_uint16(data)
-        if length != len(data) + 2:
-            raise PacketInvalidSize(len(data) + 2, length)
+        reader = PacketReader(data)
 
-        # Check if type is in range
-        type, data = read_uint8(data)
-        if type >= PacketUDPType.PACKET_UDP_END:
-            raise PacketInvalidType(type)
+        # Check length of packet
+        length = reader.read_uint16()
+        if length != len(data):
+            raise PacketInvalidSize(len(data), length)
 
         # Check if we expect this packet
-        type = PacketUDPType(type)
-        func = getattr(self, f"receive_{type.name}", None)
-        if func is None:
+        type = reader.read_uint8()
+        entry = self._dispatch[type]
+        if entry is None:
             raise PacketInvalidType(type)
 
         # Process this packet
-        kwargs = func(source, data)
-        return type, kwargs
+        decoder, handler = entry
+        return handler, decoder(source, data, reader.pos)
 
     @staticmethod
-    def receive_PACKET_UDP_CLIENT_GET_LIST(source, data):
-        version, data = read_uint8(data)
+    def receive_PACKET_UDP_CLIENT_GET_LIST(source, data, offset=0):
+        reader = PacketReader(data, offset)
+        version = reader.read_uint8()
 
         if version == 2:
-            slt, data = read_uint8(data)
+            slt = reader.read_uint8()
         else:
             slt = SLTType.SLT_IPv4.value
 
-        if len(data) != 0:
+        if reader.remaining() != 0:
             raise PacketInvalidData("more bytes than expected")
 
         if version < 1 or version > 2:
@@ -80,16 +87,17 @@ class OpenTTDProtocolReceive:
         return {"slt": slt}
 
     @staticmethod
-    def receive_PACKET_UDP_SERVER_REGISTER(source, data):
-        welcome, data = read_string(data)
-        version, data = read_uint8(data)
-        port, data = read_uint16(data)
+    def receive_PACKET_UDP_SERVER_REGISTER(source, data, offset=0):
+        reader = PacketReader(data, offset)
+        welcome = reader.read_string()
+        version = reader.read_uint8()
+        port = reader.read_uint16()
         session_key = None
 
         if version == 2:
-            session_key, data = read_uint64(data)
+            session_key = reader.read_uint64()
 
-        if len(data) != 0:
+        if reader.remaining() != 0:
             raise PacketInvalidData("more bytes than expected")
 
         if welcome != NETWORK_MASTER_SERVER_WELCOME_MESSAGE:
@@ -100,83 +108,22 @@ class OpenTTDProtocolReceive:
         return {"port": port, "session_key": session_key}
 
     @staticmethod
-    def receive_PACKET_UDP_SERVER_RESPONSE(source, data):
-        payload = {
-            name: None
-            for name in [
-                "gamescript_version",
-                "gamescript_name",
-                "newgrfs",
-                "game_date",
-                "start_date",
-                "companies_max",
-                "companies_on",
-                "spectators_max",
-                "name",
-                "openttd_version",
-                "use_password",
-                "clients_max",
-                "clients_on",
-                "spectators_on",
-                "map_width",
-                "map_height",
-                "map_type",
-                "is_dedicated",
-                "ticks_playing",
-            ]
-        }
-
-        game_info_version, data = read_uint8(data)
-
-        if game_info_version >= 4:
-            newgrf_count, data = read_uint8(data)
-            payload["newgrfs"] = []
-            for _ in range(newgrf_count):
-                grfid, data = read_uint32(data)
-                md5sum, data = read_bytes(data, 16)
-                payload["newgrfs"].append({"grfid": grfid, "md5sum": md5sum.hex(), "name": None})
-
-        if game_info_version >= 3:
-            payload["game_date"], data = read_uint32(data)
-            payload["start_date"], data = read_uint32(data)
-
-        if game_info_version >= 2:
-            payload["companies_max"], data = read_uint8(data)
-            payload["companies_on"], data = read_uint8(data)
-            payload["spectators_max"], data = read_uint8(data)
-
-        if game_info_version >= 1:
-            payload["name"], data = read_string(data)
-            payload["openttd_version"], data = read_string(data)
-            _, data = read_uint8(data)  # Unused, used to be server-lang
-            payload["use_password"], data = read_uint8(data)
-            payload["clients_max"], data = read_uint8(data)
-            payload["clients_on"], data = read_uint8(data)
-            payload["spectators_on"], data = read_uint8(data)
-            if game_info_version < 3:
-                payload["game_date"], data = read_uint16(data)
-                payload["game_date"] += DAYS_TILL_ORIGINAL_BASE_YEAR
-                payload["start_date"], data = read_uint16(data)
-                payload["start_date"] += DAYS_TILL_ORIGINAL_BASE_YEAR
-            _, data = read_string(data)  # Unused, used to be map-name
-            payload["map_width"], data = read_uint16(data)
-            payload["map_height"], data = read_uint16(data)
-            payload["map_type"], data = read_uint8(data)
-            payload["is_dedicated"], data = read_uint8(data)
-
-        payload["ticks_playing"] = max(0, (payload["game_date"] - payload["start_date"]) * 74)
-
-        if len(data) != 0:
+    def receive_PACKET_UDP_SERVER_RESPONSE(source, data, offset=0):
+        reader = PacketReader(data, offset)
+        payload = GAME_INFO_DECODER.decode(reader)
+
+        if reader.remaining() != 0:
             raise PacketInvalidData("more bytes than expected")
 
         return payload
 
     @staticmethod
-    def receive_PACKET_UDP_SERVER_UNREGISTER(source, data):
-        version, data = read_uint8(data)
-        port, data = read_uint16(data)
+    def receive_PACKET_UDP_SERVER_UNREGISTER(source, data, offset=0):
+        reader = PacketReader(data, offset)
+        version = reader.read_uint8()
+        port = reader.read_uint16()
 
-        if len(data) != 0:
+        if reader.remaining() != 0:
             raise PacketInvalidData("more bytes than expected")
 
         if version < 1 or version > 2:
@@ -1,38 +1,27 @@
 from .protocol.enums import PacketUDPType
-from .protocol.write import (
-    write_init,
-    write_uint8,
-    write_uint16,
-    write_uint64,
-    write_presend,
-)
+from .protocol.write import PacketWriter
 
 
 class OpenTTDProtocolSend:
     def send_PACKET_UDP_MASTER_SESSION_KEY(self, addr, session_key, new_connection=False):
-        data = write_init(PacketUDPType.PACKET_UDP_MASTER_SESSION_KEY)
-        data = write_uint64(data, session_key)
-        data = write_presend(data)
-        return self.send_packet(addr, data, new_connection=new_connection)
+        packet = PacketWriter(PacketUDPType.PACKET_UDP_MASTER_SESSION_KEY)
+        packet.write_uint64(session_key)
+        return self.send_packet(addr, packet.finish(), new_connection=new_connection)
 
     def send_PACKET_UDP_MASTER_ACK_REGISTER(self, addr, new_connection=False):
-        data = write_init(PacketUDPType.PACKET_UDP_MASTER_ACK_REGISTER)
-        data = write_presend(data)
-        return self.send_packet(addr, data, new_connection=new_connection)
+        packet = PacketWriter(PacketUDPType.PACKET_UDP_MASTER_ACK_REGISTER)
+        return self.send_packet(addr, packet.finish(), new_connection=new_connection)
 
     def send_PACKET_UDP_CLIENT_FIND_SERVER(self, addr, new_connection=False):
-        data = write_init(PacketUDPType.PACKET_UDP_CLIENT_FIND_SERVER)
-        data = write_presend(data)
-        return self.send_packet(addr, data, new_connection=new_connection)
+        packet = PacketWriter(PacketUDPType.PACKET_UDP_CLIENT_FIND_SERVER)
+        return self.send_packet(addr, packet.finish(), new_connection=new_connection)
 
-    def send_PACKET_UDP_MASTER_RESPONSE_LIST(self, addr, slt, servers, new_connection=False):
-        data = write_init(PacketUDPType.PACKET_UDP_MASTER_RESPONSE_LIST)
-        data = write_uint8(data, slt.value + 1)
-        data = write_uint16(data, len(servers))
+    @staticmethod
+    def encode_PACKET_UDP_MASTER_RESPONSE_LIST(slt, servers):
+        packet = PacketWriter(PacketUDPType.PACKET_UDP_MASTER_RESPONSE_LIST)
+        packet.write_uint8(slt.value + 1)
+        packet.write_uint16(len(servers))
         for server in servers:
-            packed = server["ip"].packed
-            for i in range(len(packed)):
-                data = write_uint8(data, packed[i])
-            data = write_uint16(data, server["port"])
-        data = write_presend(data)
-        return self.send_packet(addr, data, new_connection=new_connection)
+            packet.write_bytes(server["ip"].packed)
+            packet.write_uint16(server["port"])
+        return packet.finish()
@@ -0,0 +1,227 @@
+import asyncio
+import ipaddress
+import logging
+import pproxy
+import time
+
+log = logging.getLogger(__name__)
+
+# An association that sent this many datagrams without getting any answer
+# back for SOCKS_UNHEALTHY_TIMEOUT seconds is considered broken, and is
+# replaced by a new one. Many servers never answer (that is why we query
+# them), so this has to be a fair amount.
+SOCKS_UNHEALTHY_UNANSWERED = 100
+SOCKS_UNHEALTHY_TIMEOUT = 60
+# Without pooling, an association is closed this long after its last
+# datagram, unless its first answer or the caller closed it before. This
+# is a bit longer than a query waits before it retries, so the retries
+# reuse the association.
+SOCKS_SINGLE_TIMEOUT = 10
+
+
+def parse_socks_udp_header(data):
+    """
+    Parse the SOCKS5 UDP header (RFC 1928) of a relayed datagram.
+
+    Returns the address the datagram was relayed from and the payload, or
+    None if the datagram has no (valid) header.
+    """
+    if data[0:3] != b"\x00\x00\x00" or len(data) < 4:
+        return None
+
+    atyp = data[3]
+    if atyp == 1:
+        pos = 8
+        host = str(ipaddress.IPv4Address(data[4:pos])) if len(data) >= pos else None
+    elif atyp == 4:
+        pos = 20
+        host = str(ipaddress.IPv6Address(data[4:pos])) if len(data) >= pos else None
+    elif atyp == 3 and len(data) >= 5:
+        pos = 5 + data[4]
+        host = data[5:pos].decode(errors="replace")
+    else:
+        return None
+
+    if host is None or len(data) < pos + 2:
+        return None
+
+    port = int.from_bytes(data[pos : pos + 2], "big")
+    return (host, port), data[pos + 2 :]
+
+
+class SocksAssociation(asyncio.DatagramProtocol):
+    """A UDP socket to the SOCKS proxy, over which datagrams are relayed to any destination."""
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._buffer = []
+        self.transport = None
+        self.closed = False
+
+        self.unanswered = 0
+        self.last_received = time.monotonic()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.closed:
+            transport.close()
+            return
+
+        for data in self._buffer:
+            transport.sendto(data)
+        self._buffer.clear()
+
+    def datagram_received(self, data, addr):
+        self.unanswered = 0
+        self.last_received = time.monotonic()
+        self._callback(data)
+
+    def error_received(self, exc):
+        log.info("Error on SOCKS association: %r", exc)
+        self.close()
+
+    def connection_lost(self, exc):
+        self.closed = True
+
+    def sendto(self, data):
+        self.unanswered += 1
+        if self.transport is None:
+            self._buffer.append(data)
+        else:
+            self.transport.sendto(data)
+
+    def is_healthy(self, now):
+        if self.closed:
+            return False
+        return self.unanswered < SOCKS_UNHEALTHY_UNANSWERED or now - self.last_received < SOCKS_UNHEALTHY_TIMEOUT
+
+    def close(self):
+        self.closed = True
+        if self.transport is not None:
+            self.transport.close()
+
+
+class SocksPool:
+    """
+    Pool of SOCKS UDP associations to relay datagrams over.
+
+    The answers on an association are demultiplexed based on the address
+    the proxy says it relayed them from, so any association can be used for
+    any destination. This requires the proxy to prefix relayed datagrams with
+    the SOCKS5 UDP header, as RFC 1928 describes.
+
+    With a pool size of zero (the default), every destination gets its own
+    association, which is closed after its first answer, or when the caller
+    closes it (for example, because the query timed out). This works with
+    proxies that do not relay the source address, like pproxy. If a pooled
+    association receives an answer without SOCKS header, the pool falls
+    back to this for all further datagrams.
+    """
+
+    size = 0
+
+    def __init__(self, proxy, callback):
+        self._conn = pproxy.Connection(proxy)
+        self._addr = (self._conn.host_name, self._conn.port)
+        self._callback = callback
+
+        self._associations = []
+        self._next = 0
+        # Without pooling, the association and its close-timer per destination.
+        self._singles = {}
+
+    def _open(self, callback):
+        association = SocksAssociation(callback)
+
+        def opened(task):
+            if task.cancelled() or task.exception() is not None:
+                log.error("Failed to open SOCKS association: %r", None if task.cancelled() else task.exception())
+                association.closed = True
+
+        task = asyncio.ensure_future(
+            asyncio.get_event_loop().create_datagram_endpoint(lambda: association, remote_addr=self._addr)
+        )
+        task.add_done_callback(opened)
+        return association
+
+    def _get_association(self):
+        if len(self._associations) < self.size:
+            association = self._open(self._datagram_received)
+            self._associations.append(association)
+            return association
+
+        index = self._next
+        self._next = (index + 1) % self.size
+
+        association = self._associations[index]
+        if not association.is_healthy(time.monotonic()):
+            log.info("SOCKS association %d is not healthy; replacing it", index)
+            association.close()
+
+            association = self._open(self._datagram_received)
+            self._associations[index] = association
+
+        return association
+
+    def _datagram_received(self, data):
+        result = parse_socks_udp_header(data)
+        if result is None:
+            if self.size > 0:
+                # Without the header there is no telling where the answer
+                # came from, so it is lost. Stop pooling, so at least the
+                # answers to the next queries arrive.
+                log.warning("Received datagram via SOCKS proxy without SOCKS header; no longer pooling associations")
+                self.size = 0
+                for association in self._associations:
+                    association.close()
+                self._associations.clear()
+            return
+
+        addr, data = result
+        self._callback(data, addr)
+
+    def sendto(self, data, addr):
+        # Modify the packet to have a SOCKS header with relay information.
+        data = self._conn.udp_prepare_connection(addr[0], addr[1], data)
+
+        if self.size > 0:
+            self._get_association().sendto(data)
+            return
+
+        # Retries to the same destination reuse its association.
+        single = self._singles.get(addr)
+        if single is None or single[0].closed:
+
+            def single_datagram_received(data):
+                self._close_single(addr, association)
+
+                # Not every proxy relays the source address; but as this
+                # association is only used for a single destination, we know
+                # where it came from anyway.
+                result = parse_socks_udp_header(data)
+                if result is not None:
+                    data = result[1]
+                self._callback(data, addr)
+
+            association = self._open(single_datagram_received)
+        else:
+            association = single[0]
+            single[1].cancel()
+
+        association.sendto(data)
+        handle = asyncio.get_event_loop().call_later(SOCKS_SINGLE_TIMEOUT, self._close_single, addr, association)
+        self._singles[addr] = (association, handle)
+
+    def _close_single(self, addr, association):
+        association.close()
+
+        single = self._singles.get(addr)
+        if single is not None and single[0] is association:
+            single[1].cancel()
+            del self._singles[addr]
+
+    def close(self, addr):
+        """Close the association to this destination, if it has its own; for example, once its query is done."""
+        single = self._singles.get(addr)
+        if single is not None:
+            self._close_single(addr, single[0])
@@ -0,0 +1,33 @@
+import asyncio
+
+from .packet_queue import PacketQueue
+from .protocol.enums import PacketUDPType
+
+
+def test_packet_queue_priority_and_drop():
+    processed = []
+
+    async def handler(source):
+        processed.append(source)
+
+    async def run():
+        queue = PacketQueue()
+        queue.workers = 1
+        queue.size = 2
+
+        assert queue.put(PacketUDPType.PACKET_UDP_CLIENT_GET_LIST, handler, "list-1", {})
+        assert queue.put(PacketUDPType.PACKET_UDP_CLIENT_GET_LIST, handler, "list-2", {})
+        assert not queue.put(PacketUDPType.PACKET_UDP_CLIENT_GET_LIST, handler, "list-3", {})
+        assert queue.put(PacketUDPType.PACKET_UDP_SERVER_UNREGISTER, handler, "unregister", {})
+
+        queue.start()
+        while len(processed) < 3:
+            await asyncio.sleep(0)
+
+        return queue
+
+    queue = asyncio.run(run())
+
+    assert processed == ["unregister", "list-1", "list-2"]
+    assert queue.dropped[PacketUDPType.PACKET_UDP_CLIENT_GET_LIST] == 1
+    assert queue.dropped[PacketUDPType.PACKET_UDP_SERVER_UNREGISTER] == 0
@@ -0,0 +1,53 @@
+import ipaddress
+
+from . import rate_limit
+from .protocol.enums import PacketUDPType
+from .rate_limit import RateLimiter
+
+
+def test_rate_limit_burst():
+    limiter = RateLimiter()
+    ip = ipaddress.IPv4Address("192.0.2.1")
+    _, burst = rate_limit.RATE_LIMITS[PacketUDPType.PACKET_UDP_CLIENT_GET_LIST]
+
+    for _ in range(burst):
+        assert limiter.allow(PacketUDPType.PACKET_UDP_CLIENT_GET_LIST, ip)
+    assert not limiter.allow(PacketUDPType.PACKET_UDP_CLIENT_GET_LIST, ip)
+
+    # Other packet types and other IPs have their own bucket.
+    assert limiter.allow(PacketUDPType.PACKET_UDP_SERVER_REGISTER, ip)
+    assert limiter.allow(PacketUDPType.PACKET_UDP_CLIENT_GET_LIST, ipaddress.IPv4Address("192.0.2.2"))
+    # Not limited packet types are always allowed.
+    assert limiter.allow(PacketUDPType.PACKET_UDP_SERVER_RESPONSE, ip)
+
+
+def test_rate_limit_ipv6_prefix():
+    limiter = RateLimiter()
+    _, burst = rate_limit.RATE_LIMITS[PacketUDPType.PACKET_UDP_CLIENT_GET_LIST]
+
+    for i in range(burst):
+        assert limiter.allow(PacketUDPType.PACKET_UDP_CLIENT_GET_LIST, ipaddress.IPv6Address(f"2001:db8::{i + 1:x}"))
+    assert not limiter.allow(PacketUDPType.PACKET_UDP_CLIENT_GET_LIST, ipaddress.IPv6Address("2001:db8::ffff"))
+    assert limiter.allow(PacketUDPType.PACKET_UDP_CLIENT_GET_LIST, ipaddress.IPv6Address("2001:db8:0:1::1"))
+
+
+def test_rate_limit_ban():
+    limiter = RateLimiter()
+    ip = ipaddress.IPv4Address("192.0.2.1")
+
+    for _ in range(rate_limit.BAN_STRIKES):
+        limiter.strike(ip)
+    assert not limiter.is_banned(ip)
+
+    limiter.strike(ip)
+    assert limiter.is_banned(ip)
+    assert not limiter.is_banned(ipaddress.IPv4Address("192.0.2.2"))
+
+
+def test_rate_limit_bounded(monkeypatch):
+    monkeypatch.setattr(rate_limit, "MAX_ENTRIES", 10)
+    limiter = RateLimiter()
+
+    for i in range(100):
+        limiter.allow(PacketUDPType.PACKET_UDP_CLIENT_GET_LIST, ipaddress.IPv4Address(i))
+    assert len(limiter._buckets) == 10
@@ -148,3 +148,77 @@ def test_receive_PACKET_UDP_SERVER_UNREGISTER_success(data, result):
 def test_receive_PACKET_UDP_SERVER_UNREGISTER_failure(data):
     with pytest.raises(PacketInvalidData):
         assert OpenTTDProtocolReceive.receive_PACKET_UDP_SERVER_UNREGISTER(None, data)
+
+
+GAME_INFO_BASE = b"name\x00version\x00\x00\x01\x19\x04\x00"
+GAME_INFO_MAP = b"\x00\x00\x01\x00\x02\x01\x01"
+GAME_INFO_V1 = GAME_INFO_BASE + b"\x10\x00\x08\x00" + GAME_INFO_MAP
+GAME_INFO_V3 = b"\x10\x00\x00\x00\x08\x00\x00\x00\x0f\x03\x0a" + GAME_INFO_BASE + GAME_INFO_MAP
+GAME_INFO_V4 = b"\x01\x01\x00\x00\x00" + bytes(range(16)) + GAME_INFO_V3
+
+
+@pytest.mark.parametrize(
+    "data, result",
+    [
+        (
+            b"\x01" + GAME_INFO_V1,
+            {
+                "game_date": 0x10 + 701265,
+                "start_date": 0x08 + 701265,
+                "companies_max": None,
+                "newgrfs": None,
+            },
+        ),
+        (
+            b"\x03" + GAME_INFO_V3,
+            {
+                "game_date": 0x10,
+                "start_date": 0x08,
+                "companies_max": 0x0F,
+                "newgrfs": None,
+            },
+        ),
+        (
+            b"\x04" + GAME_INFO_V4,
+            {
+                "game_date": 0x10,
+                "start_date": 0x08,
+                "companies_max": 0x0F,
+                "newgrfs": [{"grfid": 1, "md5sum": "000102030405060708090a0b0c0d0e0f", "name": None}],
+            },
+        ),
+    ],
+)
+def test_receive_PACKET_UDP_SERVER_RESPONSE_success(data, result):
+    payload = OpenTTDProtocolReceive.receive_PACKET_UDP_SERVER_RESPONSE(None, data)
+
+    assert payload["name"] == "name"
+    assert payload["openttd_version"] == "version"
+    assert payload["use_password"] == 0x01
+    assert payload["clients_on"] == 0x04
+    assert payload["map_width"] == 0x100
+    assert payload["map_height"] == 0x200
+    assert payload["is_dedicated"] == 0x01
+    assert payload["ticks_playing"] == 8 * 74
+    for key, value in result.items():
+        assert payload[key] == value
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        # Too few data
+        b"",
+        b"\x01" + GAME_INFO_V1[:-1],
+        b"\x04" + GAME_INFO_V4[:-1],
+        # Too much data
+        b"\x01" + GAME_INFO_V1 + b"\xff",
+        b"\x04" + GAME_INFO_V4 + b"\xff",
+        # Unsupported version number
+        b"\x00",
+        b"\x05" + GAME_INFO_V4,
+    ],
+)
+def test_receive_PACKET_UDP_SERVER_RESPONSE_failure(data):
+    with pytest.raises(PacketInvalidData):
+        assert OpenTTDProtocolReceive.receive_PACKET_UDP_SERVER_RESPONSE(None, data)
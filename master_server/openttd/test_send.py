@@ -0,0 +1,25 @@
+import ipaddress
+import pytest
+
+from .protocol.enums import SLTType
+from .send import OpenTTDProtocolSend
+
+
+@pytest.mark.parametrize(
+    "slt, servers, result",
+    [
+        (SLTType.SLT_IPv4, [], b"\x06\x00\x07\x01\x00\x00"),
+        (
+            SLTType.SLT_IPv4,
+            [{"ip": ipaddress.IPv4Address("1.2.3.4"), "port": 0x1234}],
+            b"\x0c\x00\x07\x01\x01\x00\x01\x02\x03\x04\x34\x12",
+        ),
+        (
+            SLTType.SLT_IPv6,
+            [{"ip": ipaddress.IPv6Address("::1"), "port": 0x1234}],
+            b"\x18\x00\x07\x02\x01\x00" + b"\x00" * 15 + b"\x01\x34\x12",
+        ),
+    ],
+)
+def test_encode_PACKET_UDP_MASTER_RESPONSE_LIST(slt, servers, result):
+    assert OpenTTDProtocolSend.encode_PACKET_UDP_MASTER_RESPONSE_LIST(slt, servers) == result
@@ -0,0 +1,146 @@
+import asyncio
+import pytest
+
+from .socks import (
+    parse_socks_udp_header,
+    SocksPool,
+)
+
+
+@pytest.mark.parametrize(
+    "data, result",
+    [
+        (b"\x00\x00\x00\x01\x7f\x00\x00\x01\x0f\x8bdata", (("127.0.0.1", 3979), b"data")),
+        (b"\x00\x00\x00\x04" + b"\x00" * 15 + b"\x01\x0f\x8bdata", (("::1", 3979), b"data")),
+        (b"\x00\x00\x00\x03\x09localhost\x0f\x8bdata", (("localhost", 3979), b"data")),
+        # No SOCKS header.
+        (b"\x03\x00\x00", None),
+        # Invalid address type.
+        (b"\x00\x00\x00\x02\x7f\x00\x00\x01\x0f\x8bdata", None),
+        # Too short.
+        (b"\x00\x00\x00\x01\x7f\x00\x00\x01\x0f", None),
+        (b"\x00\x00\x00\x04\x00\x00", None),
+    ],
+)
+def test_parse_socks_udp_header(data, result):
+    assert parse_socks_udp_header(data) == result
+
+
+class Relay(asyncio.DatagramProtocol):
+    """Minimal SOCKS5 UDP relay, answering every datagram on behalf of its destination."""
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.sources = set()
+
+    def datagram_received(self, data, addr):
+        self.sources.add(addr)
+        (host, port), payload = parse_socks_udp_header(data)
+        self.transport.sendto(b"\x00\x00\x00\x01\x7f\x00\x00\x01" + port.to_bytes(2, "big") + payload[::-1], addr)
+
+
+@pytest.mark.parametrize("size", [2, 0])
+def test_socks_pool(size):
+    received = []
+
+    async def run():
+        transport, relay = await asyncio.get_event_loop().create_datagram_endpoint(Relay, local_addr=("127.0.0.1", 0))
+        port = transport.get_extra_info("sockname")[1]
+
+        pool = SocksPool(f"socks5://127.0.0.1:{port}", lambda data, addr: received.append((data, addr)))
+        pool.size = size
+        for i in range(4):
+            pool.sendto(b"data", ("127.0.0.1", 4000 + i))
+
+        while len(received) < 4:
+            await asyncio.sleep(0.01)
+
+        transport.close()
+        return relay
+
+    relay = asyncio.run(asyncio.wait_for(run(), 5))
+
+    assert sorted(received) == [(b"atad", ("127.0.0.1", 4000 + i)) for i in range(4)]
+    assert len(relay.sources) == (size or 4)
+
+
+class StrippingRelay(Relay):
+    """SOCKS5 UDP relay that, like pproxy, answers without SOCKS header."""
+
+    def datagram_received(self, data, addr):
+        self.sources.add(addr)
+        (host, port), payload = parse_socks_udp_header(data)
+        self.transport.sendto(payload[::-1], addr)
+
+
+def test_socks_pool_without_header():
+    received = []
+
+    async def run():
+        transport, relay = await asyncio.get_event_loop().create_datagram_endpoint(
+            StrippingRelay, local_addr=("127.0.0.1", 0)
+        )
+        port = transport.get_extra_info("sockname")[1]
+
+        pool = SocksPool(f"socks5://127.0.0.1:{port}", lambda data, addr: received.append((data, addr)))
+        pool.size = 2
+
+        # The answer to this query cannot be matched to its server, but
+        # makes the pool stop pooling.
+        pool.sendto(b"data", ("127.0.0.1", 4000))
+        while pool.size != 0:
+            await asyncio.sleep(0.01)
+
+        for i in range(4):
+            pool.sendto(b"data", ("127.0.0.1", 4001 + i))
+
+        while len(received) < 4:
+            await asyncio.sleep(0.01)
+
+        transport.close()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+    assert sorted(received) == [(b"atad", ("127.0.0.1", 4001 + i)) for i in range(4)]
+
+
+class SilentRelay(Relay):
+    """SOCKS5 UDP relay to servers that never answer."""
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.received = 0
+
+    def datagram_received(self, data, addr):
+        self.sources.add(addr)
+        self.received += 1
+
+
+def test_socks_pool_single_reused():
+    async def run():
+        transport, relay = await asyncio.get_event_loop().create_datagram_endpoint(
+            SilentRelay, local_addr=("127.0.0.1", 0)
+        )
+        port = transport.get_extra_info("sockname")[1]
+
+        pool = SocksPool(f"socks5://127.0.0.1:{port}", lambda data, addr: None)
+        pool.size = 0
+
+        # Retries to the same server go over the same association.
+        pool.sendto(b"data", ("127.0.0.1", 4000))
+        pool.sendto(b"data", ("127.0.0.1", 4001))
+        pool.sendto(b"data", ("127.0.0.1", 4000))
+        while relay.received < 3:
+            await asyncio.sleep(0.01)
+        assert len(relay.sources) == 2
+
+        # Once the query is done, its association is closed.
+        association = pool._singles[("127.0.0.1", 4000)][0]
+        pool.close(("127.0.0.1", 4000))
+        assert association.closed
+        assert list(pool._singles) == [("127.0.0.1", 4001)]
+
+        pool.close(("127.0.0.1", 4001))
+        transport.close()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
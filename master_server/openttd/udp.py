@@ -1,7 +1,6 @@
 import asyncio
 import click
 import logging
-import pproxy
 
 from openttd_helpers import click_helper
 
@@ -12,35 +11,33 @@ from .protocol.exceptions import (
 from .protocol.source import Source
 from .receive import OpenTTDProtocolReceive
 from .send import OpenTTDProtocolSend
+from .socks import SocksPool
 
 log = logging.getLogger(__name__)
 
 
-class SocksProtocol(asyncio.DatagramProtocol):
-    def __init__(self, data, callback):
-        self._data = data
-        self._callback = callback
-
-    def connection_made(self, transport):
-        transport.sendto(self._data)
-
-    def datagram_received(self, data, addr):
-        self._callback(data)
-
-
 class OpenTTDProtocolUDP(asyncio.DatagramProtocol, OpenTTDProtocolReceive, OpenTTDProtocolSend):
     proxy_protocol = False
     socks_proxy = None
 
-    def __init__(self, callback_class):
-        super().__init__()
+    def __init__(self, callback_class, packet_queue=None, rate_limiter=None):
+        # The dispatch table is built on construction, and needs to know
+        # the callback class.
         self._callback = callback_class
+        super().__init__()
+        self._packet_queue = packet_queue
+        self._rate_limiter = rate_limiter
+
+        # The protocol to send server queries from; the answer to a query
+        # arrives on the socket the query was sent from.
+        self.query_protocol = self
         self._callback.protocol = self
         self.is_ipv6 = None
 
         if self.socks_proxy:
-            self._socks_conn = pproxy.Connection(self.socks_proxy)
-            self._socks_addr = (self._socks_conn.host_name, self._socks_conn.port)
+            self._socks_pool = SocksPool(
+                self.socks_proxy, lambda data, addr: self.datagram_received(data, addr, is_socks=True)
+            )
 
     def connection_made(self, transport):
         self.transport = transport
@@ -75,6 +72,12 @@ class OpenTTDProtocolUDP(asyncio.DatagramProtocol, OpenTTDProtocolReceive, OpenT
 
         return source, data
 
+    def get_packet_handler(self, type):
+        handler = getattr(self._callback, f"receive_{type.name}", None)
+        if handler is None:
+            return None
+        return type, handler
+
     async def guard(self, coro):
         try:
             await coro
@@ -88,32 +91,38 @@ class OpenTTDProtocolUDP(asyncio.DatagramProtocol, OpenTTDProtocolReceive, OpenT
             log.exception("Error detecting PROXY protocol %r: %r", socket_addr, err)
             return
 
+        if self._rate_limiter is not None and self._rate_limiter.is_banned(source.ip):
+            return
+
         try:
-            type, kwargs = self.receive_packet(source, data)
+            (type, handler), kwargs = self.receive_packet(source, data)
         except PacketInvalid as err:
             log.info("Dropping invalid packet from %r: %r", source, err)
             return
 
-        asyncio.create_task(self.guard(getattr(self._callback, f"receive_{type.name}")(source, **kwargs)))
+        if self._rate_limiter is not None and not self._rate_limiter.allow(type, source.ip):
+            return
+
+        if self._packet_queue is None:
+            asyncio.create_task(self.guard(handler(source, **kwargs)))
+            return
+
+        self._packet_queue.put(type, handler, source, kwargs)
 
     def error_received(self, exc):
         print("error on socket: ", exc)
 
     def send_packet(self, socket_addr, data, new_connection=False):
         if self.socks_proxy and new_connection:
-            # Modify the packet to have a SOCKS header with relay information.
-            data = self._socks_conn.udp_prepare_connection(socket_addr[0], socket_addr[1], data)
-
-            response = asyncio.Future()
-            protocol = SocksProtocol(data, response.set_result)
-
-            # Prepare the coroutine to fire the packet. It is up to the caller
-            # to await the results
-            request = asyncio.get_event_loop().create_datagram_endpoint(lambda: protocol, remote_addr=self._socks_addr)
-            return request, response
+            self._socks_pool.sendto(data, socket_addr)
+            return
 
         self.transport.sendto(data, socket_addr)
-        return None, None
+
+    def close_connection(self, socket_addr):
+        """Release what was set up for packets sent with new_connection to this address."""
+        if self.socks_proxy:
+            self._socks_pool.close(socket_addr)
 
 
 @click_helper.extend
@@ -127,6 +136,16 @@ class OpenTTDProtocolUDP(asyncio.DatagramProtocol, OpenTTDProtocolReceive, OpenT
     "--socks-proxy",
     help="Use a SOCKS proxy to query game servers.",
 )
-def click_proxy_protocol(proxy_protocol, socks_proxy):
+@click.option(
+    "--socks-pool-size",
+    help="Amount of UDP associations with the SOCKS proxy to reuse for queries; 0 uses a new association for every "
+    "query. Pooling requires the proxy to relay the source address of answers (RFC 1928), which for example pproxy "
+    "does not do.",
+    default=0,
+    show_default=True,
+    metavar="COUNT",
+)
+def click_proxy_protocol(proxy_protocol, socks_proxy, socks_pool_size):
     OpenTTDProtocolUDP.proxy_protocol = proxy_protocol
     OpenTTDProtocolUDP.socks_proxy = socks_proxy
+    SocksPool.size = socks_pool_size
@@ -0,0 +1,60 @@
+import logging
+import os
+import signal
+import sys
+
+log = logging.getLogger(__name__)
+
+# Which worker this process is, and how many workers there are in total.
+# Only set after fork_workers() returned.
+worker_index = 0
+worker_count = 1
+
+
+def fork_workers(count):
+    """
+    Fork into "count" worker processes.
+
+    This returns in every worker, with worker_index set. The original process
+    stays behind to supervise the workers: signals are forwarded to them, and
+    if one of them stops, all of them are stopped, after which the original
+    process exits with the same exit code. This function never returns in
+    the original process.
+
+    This has to be called before any event loop or (database) connection is
+    created, as those cannot be shared between processes.
+    """
+    global worker_index, worker_count
+
+    worker_count = count
+    if count <= 1:
+        return
+
+    pids = {}
+    for index in range(count):
+        pid = os.fork()
+        if pid == 0:
+            worker_index = index
+            return
+        pids[pid] = index
+
+    def forward_signal(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward_signal)
+    signal.signal(signal.SIGINT, forward_signal)
+
+    pid, status = os.wait()
+    exit_code = os.waitstatus_to_exitcode(status)
+    log.info("Worker %d stopped with exit code %d; stopping all workers ...", pids.pop(pid), exit_code)
+
+    forward_signal(signal.SIGTERM, None)
+    while pids:
+        pid, _ = os.wait()
+        pids.pop(pid, None)
+
+    sys.exit(exit_code)